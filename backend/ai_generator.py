@@ -1,5 +1,120 @@
 import anthropic
-from typing import List, Optional, Dict, Any
+import httpx
+import logging
+import orjson
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Iterator, Tuple
+from search_tools import ToolError, ToolManager
+
+logger = logging.getLogger(__name__)
+
+# Role prefixes used by SessionManager when formatting conversation history
+HISTORY_ROLE_PREFIXES = {"User: ": "user", "Assistant: ": "assistant"}
+
+# Fallback error detection for tool managers other than ToolManager, whose
+# results can't be told apart from content that merely mentions "not found"
+_NOT_FOUND_PATTERN = re.compile(r"not found", re.IGNORECASE)
+
+# Shared pool for running independent tool calls from one response concurrently
+_TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool-call")
+
+
+@dataclass(frozen=True)
+class _TextBlock:
+    """Text content block of an answer joined from a capped call and its continuation"""
+    text: str
+    type: str = "text"
+
+
+@dataclass(frozen=True)
+class _JoinedResponse:
+    """Text-only stand-in for a Claude response; never sent back to the API"""
+    content: List[_TextBlock]
+    stop_reason: str
+
+
+class _OrjsonHttpxClient(anthropic.DefaultHttpxClient):
+    """
+    SDK-default httpx client that serializes JSON request bodies with orjson.
+
+    Requests replay history and tool results on every round, so body encoding
+    grows with the conversation; orjson is considerably faster than the
+    stdlib encoder httpx uses for ``json=``.
+    """
+
+    def build_request(self, method, url, *, content=None, json=None, headers=None, **kwargs):
+        if json is not None and content is None:
+            content = orjson.dumps(json)
+            json = None
+            headers = httpx.Headers(headers)
+            headers.setdefault("Content-Type", "application/json")
+        return super().build_request(method, url, content=content, json=json, headers=headers, **kwargs)
+
+
+@lru_cache(maxsize=16)
+def _build_system_blocks(system_prompt: str, max_rounds: int) -> List[Dict[str, Any]]:
+    """
+    Build the cached system content blocks for a given round limit.
+
+    The prompt and round guidance only vary with max_rounds, so the same
+    block list is reused across queries and the cached prefix stays
+    byte-identical. Callers must treat the returned list as read-only.
+
+    Args:
+        system_prompt: Static system prompt text
+        max_rounds: Maximum tool calling rounds
+
+    Returns:
+        List of system content blocks
+    """
+    round_guidance = f"\nTool Round Limits: You have up to {max_rounds} opportunities to use tools in this conversation. Use them strategically to gather the most relevant information."
+
+    return [{
+        "type": "text",
+        "text": f"{system_prompt}{round_guidance}",
+        "cache_control": {"type": "ephemeral"}
+    }]
+
+
+def _parse_conversation_history(conversation_history: str) -> List[Dict[str, Any]]:
+    """
+    Parse formatted history ("User: ..." / "Assistant: ..." lines) into messages.
+
+    Lines without a role prefix are treated as continuations of the previous
+    message, and consecutive turns with the same role are merged so the
+    result always alternates as the Messages API expects.
+
+    Args:
+        conversation_history: History string produced by SessionManager
+
+    Returns:
+        List of message dictionaries, oldest first
+    """
+    messages = []
+
+    for line in conversation_history.split("\n"):
+        role = None
+        for prefix, prefix_role in HISTORY_ROLE_PREFIXES.items():
+            if line.startswith(prefix):
+                role = prefix_role
+                line = line[len(prefix):]
+                break
+
+        if messages and role in (None, messages[-1]["role"]):
+            # Continuation of a multi-line message or a same-role turn
+            messages[-1]["content"] += f"\n{line}"
+        else:
+            messages.append({"role": role or "user", "content": line})
+
+    # Conversations must start with a user turn
+    if messages and messages[0]["role"] == "assistant":
+        messages.insert(0, {"role": "user", "content": "(earlier conversation)"})
+
+    return messages
+
 
 class AIGenerator:
     """Handles interactions with Anthropic's Claude API for generating responses"""
@@ -38,9 +153,21 @@ All responses must be:
 Provide only the direct answer to what was asked.
 """
     
-    def __init__(self, api_key: str, model: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    # Fallback answer when tool execution fails; never stored in the response cache
+    TOOL_FAILURE_MESSAGE = "I encountered an issue accessing the course materials. Please try rephrasing your question."
+
+    # Beta header that shrinks tool-use output tokens on Claude 3.7 Sonnet
+    # (Claude 4 models have token-efficient tool use built in)
+    TOKEN_EFFICIENT_TOOLS_HEADERS = {"anthropic-beta": "token-efficient-tools-2025-02-19"}
+
+    # Output cap for the opening tool round, where Claude usually just emits a
+    # short tool_use block; later rounds and the final call keep the full budget
+    TOOL_ROUND_MAX_TOKENS = 256
+
+    def __init__(self, api_key: str, model: str, response_cache=None):
+        self.client = anthropic.Anthropic(api_key=api_key, http_client=_OrjsonHttpxClient())
         self.model = model
+        self.response_cache = response_cache
         
         # Pre-build base API parameters
         self.base_params = {
@@ -48,12 +175,21 @@ Provide only the direct answer to what was asked.
             "temperature": 0,
             "max_tokens": 800
         }
+
+        self._use_token_efficient_tools = self.model.startswith("claude-3-7")
+
+        # Shared request fragments reused across rounds instead of rebuilt per call
+        self._tool_choice = {"type": "auto"}
+        # (caller's tools list, marked copy), replaced as one tuple so
+        # concurrent requests never see a mismatched pair
+        self._tools_memo = (None, None)
     
     def generate_response(self, query: str,
                          conversation_history: Optional[str] = None,
                          tools: Optional[List] = None,
                          tool_manager=None,
-                         max_rounds: int = 2) -> str:
+                         max_rounds: int = 2,
+                         cache: bool = True) -> str:
         """
         Generate AI response with sequential tool calling support.
 
@@ -63,76 +199,98 @@ Provide only the direct answer to what was asked.
             tools: Available tools the AI can use
             tool_manager: Manager to execute tools
             max_rounds: Maximum number of tool calling rounds (default: 2)
+            cache: Whether to use the semantic response cache (default: True)
 
         Returns:
             Generated response as string
         """
 
+        # Return a previous answer for a near-duplicate query in the same context
+        cache_key, cached_response = self._lookup_cached_response(query, conversation_history, tools, cache)
+        if cached_response is not None:
+            return cached_response
+
         # Initialize conversation state
         messages = self._initialize_conversation(query, conversation_history)
-        system_content = self._build_system_content(conversation_history, max_rounds)
+        system_content = self._build_system_content(max_rounds)
 
         # Execute sequential rounds
-        return self._execute_sequential_rounds(
+        response = self._execute_sequential_rounds(
             messages=messages,
             system_content=system_content,
             tools=tools,
             tool_manager=tool_manager,
             max_rounds=max_rounds
         )
-    
-    def _handle_tool_execution(self, initial_response, base_params: Dict[str, Any], tool_manager):
+
+        self._store_cached_response(query, cache_key, response)
+
+        return response
+
+    def generate_response_stream(self, query: str,
+                                 conversation_history: Optional[str] = None,
+                                 tools: Optional[List] = None,
+                                 tool_manager=None,
+                                 max_rounds: int = 2,
+                                 cache: bool = True) -> Iterator[str]:
         """
-        Handle execution of tool calls and get follow-up response.
-        
+        Generate AI response as a stream of text deltas.
+
+        Mirrors generate_response and yields the same answer text; rounds are
+        streamed so callers can render the answer as its tokens arrive.
+
         Args:
-            initial_response: The response containing tool use requests
-            base_params: Base API parameters
+            query: The user's question or request
+            conversation_history: Previous messages for context
+            tools: Available tools the AI can use
             tool_manager: Manager to execute tools
-            
+            max_rounds: Maximum number of tool calling rounds (default: 2)
+            cache: Whether to use the semantic response cache (default: True)
+
+        Yields:
+            Response text deltas
+        """
+        cache_key, cached_response = self._lookup_cached_response(query, conversation_history, tools, cache)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        messages = self._initialize_conversation(query, conversation_history)
+        system_content = self._build_system_content(max_rounds)
+
+        text_chunks = []
+        for text in self._stream_sequential_rounds(messages, system_content, tools, tool_manager, max_rounds):
+            text_chunks.append(text)
+            yield text
+
+        self._store_cached_response(query, cache_key, "".join(text_chunks))
+
+    def _lookup_cached_response(self, query: str, conversation_history: Optional[str],
+                                tools: Optional[List], cache: bool):
+        """
+        Look up a cached response for the query.
+
         Returns:
-            Final response text after tool execution
+            Tuple of (cache key or None when caching is off, cached response or None)
         """
-        # Start with existing messages
-        messages = base_params["messages"].copy()
-        
-        # Add AI's tool use response
-        messages.append({"role": "assistant", "content": initial_response.content})
-        
-        # Execute all tool calls and collect results
-        tool_results = []
-        for content_block in initial_response.content:
-            if content_block.type == "tool_use":
-                tool_result = tool_manager.execute_tool(
-                    content_block.name, 
-                    **content_block.input
-                )
-                
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": content_block.id,
-                    "content": tool_result
-                })
-        
-        # Add tool results as single message
-        if tool_results:
-            messages.append({"role": "user", "content": tool_results})
-        
-        # Prepare final API call without tools
-        final_params = {
-            **self.base_params,
-            "messages": messages,
-            "system": base_params["system"]
-        }
-        
-        # Get final response
-        final_response = self.client.messages.create(**final_params)
-        return final_response.content[0].text
+        if not cache or self.response_cache is None:
+            return None, None
 
+        cache_key = self.response_cache.make_key(conversation_history, tools)
+        return cache_key, self.response_cache.get(query, cache_key)
+
+    def _store_cached_response(self, query: str, cache_key: Optional[str], response: str):
+        """Store a successful response in the cache when caching is on"""
+        if cache_key is not None and response and response != self.TOOL_FAILURE_MESSAGE:
+            self.response_cache.put(query, cache_key, response)
+    
     def _initialize_conversation(self, query: str, conversation_history: Optional[str]) -> List[Dict[str, Any]]:
         """
         Initialize the conversation messages array.
 
+        Prior turns are replayed as messages rather than folded into the
+        system prompt, keeping the cached system prefix identical across users.
+
         Args:
             query: The user's current question
             conversation_history: Previous conversation context
@@ -142,35 +300,30 @@ Provide only the direct answer to what was asked.
         """
         messages = []
 
-        # For now, just add the current user query
-        # Conversation history is handled in system content
-        messages.append({"role": "user", "content": query})
+        if conversation_history:
+            messages = _parse_conversation_history(conversation_history)
+
+        # Add the current user query, merging if history ended on a user turn
+        if messages and messages[-1]["role"] == "user":
+            messages[-1]["content"] += f"\n\n{query}"
+        else:
+            messages.append({"role": "user", "content": query})
 
         return messages
 
-    def _build_system_content(self, conversation_history: Optional[str], max_rounds: int) -> str:
+    def _build_system_content(self, max_rounds: int) -> List[Dict[str, Any]]:
         """
-        Build system content with round-specific guidance.
+        Build system content blocks with round-specific guidance.
 
         Args:
-            conversation_history: Previous conversation context
             max_rounds: Maximum tool calling rounds
 
         Returns:
-            Complete system content string
+            List of system content blocks
         """
-        base_content = self.SYSTEM_PROMPT
-
-        # Add round-specific guidance
-        round_guidance = f"\nTool Round Limits: You have up to {max_rounds} opportunities to use tools in this conversation. Use them strategically to gather the most relevant information."
+        return _build_system_blocks(self.SYSTEM_PROMPT, max_rounds)
 
-        # Add conversation history
-        if conversation_history:
-            return f"{base_content}{round_guidance}\n\nPrevious conversation:\n{conversation_history}"
-        else:
-            return f"{base_content}{round_guidance}"
-
-    def _execute_sequential_rounds(self, messages: List[Dict[str, Any]], system_content: str,
+    def _execute_sequential_rounds(self, messages: List[Dict[str, Any]], system_content: List[Dict[str, Any]],
                                   tools: Optional[List], tool_manager,
                                   max_rounds: int) -> str:
         """
@@ -183,7 +336,7 @@ Provide only the direct answer to what was asked.
 
         Args:
             messages: Current conversation messages
-            system_content: System prompt content
+            system_content: System prompt content blocks
             tools: Available tools
             tool_manager: Manager to execute tools
             max_rounds: Maximum number of rounds
@@ -191,11 +344,18 @@ Provide only the direct answer to what was asked.
         Returns:
             Final response text
         """
+        if not tools:
+            # No tools offered - a single call answers directly
+            return self._make_claude_api_call(messages, system_content).content[0].text
+
         current_round = 0
 
         while current_round < max_rounds:
             # Make API call to Claude
-            response = self._make_claude_api_call(messages, system_content, tools)
+            # Only the opening round is expected to be a tool call; later rounds
+            # follow tool results and usually carry the answer, so stay uncapped
+            response = self._make_claude_api_call(messages, system_content, tools,
+                                                  cap_output=current_round == 0)
 
             # Check termination conditions
             if response.stop_reason != "tool_use":
@@ -206,14 +366,17 @@ Provide only the direct answer to what was asked.
                 # No tool manager available - return response
                 return response.content[0].text
 
+            # Index content blocks once for the helpers below
+            tool_blocks, text_blocks = self._split_content(response)
+
             # Execute tools and update conversation
             tool_execution_success = self._execute_tools_and_update_messages(
-                response, messages, tool_manager
+                response, tool_blocks, messages, tool_manager
             )
 
             if not tool_execution_success:
                 # Tool execution failed - terminate with error handling
-                return self._handle_tool_failure(response)
+                return self._handle_tool_failure(text_blocks)
 
             current_round += 1
 
@@ -221,19 +384,61 @@ Provide only the direct answer to what was asked.
         final_response = self._make_claude_api_call(messages, system_content, tools=None)
         return final_response.content[0].text
 
-    def _make_claude_api_call(self, messages: List[Dict[str, Any]], system_content: str,
-                             tools: Optional[List] = None):
+    def _make_claude_api_call(self, messages: List[Dict[str, Any]], system_content: List[Dict[str, Any]],
+                             tools: Optional[List] = None, cap_output: bool = False):
         """
         Make a single API call to Claude.
 
         Args:
             messages: Conversation messages
-            system_content: System prompt
+            system_content: System prompt content blocks
             tools: Available tools (optional)
+            cap_output: Use TOOL_ROUND_MAX_TOKENS for a round expected to call a tool
 
         Returns:
             Claude API response
         """
+        api_params = self._build_api_params(messages, system_content, tools)
+
+        if not tools or not cap_output:
+            return self.client.messages.create(**api_params)
+
+        # Capped rounds run with a tight output cap; if Claude answers directly
+        # and hits the cap, continue its answer with the rest of the budget
+        response = self.client.messages.create(**{**api_params, "max_tokens": self.TOOL_ROUND_MAX_TOKENS})
+        if response.stop_reason != "max_tokens":
+            return response
+
+        partial = "".join(block.text for block in response.content if block.type == "text").rstrip()
+        if not partial or any(block.type != "text" for block in response.content):
+            # A cut-off tool call can't be continued - regenerate it in full
+            return self.client.messages.create(**api_params)
+
+        # Prefill the partial answer (no trailing whitespace allowed) so Claude picks up where it stopped
+        continuation = self.client.messages.create(**{
+            **api_params,
+            "messages": messages + [{"role": "assistant", "content": partial}],
+            "max_tokens": api_params["max_tokens"] - self.TOOL_ROUND_MAX_TOKENS
+        })
+        if continuation.stop_reason == "tool_use":
+            return continuation
+
+        rest = "".join(block.text for block in continuation.content if block.type == "text")
+        return _JoinedResponse(content=[_TextBlock(partial + rest)], stop_reason=continuation.stop_reason)
+
+    def _build_api_params(self, messages: List[Dict[str, Any]], system_content: List[Dict[str, Any]],
+                          tools: Optional[List] = None) -> Dict[str, Any]:
+        """
+        Build Messages API parameters for a single call.
+
+        Args:
+            messages: Conversation messages
+            system_content: System prompt content blocks
+            tools: Available tools (optional)
+
+        Returns:
+            Keyword arguments for messages.create / messages.stream
+        """
         api_params = {
             **self.base_params,
             "messages": messages,
@@ -241,18 +446,139 @@ Provide only the direct answer to what was asked.
         }
 
         if tools:
-            api_params["tools"] = tools
-            api_params["tool_choice"] = {"type": "auto"}
+            api_params["tools"] = self._get_cached_tools(tools)
+            api_params["tool_choice"] = self._tool_choice
+
+            if self._use_token_efficient_tools:
+                api_params["extra_headers"] = self.TOKEN_EFFICIENT_TOOLS_HEADERS
+
+        return api_params
+
+    def _get_cached_tools(self, tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Return the tool list with a cache breakpoint on its last entry.
 
-        return self.client.messages.create(**api_params)
+        The marked copy is reused while the caller keeps passing the same
+        tools list, so every round of a query sends the identical object.
+
+        Args:
+            tools: Tool definitions from the caller (never mutated)
+
+        Returns:
+            Tool definitions with cache_control on the last tool
+        """
+        memo_tools, cached_tools = self._tools_memo
+        if tools is not memo_tools:
+            # Mark the last tool so the whole tool schema list is cached too
+            cached_tools = list(tools)
+            cached_tools[-1] = {**cached_tools[-1], "cache_control": {"type": "ephemeral"}}
+            self._tools_memo = (tools, cached_tools)
+
+        return cached_tools
+
+    def _stream_claude_api_call(self, messages: List[Dict[str, Any]], system_content: List[Dict[str, Any]],
+                                tools: Optional[List] = None):
+        """
+        Make a single streaming API call to Claude.
 
-    def _execute_tools_and_update_messages(self, response, messages: List[Dict[str, Any]],
+        Yields:
+            Text deltas as they arrive
+
+        Returns:
+            The final accumulated Claude API message
+        """
+        api_params = self._build_api_params(messages, system_content, tools)
+
+        with self.client.messages.stream(**api_params) as stream:
+            for text in stream.text_stream:
+                yield text
+            return stream.get_final_message()
+
+    def _stream_sequential_rounds(self, messages: List[Dict[str, Any]], system_content: List[Dict[str, Any]],
+                                  tools: Optional[List], tool_manager,
+                                  max_rounds: int) -> Iterator[str]:
+        """
+        Streaming counterpart of _execute_sequential_rounds.
+
+        Text from rounds that offer tools is held back until the round ends,
+        so preamble written before a tool_use block ("Let me search...") is
+        never emitted; the answer text matches generate_response. The final
+        tool-less call streams as it arrives.
+
+        Yields:
+            Response text deltas
+        """
+        if not tools:
+            yield from self._stream_claude_api_call(messages, system_content)
+            return
+
+        current_round = 0
+
+        while current_round < max_rounds:
+            text_chunks, response = self._collect_stream(
+                self._stream_claude_api_call(messages, system_content, tools)
+            )
+
+            if response.stop_reason != "tool_use" or not tool_manager:
+                # Claude answered in this round - release the held-back text
+                yield from text_chunks
+                return
+
+            tool_blocks, text_blocks = self._split_content(response)
+
+            if not self._execute_tools_and_update_messages(response, tool_blocks, messages, tool_manager):
+                yield self._handle_tool_failure(text_blocks)
+                return
+
+            current_round += 1
+
+        # Max rounds reached - stream final call without tools for summary
+        yield from self._stream_claude_api_call(messages, system_content, tools=None)
+
+    @staticmethod
+    def _collect_stream(stream: Iterator[str]) -> Tuple[List[str], Any]:
+        """
+        Drain a _stream_claude_api_call generator without yielding.
+
+        Returns:
+            Tuple of (text deltas, final Claude API message)
+        """
+        text_chunks = []
+        while True:
+            try:
+                text_chunks.append(next(stream))
+            except StopIteration as stop:
+                return text_chunks, stop.value
+
+    @staticmethod
+    def _split_content(response) -> Tuple[List[Any], List[Any]]:
+        """
+        Partition response content into tool_use and text blocks in one pass.
+
+        Args:
+            response: Claude API response
+
+        Returns:
+            Tuple of (tool_use blocks, text blocks) in original order
+        """
+        tool_blocks = []
+        text_blocks = []
+        for content_block in response.content:
+            if content_block.type == "tool_use":
+                tool_blocks.append(content_block)
+            elif content_block.type == "text":
+                text_blocks.append(content_block)
+        return tool_blocks, text_blocks
+
+    def _execute_tools_and_update_messages(self, response, tool_blocks: List[Any],
+                                          messages: List[Dict[str, Any]],
                                           tool_manager) -> bool:
         """
         Execute tools from Claude's response and update messages array.
 
         Args:
             response: Claude API response containing tool use
+            tool_blocks: The response's tool_use blocks, from _split_content
             messages: Conversation messages to update
             tool_manager: Manager to execute tools
 
@@ -263,24 +589,34 @@ Provide only the direct answer to what was asked.
             # Add Claude's tool use response to messages
             messages.append({"role": "assistant", "content": response.content})
 
-            # Execute all tool calls
+            # Execute all tool calls, concurrently when Claude requested several
+            def run_tool(block):
+                return tool_manager.execute_tool(block.name, **block.input)
+
+            if len(tool_blocks) > 1:
+                tool_outputs = list(_TOOL_EXECUTOR.map(run_tool, tool_blocks))
+                if isinstance(tool_manager, ToolManager):
+                    # Keep every call's sources, in block order, not just the last to finish
+                    tool_manager.record_sources(tool_outputs)
+            else:
+                tool_outputs = [run_tool(block) for block in tool_blocks]
+
+            # Results keep the order of the original tool_use blocks
             tool_results = []
-            for content_block in response.content:
-                if content_block.type == "tool_use":
-                    tool_result = tool_manager.execute_tool(
-                        content_block.name,
-                        **content_block.input
-                    )
-
-                    # Check for tool execution errors
-                    if isinstance(tool_result, str) and "not found" in tool_result.lower():
-                        return False
-
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": content_block.id,
-                        "content": tool_result
-                    })
+            for content_block, tool_result in zip(tool_blocks, tool_outputs):
+                # Check for tool execution errors
+                if isinstance(tool_result, ToolError):
+                    return False
+                if (not isinstance(tool_manager, ToolManager) and isinstance(tool_result, str)
+                        and _NOT_FOUND_PATTERN.search(tool_result)):
+                    # Other managers can't signal ToolError, so fall back to the text
+                    return False
+
+                tool_results.append({
+                    "type": "tool_result",
+                    "tool_use_id": content_block.id,
+                    "content": tool_result
+                })
 
             # Add tool results as single message
             if tool_results:
@@ -288,27 +624,21 @@ Provide only the direct answer to what was asked.
 
             return True
 
-        except Exception as e:
-            print(f"Tool execution error: {e}")
+        except Exception:
+            logger.exception("Tool execution error")
             return False
 
-    def _handle_tool_failure(self, response) -> str:
+    def _handle_tool_failure(self, text_blocks: List[Any]) -> str:
         """
         Handle tool execution failures gracefully.
 
         Args:
-            response: Claude API response that had tool failures
+            text_blocks: Text blocks of the response that had tool failures
 
         Returns:
             Fallback response text
         """
-        # Extract any text content from the response
-        text_content = []
-        for content_block in response.content:
-            if content_block.type == "text":
-                text_content.append(content_block.text)
-
-        if text_content:
-            return " ".join(text_content)
+        if text_blocks:
+            return " ".join(content_block.text for content_block in text_blocks)
         else:
-            return "I encountered an issue accessing the course materials. Please try rephrasing your question."
\ No newline at end of file
+            return self.TOOL_FAILURE_MESSAGE
\ No newline at end of file
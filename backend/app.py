@@ -5,15 +5,21 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Dict, Any
+import logging
+import orjson
 import os
 
 from config import config
 from rag_system import RAGSystem
 
+# Handlers and levels are left to the entry point (uvicorn's log config)
+logger = logging.getLogger(__name__)
+
 # Initialize FastAPI app
-app = FastAPI(title="Course Materials RAG System", root_path="")
+app = FastAPI(title="Course Materials RAG System", root_path="", default_response_class=ORJSONResponse)
 
 # Add trusted host middleware for proxy
 app.add_middleware(
@@ -40,10 +46,17 @@ class QueryRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
 
+class SourceItem(BaseModel):
+    """A cited source; extra keys are passed through unchanged"""
+    model_config = ConfigDict(extra="allow")
+
+    text: str
+    link: Optional[str] = None
+
 class QueryResponse(BaseModel):
     """Response model for course queries"""
     answer: str
-    sources: List[Dict[str, Any]]
+    sources: List[SourceItem]
     session_id: str
 
 class CourseStats(BaseModel):
@@ -51,6 +64,14 @@ class CourseStats(BaseModel):
     total_courses: int
     course_titles: List[str]
 
+def format_sources(sources: List[Any]) -> List[Dict[str, Any]]:
+    """Ensure sources are in the {'text', 'link'} dict format the frontend expects"""
+    # Strings are wrapped for backward compatibility
+    return [
+        source if isinstance(source, dict) else {'text': str(source), 'link': None}
+        for source in sources
+    ]
+
 # API Endpoints
 
 @app.post("/api/query", response_model=QueryResponse)
@@ -65,27 +86,40 @@ async def query_documents(request: QueryRequest):
         # Process query using RAG system
         answer, sources = rag_system.query(request.query, session_id)
 
-        # Ensure sources are in the correct format
-        formatted_sources = []
-        for source in sources:
-            if isinstance(source, dict):
-                # Already in the correct format
-                formatted_sources.append(source)
-            else:
-                # Convert string to dict format for backward compatibility
-                formatted_sources.append({
-                    'text': str(source),
-                    'link': None
-                })
-
         return QueryResponse(
             answer=answer,
-            sources=formatted_sources,
+            sources=format_sources(sources),
             session_id=session_id
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/query/stream")
+async def query_documents_stream(request: QueryRequest):
+    """
+    Process a query and stream the answer as newline-delimited JSON events.
+
+    Emits {"type": "text", "text": ...} events as the answer is generated, then
+    {"type": "done", "sources": [...], "session_id": ...}, or {"type": "error",
+    "detail": ...} if processing fails after the stream has started.
+    """
+    session_id = request.session_id
+    if not session_id:
+        session_id = rag_system.session_manager.create_session()
+
+    def events():
+        try:
+            for event in rag_system.query_stream(request.query, session_id):
+                if event["type"] == "sources":
+                    event = {"type": "done", "sources": format_sources(event["sources"]), "session_id": session_id}
+                yield orjson.dumps(event) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so the failure only reaches the client as an event
+            logger.exception("Streaming query failed")
+            yield orjson.dumps({"type": "error", "detail": str(e)}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @app.get("/api/courses", response_model=CourseStats)
 async def get_course_stats():
     """Get course analytics and statistics"""
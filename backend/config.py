@@ -5,7 +5,7 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-@dataclass
+@dataclass(frozen=True)
 class Config:
     """Configuration settings for the RAG system"""
     # Anthropic API settings
@@ -20,6 +20,13 @@ class Config:
     CHUNK_OVERLAP: int = 100     # Characters to overlap between chunks
     MAX_RESULTS: int = 5         # Maximum search results to return
     MAX_HISTORY: int = 2         # Number of conversation messages to remember
+
+    # Response cache settings
+    RESPONSE_CACHE_SIZE: int = 256          # Maximum cached answers kept in memory
+    # Also serve near-duplicate questions by embedding distance; off by default
+    # since the threshold has not been tuned for the production embedding model
+    RESPONSE_CACHE_SEMANTIC: bool = False
+    RESPONSE_CACHE_THRESHOLD: float = 0.08  # Max cosine distance for a semantic hit
     
     # Database paths
     CHROMA_PATH: str = "./chroma_db"  # ChromaDB storage location
@@ -1,9 +1,10 @@
-from typing import List, Tuple, Optional, Dict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import os
 from document_processor import DocumentProcessor
 from vector_store import VectorStore
 from ai_generator import AIGenerator
 from session_manager import SessionManager
+from response_cache import SemanticResponseCache
 from search_tools import ToolManager, CourseSearchTool, CourseOutlineTool
 from models import Course, Lesson, CourseChunk
 
@@ -16,6 +17,12 @@ class RAGSystem:
         # Initialize core components
         self.document_processor = DocumentProcessor(config.CHUNK_SIZE, config.CHUNK_OVERLAP)
         self.vector_store = VectorStore(config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS)
+        # Exact repeats only, unless semantic matching is switched on
+        self.response_cache = SemanticResponseCache(
+            self.vector_store.embedding_function if config.RESPONSE_CACHE_SEMANTIC else None,
+            distance_threshold=config.RESPONSE_CACHE_THRESHOLD,
+            max_entries=config.RESPONSE_CACHE_SIZE
+        )
         self.ai_generator = AIGenerator(config.ANTHROPIC_API_KEY, config.ANTHROPIC_MODEL)
         self.session_manager = SessionManager(config.MAX_HISTORY)
         
@@ -45,6 +52,9 @@ class RAGSystem:
             
             # Add course content chunks to vector store
             self.vector_store.add_course_content(course_chunks)
+
+            # Cached answers may no longer reflect the catalog
+            self.response_cache.clear()
             
             return course, len(course_chunks)
         except Exception as e:
@@ -98,6 +108,10 @@ class RAGSystem:
                         print(f"Course already exists: {course.title} - skipping")
                 except Exception as e:
                     print(f"Error processing {file_name}: {e}")
+
+        # Cached answers may no longer reflect the catalog
+        if total_courses or clear_existing:
+            self.response_cache.clear()
         
         return total_courses, total_chunks
     
@@ -112,6 +126,70 @@ class RAGSystem:
         Returns:
             Tuple of (response, sources list - empty for tool-based approach)
         """
+        prompt, history, tools, cache_key, cached = self._prepare_query(query, session_id)
+
+        if cached is not None:
+            response, sources = cached
+        else:
+            # Generate response using AI with tools
+            response = self.ai_generator.generate_response(
+                query=prompt,
+                conversation_history=history,
+                tools=tools,
+                tool_manager=self.tool_manager
+            )
+            sources = self._finish_generation(query, cache_key, response)
+        
+        # Update conversation history
+        if session_id:
+            self.session_manager.add_exchange(session_id, query, response)
+        
+        # Return response with sources from tool searches
+        return response, sources
+
+    def query_stream(self, query: str, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Process a user query like query(), streaming the answer as it is generated.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+
+        Yields:
+            {"type": "text", "text": ...} events with answer text, then a single
+            {"type": "sources", "sources": [...]} event once the answer is complete
+        """
+        prompt, history, tools, cache_key, cached = self._prepare_query(query, session_id)
+
+        if cached is not None:
+            response, sources = cached
+            yield {"type": "text", "text": response}
+        else:
+            text_chunks = []
+            for text in self.ai_generator.generate_response_stream(
+                query=prompt,
+                conversation_history=history,
+                tools=tools,
+                tool_manager=self.tool_manager
+            ):
+                text_chunks.append(text)
+                yield {"type": "text", "text": text}
+
+            response = "".join(text_chunks)
+            sources = self._finish_generation(query, cache_key, response)
+
+        if session_id:
+            self.session_manager.add_exchange(session_id, query, response)
+
+        yield {"type": "sources", "sources": sources}
+
+    def _prepare_query(self, query: str, session_id: Optional[str]):
+        """
+        Build the prompt and context for a query and look it up in the response cache.
+
+        Returns:
+            Tuple of (prompt, history, tool definitions, cache key, cached (response, sources) or None)
+        """
         # Create prompt for the AI with clear instructions
         prompt = f"""Answer this question about course materials: {query}"""
         
@@ -119,27 +197,31 @@ class RAGSystem:
         history = None
         if session_id:
             history = self.session_manager.get_conversation_history(session_id)
-        
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
-            query=prompt,
-            conversation_history=history,
-            tools=self.tool_manager.get_tool_definitions(),
-            tool_manager=self.tool_manager
-        )
-        
+
+        tools = self.tool_manager.get_tool_definitions()
+
+        # Serve a repeated question from cache, sources included; lookups use the
+        # raw query so the shared prompt prefix doesn't make questions collide
+        cache_key = self.response_cache.make_key(history, tools)
+        return prompt, history, tools, cache_key, self.response_cache.get(query, cache_key)
+
+    def _finish_generation(self, query: str, cache_key: str, response: str) -> List[Dict[str, Any]]:
+        """
+        Collect the sources of a freshly generated response and cache both.
+
+        Returns:
+            Sources from the tool searches behind the response
+        """
         # Get sources from the search tool
         sources = self.tool_manager.get_last_sources()
 
         # Reset sources after retrieving them
         self.tool_manager.reset_sources()
-        
-        # Update conversation history
-        if session_id:
-            self.session_manager.add_exchange(session_id, query, response)
-        
-        # Return response with sources from tool searches
-        return response, sources
+
+        if response and response != self.ai_generator.TOOL_FAILURE_MESSAGE:
+            self.response_cache.put(query, cache_key, (response, list(sources)))
+
+        return sources
     
     def get_course_analytics(self) -> Dict:
         """Get analytics about the course catalog"""
@@ -0,0 +1,153 @@
+import hashlib
+import json
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+@dataclass
+class CacheEntry:
+    """A single cached answer with the embedding of the query that produced it"""
+    embedding: Optional[np.ndarray]  # Unit-normalized query embedding, None when semantic matching is off
+    key_hash: str                    # Hash of the context the answer depends on
+    answer: Any                      # Cached response, e.g. text or (text, sources)
+    exact_key: str = ""              # Normalized query text, for the exact-match fast path
+
+
+class SemanticResponseCache:
+    """
+    In-memory cache mapping repeated queries to previous answers.
+
+    Queries match exactly (up to case and surrounding whitespace). With an
+    embedding function, near-duplicate queries within the distance threshold
+    match too; without one, no query is ever embedded.
+    """
+
+    def __init__(self,
+                 embedding_function: Optional[Callable[[List[str]], Sequence[Any]]] = None,
+                 distance_threshold: float = 0.08,
+                 max_entries: int = 256):
+        self.embedding_function = embedding_function
+        self.distance_threshold = distance_threshold
+        self.entries: Deque[CacheEntry] = deque(maxlen=max_entries)  # Oldest first, for eviction
+
+        # Entries grouped by context key, so a lookup only scores queries asked in
+        # the same context; each group's stacked embeddings are memoized as an
+        # immutable (matrix, entries) snapshot, replaced whole on change
+        self._buckets: Dict[str, Deque[CacheEntry]] = {}
+        self._snapshots: Dict[str, Tuple[np.ndarray, Tuple[CacheEntry, ...]]] = {}
+
+        # Repeats of a cached question (up to case and surrounding whitespace)
+        # are answered without embedding the query
+        self._exact: Dict[Tuple[str, str], CacheEntry] = {}
+        self.hits = 0  # Lookups answered from cache, exact or semantic
+
+        # Single-slot (query, embedding) memo so a miss followed by put() embeds
+        # the query once; replaced as one tuple so concurrent callers stay consistent
+        self._last_embedded: Tuple[Optional[str], Optional[np.ndarray]] = (None, None)
+
+    @staticmethod
+    def make_key(conversation_history: Optional[str], tools: Optional[List[Dict[str, Any]]]) -> str:
+        """Hash the conversation history and available tool names into a cache key"""
+        tool_names = sorted(tool.get("name", "") for tool in tools or [])
+        raw_key = f"{conversation_history or ''}|{json.dumps(tool_names)}"
+        return hashlib.sha1(raw_key.encode("utf-8")).hexdigest()
+
+    def get(self, query: str, key_hash: str) -> Optional[Any]:
+        """
+        Look up a cached answer for a repeated or semantically similar query.
+
+        Args:
+            query: The user's question
+            key_hash: Cache key from make_key for the current context
+
+        Returns:
+            Cached answer for an exact repeat or, with semantic matching on,
+            for an entry within the distance threshold
+        """
+        entry = self._exact.get((self._exact_key(query), key_hash))
+        if entry is not None:
+            self.hits += 1
+            return entry.answer
+
+        if self.embedding_function is None:
+            return None
+
+        snapshot = self._snapshots.get(key_hash)
+        if snapshot is None:
+            bucket = self._buckets.get(key_hash)
+            if not bucket:
+                return None
+            candidates = tuple(bucket)
+            snapshot = (np.stack([entry.embedding for entry in candidates]), candidates)
+            self._snapshots[key_hash] = snapshot
+        matrix, candidates = snapshot
+
+        embedding = self._embed(query)
+        distances = 1.0 - matrix @ embedding
+
+        best = int(np.argmin(distances))
+        if distances[best] < self.distance_threshold:
+            self.hits += 1
+            return candidates[best].answer
+        return None
+
+    def put(self, query: str, key_hash: str, answer: Any):
+        """Store an answer for a query, evicting the oldest entry when full"""
+        if self.entries.maxlen == 0:
+            return
+
+        if len(self.entries) == self.entries.maxlen:
+            # The oldest entry overall is also the oldest in its own bucket
+            oldest = self.entries[0]
+            bucket = self._buckets.get(oldest.key_hash)
+            if bucket:
+                bucket.popleft()
+                if not bucket:
+                    del self._buckets[oldest.key_hash]
+                self._snapshots.pop(oldest.key_hash, None)
+            exact = (oldest.exact_key, oldest.key_hash)
+            if self._exact.get(exact) is oldest:
+                del self._exact[exact]
+
+        semantic = self.embedding_function is not None
+        entry = CacheEntry(
+            embedding=self._embed(query) if semantic else None,
+            key_hash=key_hash,
+            answer=answer,
+            exact_key=self._exact_key(query)
+        )
+        self.entries.append(entry)
+        self._exact[(entry.exact_key, key_hash)] = entry
+        if semantic:
+            self._buckets.setdefault(key_hash, deque()).append(entry)
+            self._snapshots.pop(key_hash, None)
+
+    def clear(self):
+        """Clear all cached answers"""
+        self.entries.clear()
+        self._buckets = {}
+        self._snapshots = {}
+        self._exact = {}
+        self._last_embedded = (None, None)
+
+    @staticmethod
+    def _exact_key(query: str) -> str:
+        """Normalize a query for exact matching: case and surrounding whitespace are ignored, nothing else"""
+        return query.strip().lower()
+
+    def _embed(self, query: str) -> np.ndarray:
+        """Embed and unit-normalize a query so a dot product gives cosine similarity"""
+        last_query, last_embedding = self._last_embedded
+        if query == last_query and last_embedding is not None:
+            return last_embedding
+
+        embedding = np.asarray(self.embedding_function([query])[0], dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+
+        self._last_embedded = (query, embedding)
+        return embedding
@@ -1,8 +1,37 @@
-from typing import Dict, Any, Optional, Protocol
+from typing import Dict, Any, List, Optional, Protocol
 from abc import ABC, abstractmethod
 from vector_store import VectorStore, SearchResults
 
 
+# Returned by CourseSearchTool when an unfiltered search finds nothing
+NO_CONTENT_MSG = "No relevant content found."
+
+
+def no_content_message(course_name: Optional[str] = None, lesson_number: Optional[int] = None) -> str:
+    """Build the empty-result message, naming whichever filters were applied"""
+    if not course_name and not lesson_number:
+        return NO_CONTENT_MSG
+    filter_info = ""
+    if course_name:
+        filter_info += f" in course '{course_name}'"
+    if lesson_number:
+        filter_info += f" in lesson {lesson_number}"
+    return f"No relevant content found{filter_info}."
+
+
+class ToolError(str):
+    """Tool result that signals a failed tool call rather than usable content"""
+
+
+class ToolResult(str):
+    """Tool result text that carries the UI sources it was built from"""
+
+    def __new__(cls, text: str, sources: Optional[List[Dict[str, Any]]] = None):
+        result = super().__new__(cls, text)
+        result.sources = sources or []
+        return result
+
+
 class Tool(ABC):
     """Abstract base class for all tools"""
     
@@ -20,34 +49,37 @@ class Tool(ABC):
 class CourseSearchTool(Tool):
     """Tool for searching course content with semantic course name matching"""
     
+    # Static schema shared by every instance; callers must not mutate it
+    _TOOL_DEFINITION = {
+        "name": "search_course_content",
+        "description": "Search course materials with smart course name matching and lesson filtering",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string", 
+                    "description": "What to search for in the course content"
+                },
+                "course_name": {
+                    "type": "string",
+                    "description": "Course title (partial matches work, e.g. 'MCP', 'Introduction')"
+                },
+                "lesson_number": {
+                    "type": "integer",
+                    "description": "Specific lesson number to search within (e.g. 1, 2, 3)"
+                }
+            },
+            "required": ["query"]
+        }
+    }
+
     def __init__(self, vector_store: VectorStore):
         self.store = vector_store
         self.last_sources = []  # Track sources from last search
     
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
-        return {
-            "name": "search_course_content",
-            "description": "Search course materials with smart course name matching and lesson filtering",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string", 
-                        "description": "What to search for in the course content"
-                    },
-                    "course_name": {
-                        "type": "string",
-                        "description": "Course title (partial matches work, e.g. 'MCP', 'Introduction')"
-                    },
-                    "lesson_number": {
-                        "type": "integer",
-                        "description": "Specific lesson number to search within (e.g. 1, 2, 3)"
-                    }
-                },
-                "required": ["query"]
-            }
-        }
+        return self._TOOL_DEFINITION
     
     def execute(self, query: str, course_name: Optional[str] = None, lesson_number: Optional[int] = None) -> str:
         """
@@ -69,84 +101,68 @@ class CourseSearchTool(Tool):
             lesson_number=lesson_number
         )
         
-        # Handle errors
+        # Only a failed search is an error; nothing found, for instance in an
+        # unknown course, is an ordinary answer
         if results.error:
-            return results.error
+            return ToolError(results.error)
         
         # Handle empty results
         if results.is_empty():
-            filter_info = ""
-            if course_name:
-                filter_info += f" in course '{course_name}'"
-            if lesson_number:
-                filter_info += f" in lesson {lesson_number}"
-            return f"No relevant content found{filter_info}."
+            return ToolResult(no_content_message(course_name, lesson_number))
         
         # Format and return results
         return self._format_results(results)
     
     def _format_results(self, results: SearchResults) -> str:
         """Format search results with course and lesson context"""
-        formatted = []
-        sources = []  # Track sources for the UI
-
-        for doc, meta in zip(results.documents, results.metadata):
-            course_title = meta.get('course_title', 'unknown')
-            lesson_num = meta.get('lesson_number')
-
-            # Build context header
-            header = f"[{course_title}"
-            if lesson_num is not None:
-                header += f" - Lesson {lesson_num}"
-            header += "]"
-
-            # Track source for the UI with link information
-            source_text = course_title
-            if lesson_num is not None:
-                source_text += f" - Lesson {lesson_num}"
-
-            # Get lesson link if available
-            lesson_link = None
-            if lesson_num is not None:
-                lesson_link = self.store.get_lesson_link(course_title, lesson_num)
-
-            # Store source as dict with text and optional link
-            source_data = {
-                'text': source_text,
-                'link': lesson_link
-            }
-            sources.append(source_data)
-
-            formatted.append(f"{header}\n{doc}")
+        # Track sources for the UI; each source's text doubles as the result header
+        sources = [self._source_for(meta)
+                   for _, meta in zip(results.documents, results.metadata)]
+        formatted = [f"[{source['text']}]\n{doc}"
+                     for source, doc in zip(sources, results.documents)]
 
         # Store sources for retrieval
         self.last_sources = sources
 
-        return "\n\n".join(formatted)
+        return ToolResult("\n\n".join(formatted), sources)
+
+    def _source_for(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the UI source (text and optional lesson link) for one result"""
+        course_title = meta.get('course_title', 'unknown')
+        lesson_num = meta.get('lesson_number')
+        if lesson_num is None:
+            return {'text': course_title, 'link': None}
+        return {
+            'text': f"{course_title} - Lesson {lesson_num}",
+            'link': self.store.get_lesson_link(course_title, lesson_num)
+        }
 
 class CourseOutlineTool(Tool):
     """Tool for getting course outlines with title, link, and lesson list"""
 
+    # Static schema shared by every instance; callers must not mutate it
+    _TOOL_DEFINITION = {
+        "name": "get_course_outline",
+        "description": "Get complete course outline with title, link, and all lessons",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "course_title": {
+                    "type": "string",
+                    "description": "Course title to get outline for (partial matches work)"
+                }
+            },
+            "required": ["course_title"]
+        }
+    }
+
     def __init__(self, vector_store: VectorStore):
         self.store = vector_store
         self.last_sources = []  # Track sources from last search
 
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
-        return {
-            "name": "get_course_outline",
-            "description": "Get complete course outline with title, link, and all lessons",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "course_title": {
-                        "type": "string",
-                        "description": "Course title to get outline for (partial matches work)"
-                    }
-                },
-                "required": ["course_title"]
-            }
-        }
+        return self._TOOL_DEFINITION
 
     def execute(self, course_title: str) -> str:
         """
@@ -162,7 +178,7 @@ class CourseOutlineTool(Tool):
         # Resolve course name using vector search
         resolved_title = self.store._resolve_course_name(course_title)
         if not resolved_title:
-            return f"No course found matching '{course_title}'"
+            return ToolResult(f"No course found matching '{course_title}'")
 
         # Get all courses metadata to find the exact course
         all_courses = self.store.get_all_courses_metadata()
@@ -174,7 +190,7 @@ class CourseOutlineTool(Tool):
                 break
 
         if not target_course:
-            return f"Course '{resolved_title}' not found in metadata"
+            return ToolResult(f"No course found matching '{course_title}'")
 
         # Format the course outline
         return self._format_course_outline(target_course)
@@ -213,7 +229,7 @@ class CourseOutlineTool(Tool):
         }
         self.last_sources = [source_data]
 
-        return "\n".join(formatted)
+        return ToolResult("\n".join(formatted), self.last_sources)
 
 
 class ToolManager:
@@ -221,6 +237,9 @@ class ToolManager:
 
     def __init__(self):
         self.tools = {}
+        self._dispatch = {}  # Tool name -> bound execute method
+        self._tool_definitions = None  # Built on first use, reset on registration
+        self._last_sources = None  # Sources of the latest call(s), when results carry them
     
     def register_tool(self, tool: Tool):
         """Register any tool that implements the Tool interface"""
@@ -229,21 +248,49 @@ class ToolManager:
         if not tool_name:
             raise ValueError("Tool must have a 'name' in its definition")
         self.tools[tool_name] = tool
+        self._dispatch[tool_name] = tool.execute
+        self._tool_definitions = None
 
     
     def get_tool_definitions(self) -> list:
-        """Get all tool definitions for Anthropic tool calling"""
-        return [tool.get_tool_definition() for tool in self.tools.values()]
+        """
+        Get all tool definitions for Anthropic tool calling.
+
+        The same list object is returned until another tool is registered, so
+        AIGenerator can reuse its prepared tool payload across queries.
+        Callers must not mutate it.
+        """
+        if self._tool_definitions is None:
+            self._tool_definitions = [tool.get_tool_definition() for tool in self.tools.values()]
+        return self._tool_definitions
     
     def execute_tool(self, tool_name: str, **kwargs) -> str:
         """Execute a tool by name with given parameters"""
-        if tool_name not in self.tools:
-            return f"Tool '{tool_name}' not found"
+        execute = self._dispatch.get(tool_name)
+        if execute is None:
+            return ToolError(f"Tool '{tool_name}' not found")
         
-        return self.tools[tool_name].execute(**kwargs)
+        result = execute(**kwargs)
+        if isinstance(result, ToolResult):
+            self._last_sources = result.sources
+        return result
+
+    def record_sources(self, results: List[str]):
+        """
+        Record the sources of several tool results, in the given order.
+
+        Used after concurrent calls, where each call's own bookkeeping in
+        execute_tool would otherwise keep whichever finished last.
+        """
+        self._last_sources = [source for result in results
+                              if isinstance(result, ToolResult)
+                              for source in result.sources]
     
     def get_last_sources(self) -> list:
         """Get sources from the last search operation"""
+        if self._last_sources is not None:
+            return self._last_sources
+
         # Check all tools for last_sources attribute
         for tool in self.tools.values():
             if hasattr(tool, 'last_sources') and tool.last_sources:
@@ -252,6 +299,7 @@ class ToolManager:
 
     def reset_sources(self):
         """Reset sources from all tools that track sources"""
+        self._last_sources = None
         for tool in self.tools.values():
             if hasattr(tool, 'last_sources'):
                 tool.last_sources = []
\ No newline at end of file
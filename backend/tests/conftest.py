@@ -1,60 +1,131 @@
+import copy
 import pytest
 import sys
 import os
+from types import SimpleNamespace
 from unittest.mock import Mock, MagicMock, patch
-from typing import List, Dict, Any
+from dataclasses import replace
+from typing import List, Dict, Any, Optional
 from fastapi.testclient import TestClient
+from pydantic import BaseModel, ConfigDict
 
-# Add parent directory to path for imports
+# Add parent directory (backend modules) and this directory (mocks) to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from models import Course, Lesson, CourseChunk
-from vector_store import SearchResults
+from vector_store import SearchResults, VectorStore
 from config import Config
+from search_tools import CourseSearchTool, CourseOutlineTool
+from rag_system import RAGSystem
+from mocks import MockAnthropicClient, MockVectorStore, text_response, tool_use_response
+
+@pytest.fixture(scope="session")
+def base_config():
+    """Default configuration, read once per session; derive copies instead of mutating it"""
+    return Config()
 
 @pytest.fixture
-def test_config():
+def test_config(base_config, tmp_path):
     """Test configuration with safe defaults"""
-    config = Config()
-    config.CHROMA_PATH = "./test_chroma_db"
-    config.ANTHROPIC_API_KEY = "test-key"
-    config.CHUNK_SIZE = 100
-    config.CHUNK_OVERLAP = 20
-    config.MAX_RESULTS = 3
-    return config
+    return replace(
+        base_config,
+        # Per-test database directory, so parallel workers never share one
+        CHROMA_PATH=str(tmp_path / "chroma_db"),
+        ANTHROPIC_API_KEY="test-key",
+        CHUNK_SIZE=100,
+        CHUNK_OVERLAP=20,
+        MAX_RESULTS=3
+    )
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def session_vector_store(base_config, tmp_path_factory):
+    """Real, empty VectorStore loading the embedding model once per session; tests must not add data"""
+    return VectorStore(str(tmp_path_factory.mktemp("session_chroma")),
+                       base_config.EMBEDDING_MODEL, base_config.MAX_RESULTS)
+
+# Read-only sample data is built once at import; tests must not mutate it
+_SAMPLE_COURSE = Course(
+    title="Test Course",
+    course_link="https://example.com/course",
+    instructor="Test Instructor",
+    lessons=[
+        Lesson(lesson_number=1, title="Introduction", lesson_link="https://example.com/lesson1"),
+        Lesson(lesson_number=2, title="Advanced Topics", lesson_link="https://example.com/lesson2")
+    ]
+)
+
+_SAMPLE_CHUNKS = (
+    CourseChunk(
+        content="This is lesson 1 content about introduction",
+        course_title="Test Course",
+        lesson_number=1,
+        chunk_index=0
+    ),
+    CourseChunk(
+        content="This is lesson 2 content about advanced topics",
+        course_title="Test Course",
+        lesson_number=2,
+        chunk_index=1
+    )
+)
+
+_SAMPLE_TOOLS = (
+    {
+        "name": "search_course_content",
+        "description": "Search course materials",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Search query"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "get_course_outline",
+        "description": "Get course outline",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "course_title": {"type": "string", "description": "Course title"}
+            },
+            "required": ["course_title"]
+        }
+    }
+)
+
+@pytest.fixture(scope="session")
 def sample_course():
     """Sample course for testing"""
-    return Course(
-        title="Test Course",
-        course_link="https://example.com/course",
-        instructor="Test Instructor",
-        lessons=[
-            Lesson(lesson_number=1, title="Introduction", lesson_link="https://example.com/lesson1"),
-            Lesson(lesson_number=2, title="Advanced Topics", lesson_link="https://example.com/lesson2")
-        ]
-    )
+    return _SAMPLE_COURSE
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_course_chunks():
     """Sample course chunks for testing"""
-    return [
-        CourseChunk(
-            content="This is lesson 1 content about introduction",
-            course_title="Test Course",
-            lesson_number=1,
-            chunk_index=0
-        ),
-        CourseChunk(
-            content="This is lesson 2 content about advanced topics",
-            course_title="Test Course",
-            lesson_number=2,
-            chunk_index=1
-        )
-    ]
-
-@pytest.fixture
+    return _SAMPLE_CHUNKS
+
+_SAMPLE_COURSE_TEXT = (
+    "Course Title: Test Course\n"
+    "Course Link: https://example.com\n"
+    "Course Instructor: Test Instructor\n"
+    "\nLesson 1: Introduction\n"
+    "This is lesson content\n"
+)
+
+@pytest.fixture(scope="session")
+def sample_course_dir(tmp_path_factory):
+    """Directory holding one course document, written once per session; tests must not modify it"""
+    course_dir = tmp_path_factory.mktemp("courses")
+    (course_dir / "test_course.txt").write_text(_SAMPLE_COURSE_TEXT)
+    return str(course_dir)
+
+@pytest.fixture(scope="session")
+def sample_course_file(sample_course_dir):
+    """Path of the course document in sample_course_dir"""
+    return os.path.join(sample_course_dir, "test_course.txt")
+
+@pytest.fixture(scope="session")
 def empty_search_results():
     """Empty search results for testing"""
     return SearchResults(
@@ -63,7 +134,7 @@ def empty_search_results():
         distances=[]
     )
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def populated_search_results():
     """Populated search results for testing"""
     return SearchResults(
@@ -75,7 +146,7 @@ def populated_search_results():
         distances=[0.1, 0.2]
     )
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_search_results():
     """Search results with error for testing"""
     return SearchResults.empty("Test error message")
@@ -83,113 +154,126 @@ def error_search_results():
 @pytest.fixture
 def mock_vector_store():
     """Mock vector store for isolated testing"""
-    mock = Mock()
-    mock.search = Mock()
-    mock._resolve_course_name = Mock()
-    mock.get_all_courses_metadata = Mock()
-    mock.get_lesson_link = Mock()
-    return mock
+    # Child mocks (search, _resolve_course_name, ...) are created lazily on access
+    return Mock()
 
 @pytest.fixture
 def mock_anthropic_client():
     """Mock Anthropic client for AI testing"""
-    mock = Mock()
-    mock.messages = Mock()
-    mock.messages.create = Mock()
-    return mock
+    # messages.create is created lazily on first access
+    return Mock()
 
 @pytest.fixture
-def mock_ai_response():
-    """Mock AI response structure"""
-    response = Mock()
-    response.content = [Mock()]
-    response.content[0].text = "Test AI response"
-    response.stop_reason = "end_turn"
-    return response
+def patched_anthropic(monkeypatch):
+    """Make anthropic.Anthropic return holder["client"] (default MockAnthropicClient) for this test"""
+    holder = {}
 
-@pytest.fixture
-def mock_tool_use_response():
-    """Mock AI response with tool use"""
-    response = Mock()
+    def factory(*args, **kwargs):
+        return holder.get("client") or MockAnthropicClient()
 
-    # Create tool use content block
-    tool_block = Mock()
-    tool_block.type = "tool_use"
-    tool_block.name = "search_course_content"
-    tool_block.id = "test_tool_id"
-    tool_block.input = {"query": "test query"}
+    monkeypatch.setattr("anthropic.Anthropic", factory)
+    return holder
 
-    response.content = [tool_block]
-    response.stop_reason = "tool_use"
-    return response
+@pytest.fixture(scope="session")
+def mock_ai_response():
+    """AI response double with a single text block"""
+    return text_response("Test AI response")
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def mock_tool_use_response():
+    """AI response double requesting a search tool call"""
+    return tool_use_response("search_course_content", "test_tool_id", {"query": "test query"})
+
+@pytest.fixture(scope="session")
 def sample_tool_definitions():
     """Sample tool definitions for testing"""
-    return [
-        {
-            "name": "search_course_content",
-            "description": "Search course materials",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {"type": "string", "description": "Search query"}
-                },
-                "required": ["query"]
-            }
-        },
-        {
-            "name": "get_course_outline",
-            "description": "Get course outline",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "course_title": {"type": "string", "description": "Course title"}
-                },
-                "required": ["course_title"]
-            }
-        }
-    ]
+    return _SAMPLE_TOOLS
+
+@pytest.fixture(scope="session")
+def real_tools():
+    """Definitions of the real search and outline tools, built once per session"""
+    store = MockVectorStore()
+    return (CourseSearchTool(store).get_tool_definition(),
+            CourseOutlineTool(store).get_tool_definition())
+
+@pytest.fixture(scope="module")
+def _rag_system_mocked_module(base_config):
+    """RAGSystem with a mocked AIGenerator and populated MockVectorStore, built once per module"""
+    # Patch only during construction, so later tests in the module see the real classes
+    with patch('rag_system.AIGenerator'), patch('rag_system.VectorStore') as mock_vector_store_class:
+        mock_vector_store_class.return_value = MockVectorStore(populate_with_data=True)
+        return RAGSystem(replace(base_config, ANTHROPIC_API_KEY="test-key"))
+
+@pytest.fixture
+def rag_system_mocked(_rag_system_mocked_module):
+    """Shared mocked RAGSystem with per-test state (AI mock, response cache, sources) cleared"""
+    rag_system = _rag_system_mocked_module
+    rag_system.ai_generator.reset_mock(return_value=True, side_effect=True)
+    rag_system.response_cache.clear()
+    rag_system.tool_manager.reset_sources()
+    return rag_system
 
 # Test data for various scenarios
-TEST_QUERIES = [
+TEST_QUERIES = (
     "What is machine learning?",
     "Explain the concept in lesson 1",
     "Show me the course outline",
     "What's in the Test Course?"
-]
+)
 
-TEST_COURSE_NAMES = [
+TEST_COURSE_NAMES = (
     "Test Course",
     "Machine Learning",
     "AI Fundamentals",
     "NonexistentCourse"
-]
+)
 
 # API Testing Fixtures
 
+# Pydantic models for the test app, built once at import
+class QueryRequest(BaseModel):
+    query: str
+    session_id: Optional[str] = None
+
+class SourceItem(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    text: str
+    link: Optional[str] = None
+
+class QueryResponse(BaseModel):
+    answer: str
+    sources: List[SourceItem]
+    session_id: str
+
+class CourseStats(BaseModel):
+    total_courses: int
+    course_titles: List[str]
+
+def get_rag_system():
+    """Dependency through which the test app's routes reach the RAG system"""
+    raise RuntimeError("test app used without the mock_rag_system override")
+
 @pytest.fixture
 def mock_rag_system():
-    """Mock RAG system for API testing"""
+    """Fresh mock RAG system for API testing"""
     mock = Mock()
-    mock.query = Mock()
-    mock.get_course_analytics = Mock()
-    mock.session_manager = Mock()
-    mock.session_manager.create_session = Mock(return_value="test-session-123")
-    mock.add_course_folder = Mock(return_value=(2, 10))
+    # Plain namespace: routes only call create_session, and tests count those calls
+    mock.session_manager = SimpleNamespace(create_session=Mock(return_value="test-session-123"))
+    mock.add_course_folder.return_value = (2, 10)
     return mock
 
-@pytest.fixture
-def test_app(mock_rag_system):
-    """Create test FastAPI app with mocked dependencies"""
-    from fastapi import FastAPI
+@pytest.fixture(scope="session")
+def _test_app_singleton():
+    """Create test FastAPI app with mocked dependencies, once per session"""
+    import orjson
+    from fastapi import Depends, FastAPI
+    from fastapi.responses import ORJSONResponse
     from fastapi.middleware.cors import CORSMiddleware
     from fastapi.middleware.trustedhost import TrustedHostMiddleware
-    from pydantic import BaseModel
-    from typing import List, Optional, Dict, Any
 
     # Create test app without static file mounting
-    app = FastAPI(title="Course Materials RAG System", root_path="")
+    app = FastAPI(title="Course Materials RAG System", root_path="", default_response_class=ORJSONResponse)
 
     # Add middleware
     app.add_middleware(
@@ -206,39 +290,20 @@ def test_app(mock_rag_system):
         expose_headers=["*"],
     )
 
-    # Pydantic models
-    class QueryRequest(BaseModel):
-        query: str
-        session_id: Optional[str] = None
-
-    class QueryResponse(BaseModel):
-        answer: str
-        sources: List[Dict[str, Any]]
-        session_id: str
-
-    class CourseStats(BaseModel):
-        total_courses: int
-        course_titles: List[str]
-
     # API endpoints with mocked RAG system
     @app.post("/api/query", response_model=QueryResponse)
-    async def query_documents(request: QueryRequest):
+    async def query_documents(request: QueryRequest, rag_system=Depends(get_rag_system)):
         try:
             session_id = request.session_id
             if not session_id:
-                session_id = mock_rag_system.session_manager.create_session()
+                session_id = rag_system.session_manager.create_session()
 
-            answer, sources = mock_rag_system.query(request.query, session_id)
+            answer, sources = rag_system.query(request.query, session_id)
 
-            formatted_sources = []
-            for source in sources:
-                if isinstance(source, dict):
-                    formatted_sources.append(source)
-                else:
-                    formatted_sources.append({
-                        'text': str(source),
-                        'link': None
-                    })
+            formatted_sources = [
+                source if isinstance(source, dict) else {'text': str(source), 'link': None}
+                for source in sources
+            ]
 
             return QueryResponse(
                 answer=answer,
@@ -249,10 +314,29 @@ def test_app(mock_rag_system):
             from fastapi import HTTPException
             raise HTTPException(status_code=500, detail=str(e))
 
+    @app.post("/api/query/stream")
+    async def query_documents_stream(request: QueryRequest, rag_system=Depends(get_rag_system)):
+        from fastapi.responses import StreamingResponse
+
+        session_id = request.session_id
+        if not session_id:
+            session_id = rag_system.session_manager.create_session()
+
+        def events():
+            try:
+                for event in rag_system.query_stream(request.query, session_id):
+                    if event["type"] == "sources":
+                        event = {"type": "done", "sources": event["sources"], "session_id": session_id}
+                    yield orjson.dumps(event) + b"\n"
+            except Exception as e:
+                yield orjson.dumps({"type": "error", "detail": str(e)}) + b"\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
     @app.get("/api/courses", response_model=CourseStats)
-    async def get_course_stats():
+    async def get_course_stats(rag_system=Depends(get_rag_system)):
         try:
-            analytics = mock_rag_system.get_course_analytics()
+            analytics = rag_system.get_course_analytics()
             return CourseStats(
                 total_courses=analytics["total_courses"],
                 course_titles=analytics["course_titles"]
@@ -268,9 +352,35 @@ def test_app(mock_rag_system):
     return app
 
 @pytest.fixture
-def client(test_app):
+def test_app(_test_app_singleton, mock_rag_system):
+    """Test FastAPI app whose routes use this test's mock RAG system"""
+    _test_app_singleton.dependency_overrides[get_rag_system] = lambda: mock_rag_system
+    yield _test_app_singleton
+    _test_app_singleton.dependency_overrides.clear()
+
+@pytest.fixture(scope="session")
+def _test_client_singleton(_test_app_singleton):
+    """Test client shared across the session"""
+    return TestClient(_test_app_singleton)
+
+@pytest.fixture
+def client(_test_client_singleton, test_app):
     """Test client for API testing"""
-    return TestClient(test_app)
+    return _test_client_singleton
+
+@pytest.fixture
+def anyio_backend():
+    """Run anyio-marked async tests on asyncio"""
+    return "asyncio"
+
+@pytest.fixture
+async def async_client(test_app):
+    """Async test client driving the app in-process, for concurrent request tests"""
+    import httpx
+
+    transport = httpx.ASGITransport(app=test_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+        yield async_client
 
 @pytest.fixture
 def sample_query_request():
@@ -280,21 +390,23 @@ def sample_query_request():
         "session_id": "test-session-123"
     }
 
+SAMPLE_QUERY_RESPONSE = {
+    "answer": "Machine learning is a subset of artificial intelligence.",
+    "sources": [
+        {
+            "text": "ML definition from course",
+            "link": "https://example.com/lesson1",
+            "course_title": "Test Course",
+            "lesson_number": 1
+        }
+    ],
+    "session_id": "test-session-123"
+}
+
 @pytest.fixture
 def sample_query_response():
-    """Sample query response data"""
-    return {
-        "answer": "Machine learning is a subset of artificial intelligence.",
-        "sources": [
-            {
-                "text": "ML definition from course",
-                "link": "https://example.com/lesson1",
-                "course_title": "Test Course",
-                "lesson_number": 1
-            }
-        ],
-        "session_id": "test-session-123"
-    }
+    """Sample query response data, copied so tests may modify it"""
+    return copy.deepcopy(SAMPLE_QUERY_RESPONSE)
 
 @pytest.fixture
 def sample_course_analytics():
@@ -1,15 +1,134 @@
 """
 Mock objects for RAG system testing
 """
-from unittest.mock import Mock, MagicMock
-from typing import List, Dict, Any, Optional
+from collections import defaultdict, deque
+from dataclasses import dataclass, field, replace
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from typing import Callable, List, Dict, Any, Optional
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 from vector_store import SearchResults
 from models import Course, Lesson, CourseChunk
+from rag_system import RAGSystem
+from config import config
+
+
+# Most recent calls kept by the recording mocks; older entries are evicted
+HISTORY_LIMIT = 16
+
+
+@dataclass(frozen=True)
+class FakeContentBlock:
+    """Lightweight stand-in for an Anthropic text or tool_use content block"""
+    type: str = "text"
+    text: str = ""
+    name: str = ""
+    id: str = ""
+    input: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class FakeResponse:
+    """Lightweight stand-in for an Anthropic Messages API response"""
+    content: List[FakeContentBlock]
+    stop_reason: str = "end_turn"
+
+
+def text_response(text: str, stop_reason: str = "end_turn") -> FakeResponse:
+    """Build a single-text-block response"""
+    return FakeResponse(content=[FakeContentBlock(text=text)], stop_reason=stop_reason)
+
+
+def tool_use_response(name: str, tool_id: str, tool_input: Dict[str, Any],
+                      text: Optional[str] = None) -> FakeResponse:
+    """Build a response requesting a single tool call, optionally after preamble text"""
+    content = [FakeContentBlock(text=text)] if text else []
+    content.append(FakeContentBlock(type="tool_use", name=name, id=tool_id, input=tool_input))
+    return FakeResponse(content=content, stop_reason="tool_use")
+
+
+def mock_embedding_function(texts: List[str]) -> List[List[float]]:
+    """Deterministic bag-of-words embedding for tests that need real vectors"""
+    embeddings = []
+    for text in texts:
+        vector = [0.0] * 64
+        for word in text.lower().split():
+            vector[sum(ord(char) for char in word) % 64] += 1.0
+        embeddings.append(vector)
+    return embeddings
+
+
+class FakeEmbeddingFunction(EmbeddingFunction[Documents]):
+    """ChromaDB embedding function backed by mock_embedding_function, so no model is loaded"""
+
+    def __init__(self):
+        # Input batches, most recent last
+        self.calls: deque = deque(maxlen=HISTORY_LIMIT)
+
+    # ChromaDB persists collection configs through these
+    @staticmethod
+    def name() -> str:
+        return "fake"
+
+    def get_config(self) -> Dict[str, Any]:
+        return {}
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "FakeEmbeddingFunction":
+        return FakeEmbeddingFunction()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        self.calls.append(list(input))
+        return [np.asarray(vector, dtype=np.float32) for vector in mock_embedding_function(input)]
+
+
+class RaisingStub:
+    """Callable that raises the given exception; a cheaper side_effect for raise-only cases"""
+
+    __slots__ = ("exc",)
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+    def __call__(self, *args, **kwargs):
+        raise self.exc
 
 
 class MockVectorStore:
     """Mock VectorStore with configurable behavior"""
 
+    __slots__ = (
+        "populate_with_data",
+        "simulate_search_error",
+        "simulate_empty_results",
+        "last_search_query",
+        "last_search_params",
+        "search_count",
+        "embedding_function",
+        "mock_courses_metadata",
+        "resolve_course_name_fn",
+        "_resolve_cache",
+    )
+
+    # Mock course metadata, shared by every instance; tests must not mutate it
+    _COURSES_METADATA_FULL = [
+        {
+            "title": "Test Course",
+            "instructor": "Test Instructor",
+            "course_link": "https://example.com/course",
+            "lessons": [
+                {"lesson_number": 1, "lesson_title": "Introduction", "lesson_link": "https://example.com/lesson1"},
+                {"lesson_number": 2, "lesson_title": "Advanced Topics", "lesson_link": "https://example.com/lesson2"}
+            ]
+        }
+    ]
+    _COURSES_METADATA_EMPTY = []
+
+    # Constant search outcomes, returned as-is on every call
+    _EMPTY_ERR = SearchResults.empty("Simulated search error")
+    _EMPTY = SearchResults(documents=[], metadata=[], distances=[])
+
     def __init__(self,
                  populate_with_data: bool = True,
                  simulate_search_error: bool = False,
@@ -19,23 +138,25 @@ class MockVectorStore:
         self.simulate_empty_results = simulate_empty_results
         self.last_search_query = None
         self.last_search_params = None
+        self.search_count = 0
+        self.embedding_function = mock_embedding_function
+        # Tests may swap in their own resolver instead of patching the method
+        self.resolve_course_name_fn: Optional[Callable[[str], Optional[str]]] = None
+        self._resolve_cache: Dict[str, Optional[str]] = {}
 
-        # Mock course metadata
-        self.mock_courses_metadata = [
-            {
-                "title": "Test Course",
-                "instructor": "Test Instructor",
-                "course_link": "https://example.com/course",
-                "lessons": [
-                    {"lesson_number": 1, "lesson_title": "Introduction", "lesson_link": "https://example.com/lesson1"},
-                    {"lesson_number": 2, "lesson_title": "Advanced Topics", "lesson_link": "https://example.com/lesson2"}
-                ]
-            }
-        ] if populate_with_data else []
+        self.mock_courses_metadata = self._COURSES_METADATA_FULL if populate_with_data else self._COURSES_METADATA_EMPTY
+
+    def reset(self):
+        """Clear per-test state so one instance can be shared across tests"""
+        self.last_search_query = None
+        self.last_search_params = None
+        self.search_count = 0
+        self.resolve_course_name_fn = None
 
     def search(self, query: str, course_name: Optional[str] = None,
               lesson_number: Optional[int] = None, limit: Optional[int] = None) -> SearchResults:
         """Mock search implementation"""
+        self.search_count += 1
         self.last_search_query = query
         self.last_search_params = {
             "course_name": course_name,
@@ -44,10 +165,14 @@ class MockVectorStore:
         }
 
         if self.simulate_search_error:
-            return SearchResults.empty("Simulated search error")
+            return self._EMPTY_ERR
 
         if self.simulate_empty_results or not self.populate_with_data:
-            return SearchResults(documents=[], metadata=[], distances=[])
+            return self._EMPTY
+
+        # Like VectorStore, an unresolved course is an empty result, not an error
+        if course_name and self._resolve_course_name(course_name) is None:
+            return self._EMPTY
 
         # Return mock search results
         return SearchResults(
@@ -58,13 +183,20 @@ class MockVectorStore:
 
     def _resolve_course_name(self, course_name: str) -> Optional[str]:
         """Mock course name resolution"""
+        if self.resolve_course_name_fn is not None:
+            return self.resolve_course_name_fn(course_name)
+
         if not self.populate_with_data:
             return None
 
+        if course_name in self._resolve_cache:
+            return self._resolve_cache[course_name]
+
         # Simple matching logic for testing
-        if "test" in course_name.lower() or "course" in course_name.lower():
-            return "Test Course"
-        return None
+        lowered = course_name.lower()
+        resolved = "Test Course" if "test" in lowered or "course" in lowered else None
+        self._resolve_cache[course_name] = resolved
+        return resolved
 
     def get_all_courses_metadata(self) -> List[Dict[str, Any]]:
         """Mock get all courses metadata"""
@@ -80,6 +212,17 @@ class MockVectorStore:
 class MockAnthropicClient:
     """Mock Anthropic client for testing AI responses"""
 
+    __slots__ = (
+        "simulate_tool_use",
+        "simulate_api_error",
+        "custom_response",
+        "last_request_params",
+        "call_count",
+        "messages",
+        "_cached_text_response",
+        "_cached_tool_response",
+    )
+
     def __init__(self,
                  simulate_tool_use: bool = False,
                  simulate_api_error: bool = False,
@@ -90,9 +233,12 @@ class MockAnthropicClient:
         self.last_request_params = None
         self.call_count = 0
 
-        # Set up messages mock
-        self.messages = Mock()
-        self.messages.create = self._create_message
+        # Responses are immutable and fixed by the constructor arguments
+        self._cached_text_response = text_response(custom_response)
+        self._cached_tool_response = tool_use_response("search_course_content", "mock_tool_id", {"query": "mock query"})
+
+        # Set up messages namespace
+        self.messages = SimpleNamespace(create=self._create_message)
 
     def _create_message(self, **kwargs):
         """Mock message creation"""
@@ -102,33 +248,29 @@ class MockAnthropicClient:
         if self.simulate_api_error:
             raise Exception("Simulated API error")
 
-        response = Mock()
-
         if self.simulate_tool_use:
             # Simulate tool use response
-            tool_block = Mock()
-            tool_block.type = "tool_use"
-            tool_block.name = "search_course_content"
-            tool_block.id = "mock_tool_id"
-            tool_block.input = {"query": "mock query"}
+            return self._cached_tool_response
 
-            response.content = [tool_block]
-            response.stop_reason = "tool_use"
-        else:
-            # Simulate regular text response
-            text_block = Mock()
-            text_block.text = self.custom_response
-
-            response.content = [text_block]
-            response.stop_reason = "end_turn"
-
-        return response
+        # Simulate regular text response
+        return self._cached_text_response
 
 
 class EnhancedMockAnthropicClient:
     """Enhanced mock Anthropic client for testing sequential tool calling"""
 
-    def __init__(self, response_sequence: List[Dict[str, Any]]):
+    __slots__ = (
+        "response_sequence",
+        "record_history",
+        "call_index",
+        "_call_count",
+        "call_history",
+        "_prebuilt_responses",
+        "_exhausted_response",
+        "messages",
+    )
+
+    def __init__(self, response_sequence: List[Dict[str, Any]], record_history: bool = False):
         """
         Initialize with a sequence of responses to return in order.
 
@@ -139,73 +281,73 @@ class EnhancedMockAnthropicClient:
                 {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"}},
                 {"type": "text", "content": "Final response"}
             ]
+            record_history: Keep the kwargs of the last HISTORY_LIMIT calls in call_history
         """
         self.response_sequence = response_sequence
+        self.record_history = record_history
         self.call_index = 0
-        self.call_history = []
+        self._call_count = 0
+        self.call_history = deque(maxlen=HISTORY_LIMIT)
+
+        # Response doubles are immutable, so build them all up front
+        self._prebuilt_responses = tuple(
+            self._build_response(response_def, f"tool_{index}")
+            for index, response_def in enumerate(response_sequence, start=1)
+        )
+        self._exhausted_response = self._build_text_response("Sequence exhausted")
 
-        # Set up messages mock
-        self.messages = Mock()
-        self.messages.create = self._create_message
+        # Set up messages namespace
+        self.messages = SimpleNamespace(create=self._create_message, stream=self._stream_message)
 
     @property
     def call_count(self) -> int:
         """Number of API calls made"""
-        return len(self.call_history)
+        return self._call_count
 
     def _create_message(self, **kwargs):
         """Mock message creation with sequential responses"""
-        self.call_history.append(kwargs)
-
-        # Return next response in sequence
-        if self.call_index < len(self.response_sequence):
-            response_def = self.response_sequence[self.call_index]
-            self.call_index += 1
-            return self._build_response(response_def)
-
-        # Return empty response if sequence exhausted
-        return self._build_text_response("Sequence exhausted")
-
-    def _build_response(self, response_def: Dict[str, Any]):
+        self._call_count += 1
+        if self.record_history:
+            # Snapshot messages: the generator keeps appending to the same list
+            self.call_history.append({**kwargs, "messages": list(kwargs.get("messages", []))})
+
+        # Return next response in sequence, or a fixed reply once exhausted
+        index = self.call_index
+        self.call_index += 1
+        if index < len(self._prebuilt_responses):
+            return self._prebuilt_responses[index]
+        return self._exhausted_response
+
+    def _stream_message(self, **kwargs):
+        """Mock streaming message creation over the same response sequence"""
+        return MockMessageStream(self._create_message(**kwargs))
+
+    def _build_response(self, response_def: Dict[str, Any], tool_id: str):
         """Build a mock response from definition"""
-        response = Mock()
-
         if response_def["type"] == "tool_use":
-            # Create tool use response
-            tool_block = Mock()
-            tool_block.type = "tool_use"
-            tool_block.name = response_def["tool"]
-            tool_block.id = f"tool_{self.call_index}"
-            tool_block.input = response_def.get("params", {})
-
-            response.content = [tool_block]
-            response.stop_reason = "tool_use"
-
-        elif response_def["type"] == "text":
-            # Create text response
-            text_block = Mock()
-            text_block.text = response_def["content"]
-
-            response.content = [text_block]
-            response.stop_reason = "end_turn"
+            return tool_use_response(
+                response_def["tool"],
+                tool_id,
+                response_def.get("params", {}),
+                response_def.get("text")
+            )
 
-        return response
+        return text_response(response_def["content"], response_def.get("stop_reason", "end_turn"))
 
     def _build_text_response(self, text: str):
         """Helper to build a text response"""
-        response = Mock()
-        text_block = Mock()
-        text_block.text = text
-        response.content = [text_block]
-        response.stop_reason = "end_turn"
-        return response
+        return text_response(text)
 
     def verify_message_context(self, call_index: int, expected_message_count: int):
         """Verify that the Nth API call has the expected message count"""
-        if call_index >= len(self.call_history):
+        if not self.record_history:
+            raise AssertionError("Call history not recorded; construct with record_history=True")
+        # call_history only holds the most recent calls
+        position = call_index - (self._call_count - len(self.call_history))
+        if not 0 <= position < len(self.call_history):
             raise AssertionError(f"Call index {call_index} not found in call history")
 
-        call_params = self.call_history[call_index]
+        call_params = self.call_history[position]
         actual_count = len(call_params.get("messages", []))
 
         if actual_count != expected_message_count:
@@ -214,9 +356,47 @@ class EnhancedMockAnthropicClient:
             )
 
 
+class MockMessageStream:
+    """Mock of the Anthropic MessageStream context manager"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        """Yield the text of every text block word by word, like streamed deltas"""
+        for block in self.response.content:
+            if block.type != "text":
+                continue
+            words = block.text.split(" ")
+            for index, word in enumerate(words):
+                yield word if index == 0 else f" {word}"
+
+    def get_final_message(self):
+        """Return the complete response"""
+        return self.response
+
+
 class MockToolManager:
     """Mock ToolManager for testing tool execution"""
 
+    __slots__ = (
+        "simulate_tool_error",
+        "mock_search_result",
+        "last_tool_name",
+        "last_tool_params",
+        "mock_sources",
+        "_hist_names",
+        "_hist_params",
+        "_execution_count",
+    )
+
     def __init__(self,
                  simulate_tool_error: bool = False,
                  mock_search_result: str = "Mock search result"):
@@ -226,9 +406,24 @@ class MockToolManager:
         self.last_tool_params = None
         self.mock_sources = [{"text": "Mock source", "link": "https://example.com"}]
 
-        # For sequential tool calling tests
-        self.execution_history = []
-        self.execution_count = 0
+        # For sequential tool calling tests: names and params of the last HISTORY_LIMIT calls
+        self._hist_names = deque(maxlen=HISTORY_LIMIT)
+        self._hist_params = deque(maxlen=HISTORY_LIMIT)
+        self._execution_count = 0
+
+    @property
+    def execution_count(self) -> int:
+        """Number of tool executions"""
+        return self._execution_count
+
+    @property
+    def execution_history(self) -> List[Dict[str, Any]]:
+        """Execution records built on demand from the retained names and params"""
+        first_index = self._execution_count - len(self._hist_names)
+        return [
+            {"tool_name": tool_name, "params": params, "execution_index": index}
+            for index, (tool_name, params) in enumerate(zip(self._hist_names, self._hist_params), start=first_index)
+        ]
 
     def get_tool_definitions(self) -> List[Dict[str, Any]]:
         """Mock tool definitions"""
@@ -247,18 +442,14 @@ class MockToolManager:
         ]
 
     def execute_tool(self, tool_name: str, **kwargs) -> str:
-        """Mock tool execution"""
+        """Mock tool execution; the recorded params are the call's kwargs, so tests must not mutate them"""
         self.last_tool_name = tool_name
         self.last_tool_params = kwargs
 
-        # Track execution history
-        execution_record = {
-            "tool_name": tool_name,
-            "params": kwargs.copy(),
-            "execution_index": self.execution_count
-        }
-        self.execution_history.append(execution_record)
-        self.execution_count += 1
+        # Track execution history; kwargs is a fresh dict per call, so no copy is needed
+        self._hist_names.append(tool_name)
+        self._hist_params.append(kwargs)
+        self._execution_count += 1
 
         if self.simulate_tool_error:
             return "Tool execution failed"
@@ -277,25 +468,33 @@ class MockToolManager:
 class MockSessionManager:
     """Mock SessionManager for testing session handling"""
 
+    __slots__ = (
+        "sessions",
+        "session_counter",
+        "_rendered_history",
+    )
+
     def __init__(self):
-        self.sessions = {}
+        self.sessions = defaultdict(list)
         self.session_counter = 0
+        # Rendered history per session, dropped whenever the session changes
+        self._rendered_history: Dict[str, str] = {}
 
     def create_session(self) -> str:
         """Mock session creation"""
         self.session_counter += 1
         session_id = f"mock_session_{self.session_counter}"
         self.sessions[session_id] = []
+        self._rendered_history.pop(session_id, None)
         return session_id
 
     def add_exchange(self, session_id: str, user_message: str, assistant_message: str):
         """Mock add exchange"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
         self.sessions[session_id].extend([
             {"role": "user", "content": user_message},
             {"role": "assistant", "content": assistant_message}
         ])
+        self._rendered_history.pop(session_id, None)
 
     def get_conversation_history(self, session_id: Optional[str]) -> Optional[str]:
         """Mock get conversation history"""
@@ -306,7 +505,11 @@ class MockSessionManager:
         if not messages:
             return None
 
-        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+        rendered = self._rendered_history.get(session_id)
+        if rendered is None:
+            rendered = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+            self._rendered_history[session_id] = rendered
+        return rendered
 
 
 def create_mock_rag_system(
@@ -315,11 +518,7 @@ def create_mock_rag_system(
     simulate_ai_error: bool = False,
     simulate_tool_error: bool = False
 ):
-    """Factory function to create a mock RAG system with various configurations"""
-    from rag_system import RAGSystem
-    from unittest.mock import patch
-
-    mock_system = Mock(spec=RAGSystem)
+    """Factory function to create a RAG system over mock components with various configurations"""
 
     # Configure mock vector store
     mock_vector_store = MockVectorStore(
@@ -329,7 +528,6 @@ def create_mock_rag_system(
 
     # Configure mock AI generator
     mock_ai_generator = Mock()
-    mock_ai_generator.generate_response = Mock()
 
     if simulate_ai_error:
         mock_ai_generator.generate_response.side_effect = Exception("Simulated AI error")
@@ -342,10 +540,11 @@ def create_mock_rag_system(
     # Configure mock session manager
     mock_session_manager = MockSessionManager()
 
-    # Set up the mock system
-    mock_system.vector_store = mock_vector_store
-    mock_system.ai_generator = mock_ai_generator
-    mock_system.tool_manager = mock_tool_manager
-    mock_system.session_manager = mock_session_manager
+    # A real RAGSystem, so query() runs its own logic over the mock components
+    with patch('rag_system.VectorStore', return_value=mock_vector_store), \
+            patch('rag_system.AIGenerator', return_value=mock_ai_generator):
+        rag_system = RAGSystem(replace(config, ANTHROPIC_API_KEY="test-key"))
+    rag_system.tool_manager = mock_tool_manager
+    rag_system.session_manager = mock_session_manager
 
-    return mock_system
\ No newline at end of file
+    return rag_system
\ No newline at end of file
@@ -2,9 +2,47 @@
 Tests for AIGenerator tool calling and response generation
 """
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+import threading
+from unittest.mock import Mock, MagicMock
 from ai_generator import AIGenerator
-from mocks import MockAnthropicClient, MockToolManager, EnhancedMockAnthropicClient
+from response_cache import SemanticResponseCache
+from search_tools import CourseSearchTool, CourseOutlineTool, ToolError, ToolManager
+from mocks import (MockAnthropicClient, MockToolManager, MockVectorStore, EnhancedMockAnthropicClient,
+                   FakeContentBlock, FakeResponse, text_response, mock_embedding_function)
+
+
+# MockToolManager's definitions are fixed, so build them once; tests must not mutate them
+_DEFAULT_TOOL_DEFS = tuple(MockToolManager().get_tool_definitions())
+
+# Elements the system prompt must mention
+_PROMPT_TOOL_GUIDANCE = ("search_course_content", "get_course_outline", "Tool Usage Guidelines")
+_PROMPT_RESPONSE_PROTOCOL = ("Response Protocol", "General knowledge questions",
+                             "Course content questions", "Course outline/structure questions")
+
+
+def _tool(name, **params):
+    """Response definition for a tool_use round"""
+    return {"type": "tool_use", "tool": name, "params": params}
+
+
+def _text(content):
+    """Response definition for a final text answer"""
+    return {"type": "text", "content": content}
+
+
+@pytest.fixture(scope="module")
+def generator():
+    """Generator shared by the module; tests swap in their own mock client"""
+    return AIGenerator("test-api-key", "claude-3-sonnet-20240229")
+
+
+@pytest.fixture
+def make_gen(generator, monkeypatch):
+    """Return the shared generator wired to the given mock client for one test"""
+    def _make_gen(mock_client):
+        monkeypatch.setattr(generator, "client", mock_client)
+        return generator
+    return _make_gen
 
 
 class TestAIGeneratorBasic:
@@ -21,46 +59,32 @@ class TestAIGeneratorBasic:
 
     def test_system_prompt_content(self):
         """Test that system prompt contains required tool guidance"""
-        system_prompt = AIGenerator.SYSTEM_PROMPT
-
-        # Check for tool usage guidelines
-        assert "search_course_content" in system_prompt
-        assert "get_course_outline" in system_prompt
-        assert "Tool Usage Guidelines" in system_prompt
-
-        # Check for response protocol
-        assert "Response Protocol" in system_prompt
-        assert "General knowledge questions" in system_prompt
-        assert "Course content questions" in system_prompt
-        assert "Course outline/structure questions" in system_prompt
+        # Tool usage guidelines and response protocol, checked in one pass
+        missing = [element for element in _PROMPT_TOOL_GUIDANCE + _PROMPT_RESPONSE_PROTOCOL
+                   if element not in AIGenerator.SYSTEM_PROMPT]
+        assert not missing, f"Missing prompt elements: {missing}"
 
 
 class TestAIGeneratorWithoutTools:
     """Test AIGenerator without tool calling"""
 
-    @patch('anthropic.Anthropic')
-    def test_generate_response_without_tools(self, mock_anthropic_class):
+    def test_generate_response_without_tools(self, make_gen):
         """Test generating response without tools"""
         # Setup mock client
         mock_client = MockAnthropicClient(simulate_tool_use=False, custom_response="Test response")
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         result = generator.generate_response(query="What is 2+2?")
 
         assert result == "Test response"
         assert mock_client.call_count == 1
 
-    @patch('anthropic.Anthropic')
-    def test_generate_response_with_conversation_history(self, mock_anthropic_class):
+    def test_generate_response_with_conversation_history(self, make_gen):
         """Test generating response with conversation history"""
         mock_client = MockAnthropicClient(custom_response="Response with history")
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         history = "User: Previous question\nAssistant: Previous answer"
         result = generator.generate_response(
@@ -69,17 +93,18 @@ class TestAIGeneratorWithoutTools:
         )
 
         assert result == "Response with history"
-        # Check that history was included in system prompt
-        assert history in mock_client.last_request_params["system"]
-
-    @patch('anthropic.Anthropic')
-    def test_api_error_handling(self, mock_anthropic_class):
+        # Check that history was replayed as prior turns, not in the system prompt
+        messages = mock_client.last_request_params["messages"]
+        assert messages[0] == {"role": "user", "content": "Previous question"}
+        assert messages[1] == {"role": "assistant", "content": "Previous answer"}
+        assert messages[2] == {"role": "user", "content": "Follow-up question"}
+        assert history not in mock_client.last_request_params["system"][0]["text"]
+
+    def test_api_error_handling(self, make_gen):
         """Test handling of API errors"""
         mock_client = MockAnthropicClient(simulate_api_error=True)
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         with pytest.raises(Exception, match="Simulated API error"):
             generator.generate_response(query="Test query")
@@ -88,17 +113,14 @@ class TestAIGeneratorWithoutTools:
 class TestAIGeneratorWithTools:
     """Test AIGenerator with tool calling functionality"""
 
-    @patch('anthropic.Anthropic')
-    def test_generate_response_with_tools_no_tool_use(self, mock_anthropic_class):
+    def test_generate_response_with_tools_no_tool_use(self, make_gen):
         """Test response generation with tools available but not used"""
         mock_client = MockAnthropicClient(simulate_tool_use=False, custom_response="Direct response")
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         mock_tool_manager = MockToolManager()
-        tools = mock_tool_manager.get_tool_definitions()
+        tools = _DEFAULT_TOOL_DEFS
 
         result = generator.generate_response(
             query="What is machine learning?",
@@ -112,39 +134,18 @@ class TestAIGeneratorWithTools:
         # But no tool execution should occur
         assert mock_tool_manager.last_tool_name is None
 
-    @patch('anthropic.Anthropic')
-    def test_generate_response_with_tool_use(self, mock_anthropic_class):
+    def test_generate_response_with_tool_use(self, make_gen):
         """Test response generation with tool use"""
         # First call returns tool use, second call returns final response
-        mock_client = Mock()
-        mock_anthropic_class.return_value = mock_client
-
-        # Mock the first response (tool use)
-        first_response = Mock()
-        tool_block = Mock()
-        tool_block.type = "tool_use"
-        tool_block.name = "search_course_content"
-        tool_block.id = "tool_123"
-        tool_block.input = {"query": "machine learning"}
-
-        first_response.content = [tool_block]
-        first_response.stop_reason = "tool_use"
+        mock_client = EnhancedMockAnthropicClient([
+            _tool("search_course_content", query="machine learning"),
+            _text("Final AI response based on tool results")
+        ])
 
-        # Mock the second response (final answer)
-        second_response = Mock()
-        text_block = Mock()
-        text_block.text = "Final AI response based on tool results"
-        second_response.content = [text_block]
-        second_response.stop_reason = "end_turn"
-
-        # Configure the mock to return different responses on consecutive calls
-        mock_client.messages.create.side_effect = [first_response, second_response]
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         mock_tool_manager = MockToolManager(mock_search_result="Tool search result")
-        tools = mock_tool_manager.get_tool_definitions()
+        tools = _DEFAULT_TOOL_DEFS
 
         result = generator.generate_response(
             query="Tell me about machine learning",
@@ -157,38 +158,21 @@ class TestAIGeneratorWithTools:
         assert mock_tool_manager.last_tool_name == "search_course_content"
         assert mock_tool_manager.last_tool_params == {"query": "machine learning"}
         # Should have made two API calls
-        assert mock_client.messages.create.call_count == 2
+        assert mock_client.call_count == 2
 
-    @patch('anthropic.Anthropic')
-    def test_tool_execution_error_handling(self, mock_anthropic_class):
+    def test_tool_execution_error_handling(self, make_gen):
         """Test handling of tool execution errors"""
-        # Mock tool use response
-        mock_client = Mock()
-        mock_anthropic_class.return_value = mock_client
-
-        tool_response = Mock()
-        tool_block = Mock()
-        tool_block.type = "tool_use"
-        tool_block.name = "search_course_content"
-        tool_block.id = "tool_123"
-        tool_block.input = {"query": "test"}
-
-        tool_response.content = [tool_block]
-        tool_response.stop_reason = "tool_use"
-
-        final_response = Mock()
-        text_block = Mock()
-        text_block.text = "Response despite tool error"
-        final_response.content = [text_block]
+        # Tool use response, then the final answer
+        mock_client = EnhancedMockAnthropicClient([
+            _tool("search_course_content", query="test"),
+            _text("Response despite tool error")
+        ])
 
-        mock_client.messages.create.side_effect = [tool_response, final_response]
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         # Tool manager that simulates error
         mock_tool_manager = MockToolManager(simulate_tool_error=True)
-        tools = mock_tool_manager.get_tool_definitions()
+        tools = _DEFAULT_TOOL_DEFS
 
         result = generator.generate_response(
             query="Test query",
@@ -203,76 +187,78 @@ class TestAIGeneratorWithTools:
 class TestAIGeneratorToolIntegration:
     """Test AIGenerator integration with real tool components"""
 
-    def test_with_real_tool_definitions(self):
+    def test_with_real_tool_definitions(self, make_gen, real_tools):
         """Test with real tool definitions from CourseSearchTool"""
-        from search_tools import CourseSearchTool
-        from mocks import MockVectorStore
+        # Mock the client to avoid actual API calls
+        mock_client = MockAnthropicClient(custom_response="Test response")
+        generator = make_gen(mock_client)
 
-        mock_store = MockVectorStore()
-        search_tool = CourseSearchTool(mock_store)
-        tool_definition = search_tool.get_tool_definition()
+        result = generator.generate_response(
+            query="Test query",
+            tools=real_tools[:1]
+        )
 
-        # Mock the client to avoid actual API calls
-        with patch('anthropic.Anthropic') as mock_anthropic_class:
-            mock_client = MockAnthropicClient(custom_response="Test response")
-            mock_anthropic_class.return_value = mock_client
+        assert result == "Test response"
+        # Should have valid tool definition in request
+        tools_in_request = mock_client.last_request_params.get("tools", [])
+        assert len(tools_in_request) == 1
+        assert tools_in_request[0]["name"] == "search_course_content"
 
-            generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-            generator.client = mock_client
+    def test_with_multiple_tools(self, make_gen, real_tools):
+        """Test with multiple tool definitions"""
+        mock_client = MockAnthropicClient(custom_response="Multi-tool response")
+        generator = make_gen(mock_client)
 
-            result = generator.generate_response(
-                query="Test query",
-                tools=[tool_definition]
-            )
+        result = generator.generate_response(
+            query="Test query",
+            tools=real_tools
+        )
 
-            assert result == "Test response"
-            # Should have valid tool definition in request
-            tools_in_request = mock_client.last_request_params.get("tools", [])
-            assert len(tools_in_request) == 1
-            assert tools_in_request[0]["name"] == "search_course_content"
+        assert result == "Multi-tool response"
+        # Should have both tools available
+        tools_in_request = mock_client.last_request_params.get("tools", [])
+        assert len(tools_in_request) == 2
+        tool_names = [tool["name"] for tool in tools_in_request]
+        assert "search_course_content" in tool_names
+        assert "get_course_outline" in tool_names
 
-    def test_with_multiple_tools(self):
-        """Test with multiple tool definitions"""
-        from search_tools import CourseSearchTool, CourseOutlineTool
-        from mocks import MockVectorStore
 
-        mock_store = MockVectorStore()
-        search_tool = CourseSearchTool(mock_store)
-        outline_tool = CourseOutlineTool(mock_store)
+class TestAIGeneratorDiagnostics:
+    """Diagnostic tests to identify common AI generator issues"""
 
-        tools = [search_tool.get_tool_definition(), outline_tool.get_tool_definition()]
+    def test_diagnose_anthropic_client_creation(self, monkeypatch):
+        """Test that the Anthropic client is created with the configured key"""
+        seen = {}
 
-        with patch('anthropic.Anthropic') as mock_anthropic_class:
-            mock_client = MockAnthropicClient(custom_response="Multi-tool response")
-            mock_anthropic_class.return_value = mock_client
+        def fake_anthropic(api_key, **kwargs):
+            seen["api_key"] = api_key
+            return Mock()
 
-            generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-            generator.client = mock_client
+        monkeypatch.setattr("anthropic.Anthropic", fake_anthropic)
+        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
 
-            result = generator.generate_response(
-                query="Test query",
-                tools=tools
-            )
+        assert seen["api_key"] == "test-api-key"
+        assert generator.client is not None
+        assert generator.base_params["model"] == "claude-3-sonnet-20240229"
 
-            assert result == "Multi-tool response"
-            # Should have both tools available
-            tools_in_request = mock_client.last_request_params.get("tools", [])
-            assert len(tools_in_request) == 2
-            tool_names = [tool["name"] for tool in tools_in_request]
-            assert "search_course_content" in tool_names
-            assert "get_course_outline" in tool_names
+    def test_prompt_caching_breakpoints(self, make_gen):
+        """Test that the static system prompt and tool schemas are marked for caching"""
+        mock_client = MockAnthropicClient(custom_response="Cached response")
 
+        generator = make_gen(mock_client)
 
-class TestAIGeneratorDiagnostics:
-    """Diagnostic tests to identify common AI generator issues"""
+        tools = _DEFAULT_TOOL_DEFS
+        generator.generate_response(query="Test query", tools=tools)
+
+        system_blocks = mock_client.last_request_params["system"]
+        assert len(system_blocks) == 1
+        assert system_blocks[0]["text"].startswith(AIGenerator.SYSTEM_PROMPT)
+        assert system_blocks[0]["cache_control"] == {"type": "ephemeral"}
 
-    def test_diagnose_anthropic_client_creation(self):
-        """Test if Anthropic client can be created"""
-        try:
-            generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-            assert generator.client is not None
-        except Exception as e:
-            pytest.fail(f"Anthropic client creation failed: {e}")
+        request_tools = mock_client.last_request_params["tools"]
+        assert request_tools[-1]["cache_control"] == {"type": "ephemeral"}
+        # Caller's tool definitions must not be mutated
+        assert "cache_control" not in tools[-1]
 
     def test_diagnose_system_prompt_validity(self):
         """Test if system prompt is valid and contains required elements"""
@@ -283,57 +269,16 @@ class TestAIGeneratorDiagnostics:
         assert len(system_prompt) > 0
 
         # Check for required elements
-        required_elements = [
-            "search_course_content",
-            "get_course_outline",
-            "Tool Usage Guidelines",
-            "Response Protocol"
-        ]
-
-        for element in required_elements:
-            assert element in system_prompt, f"Missing required element: {element}"
+        missing = [element for element in _PROMPT_TOOL_GUIDANCE + ("Response Protocol",)
+                   if element not in system_prompt]
+        assert not missing, f"Missing required elements: {missing}"
 
-    @patch('anthropic.Anthropic')
-    def test_diagnose_basic_request_format(self, mock_anthropic_class):
-        """Test if basic API request format is correct"""
+    def test_diagnose_request_format(self, make_gen):
+        """Test if basic and tool API request formats are correct"""
         mock_client = Mock()
-        mock_response = Mock()
-        mock_response.content = [Mock()]
-        mock_response.content[0].text = "Test response"
-        mock_response.stop_reason = "end_turn"
-        mock_client.messages.create.return_value = mock_response
-        mock_anthropic_class.return_value = mock_client
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        mock_client.messages.create.return_value = text_response("Test response")
 
-        try:
-            result = generator.generate_response(query="Test query")
-
-            # Check that request was made with correct format
-            call_args = mock_client.messages.create.call_args[1]
-            assert "model" in call_args
-            assert "messages" in call_args
-            assert "system" in call_args
-            assert len(call_args["messages"]) == 1
-            assert call_args["messages"][0]["role"] == "user"
-
-        except Exception as e:
-            pytest.fail(f"Basic request formatting failed: {e}")
-
-    @patch('anthropic.Anthropic')
-    def test_diagnose_tool_request_format(self, mock_anthropic_class):
-        """Test if tool request format is correct"""
-        mock_client = Mock()
-        mock_response = Mock()
-        mock_response.content = [Mock()]
-        mock_response.content[0].text = "Test response"
-        mock_response.stop_reason = "end_turn"
-        mock_client.messages.create.return_value = mock_response
-        mock_anthropic_class.return_value = mock_client
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         sample_tools = [{
             "name": "test_tool",
@@ -345,42 +290,175 @@ class TestAIGeneratorDiagnostics:
             }
         }]
 
-        try:
-            result = generator.generate_response(
-                query="Test query",
-                tools=sample_tools
-            )
+        generator.generate_response(query="Test query")
+        generator.generate_response(query="Test query", tools=sample_tools)
+
+        basic_args, tool_args = (call.kwargs for call in mock_client.messages.create.call_args_list)
+
+        # Check that the basic request was made with correct format
+        assert "model" in basic_args
+        assert "messages" in basic_args
+        assert "system" in basic_args
+        assert len(basic_args["messages"]) == 1
+        assert basic_args["messages"][0]["role"] == "user"
+
+        # Check that the tool request includes tools
+        assert "tools" in tool_args
+        assert "tool_choice" in tool_args
+        assert len(tool_args["tools"]) == 1
+        assert tool_args["tools"][0]["name"] == "test_tool"
+
+    def test_request_fragments_reused_across_rounds(self, make_gen):
+        """Test that system blocks and marked tools are the same objects on every round"""
+        mock_client = EnhancedMockAnthropicClient([
+            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"}},
+            {"type": "text", "content": "Final response"}
+        ], record_history=True)
+
+        generator = make_gen(mock_client)
+
+        mock_tool_manager = MockToolManager()
+        generator.generate_response(
+            query="Test query",
+            tools=_DEFAULT_TOOL_DEFS,
+            tool_manager=mock_tool_manager
+        )
+
+        first_call, second_call = mock_client.call_history
+        assert first_call["system"] is second_call["system"]
+        assert first_call["tools"] is second_call["tools"]
+        assert first_call["tool_choice"] is second_call["tool_choice"]
+
+    def test_token_efficient_tools_header(self, patched_anthropic):
+        """Test that the token-efficient tools beta header is only sent for Claude 3.7"""
+        tools = _DEFAULT_TOOL_DEFS
+
+        for model, expect_header in [("claude-3-7-sonnet-20250219", True),
+                                     ("claude-sonnet-4-20250514", False)]:
+            mock_client = MockAnthropicClient(custom_response="Test response")
+            patched_anthropic["client"] = mock_client
+
+            generator = AIGenerator("test-api-key", model)
+
+            generator.generate_response(query="Test query", tools=tools)
+            assert ("extra_headers" in mock_client.last_request_params) == expect_header
+
+            # Never sent on tool-less calls
+            generator.generate_response(query="Test query")
+            assert "extra_headers" not in mock_client.last_request_params
+
+    def test_request_bodies_serialized_with_orjson(self):
+        """Test that the client encodes JSON request bodies itself, keeping the content type"""
+        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
+        http_client = generator.client._client
 
-            # Check that request includes tools
-            call_args = mock_client.messages.create.call_args[1]
-            assert "tools" in call_args
-            assert "tool_choice" in call_args
-            assert len(call_args["tools"]) == 1
-            assert call_args["tools"][0]["name"] == "test_tool"
+        request = http_client.build_request(
+            "POST", "https://api.anthropic.com/v1/messages",
+            json={"messages": [{"role": "user", "content": "Qué es RAG?"}]},
+            headers={"X-Test": "1"}
+        )
 
-        except Exception as e:
-            pytest.fail(f"Tool request formatting failed: {e}")
+        assert request.content == '{"messages":[{"role":"user","content":"Qué es RAG?"}]}'.encode("utf-8")
+        assert request.headers.get_list("content-type") == ["application/json"]
 
 
 class TestSequentialToolCalling:
     """Test sequential tool calling functionality"""
 
-    @patch('anthropic.Anthropic')
-    def test_single_tool_call_termination(self, mock_anthropic_class):
-        """Verify that when Claude makes one tool call and returns a text response, it terminates correctly"""
+    def test_tool_rounds_use_smaller_token_cap(self, make_gen):
+        """Test that only the opening tool round is capped"""
+        response_sequence = [
+            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "first"}},
+            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "second"}},
+            {"type": "text", "content": "Final synthesis"}
+        ]
+
+        mock_client = EnhancedMockAnthropicClient(response_sequence, record_history=True)
+
+        generator = make_gen(mock_client)
+
+        mock_tool_manager = MockToolManager(mock_search_result="Tool result")
+        result = generator.generate_response(
+            query="Test query",
+            tools=_DEFAULT_TOOL_DEFS,
+            tool_manager=mock_tool_manager,
+            max_rounds=2
+        )
+
+        assert result == "Final synthesis"
+        caps = [call["max_tokens"] for call in mock_client.call_history]
+        assert caps == [AIGenerator.TOOL_ROUND_MAX_TOKENS, 800, 800]
+
+    def test_long_answer_after_search_costs_one_call(self, make_gen):
+        """Test that an answer written in round 2 is generated once, at the full budget"""
+        long_answer = " ".join(["word"] * 600)
         response_sequence = [
             {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"}},
-            {"type": "text", "content": "Final response after tool use"}
+            {"type": "text", "content": long_answer}
+        ]
+
+        mock_client = EnhancedMockAnthropicClient(response_sequence, record_history=True)
+
+        generator = make_gen(mock_client)
+
+        mock_tool_manager = MockToolManager(mock_search_result="Tool result")
+        result = generator.generate_response(
+            query="Explain the lesson in depth",
+            tools=_DEFAULT_TOOL_DEFS,
+            tool_manager=mock_tool_manager,
+            max_rounds=2
+        )
+
+        assert result == long_answer
+        assert mock_client.call_count == 2
+        assert mock_client.call_history[1]["max_tokens"] == 800
+        assert "tools" in mock_client.call_history[1]
+
+    def test_truncated_tool_round_continued(self, make_gen):
+        """Test that a direct answer cut off by the tool-round cap is continued, not regenerated"""
+        response_sequence = [
+            {"type": "text", "content": "Machine learning is ", "stop_reason": "max_tokens"},
+            {"type": "text", "content": " a way of learning from data"}
         ]
 
+        mock_client = EnhancedMockAnthropicClient(response_sequence, record_history=True)
+
+        generator = make_gen(mock_client)
+
+        mock_tool_manager = MockToolManager()
+        result = generator.generate_response(
+            query="Explain machine learning in depth",
+            tools=_DEFAULT_TOOL_DEFS,
+            tool_manager=mock_tool_manager
+        )
+
+        assert result == "Machine learning is a way of learning from data"
+        assert mock_client.call_count == 2
+        continuation = mock_client.call_history[1]
+        assert continuation["max_tokens"] == 800 - AIGenerator.TOOL_ROUND_MAX_TOKENS
+        assert continuation["messages"][-1] == {"role": "assistant", "content": "Machine learning is"}
+        assert "tools" in continuation
+
+    @pytest.mark.parametrize("response_sequence,expected_tools,expected_result", [
+        # One tool call, then a text answer
+        ([_tool("search_course_content", query="test"), _text("Final response after tool use")],
+         ["search_course_content"], "Final response after tool use"),
+        # Stops after exactly 2 tool rounds with a final summary call
+        ([_tool("search_course_content", query="test1"),
+          _tool("search_course_content", query="test2"),
+          _text("Final summary after max rounds")],
+         ["search_course_content", "search_course_content"], "Final summary after max rounds"),
+        # Claude answers directly without tools
+        ([_text("Direct answer without tools")], [], "Direct answer without tools"),
+    ], ids=["single_tool_call", "max_rounds", "no_tool_use"])
+    def test_sequential_termination(self, make_gen, response_sequence, expected_tools, expected_result):
+        """Verify each round sequence executes the expected tools and terminates with the final text"""
         mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         mock_tool_manager = MockToolManager(mock_search_result="Tool result")
-        tools = mock_tool_manager.get_tool_definitions()
+        tools = _DEFAULT_TOOL_DEFS
 
         result = generator.generate_response(
             query="Test query",
@@ -388,14 +466,12 @@ class TestSequentialToolCalling:
             tool_manager=mock_tool_manager
         )
 
-        # Verify external behavior
-        assert result == "Final response after tool use"
-        assert mock_client.call_count == 2  # Tool call + final response
-        assert mock_tool_manager.execution_count == 1
-        assert mock_tool_manager.execution_history[0]["tool_name"] == "search_course_content"
+        # One call per tool round plus the final response
+        assert result == expected_result
+        assert mock_client.call_count == len(expected_tools) + 1
+        assert [record["tool_name"] for record in mock_tool_manager.execution_history] == expected_tools
 
-    @patch('anthropic.Anthropic')
-    def test_two_round_sequential_calls(self, mock_anthropic_class):
+    def test_two_round_sequential_calls(self, make_gen):
         """Test full 2-round scenario (outline → search → final response)"""
         response_sequence = [
             {"type": "tool_use", "tool": "get_course_outline", "params": {"course_name": "Course A"}},
@@ -403,14 +479,12 @@ class TestSequentialToolCalling:
             {"type": "text", "content": "Comprehensive response based on both tools"}
         ]
 
-        mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
+        mock_client = EnhancedMockAnthropicClient(response_sequence, record_history=True)
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         mock_tool_manager = MockToolManager(mock_search_result="Tool result")
-        tools = mock_tool_manager.get_tool_definitions()
+        tools = _DEFAULT_TOOL_DEFS
 
         result = generator.generate_response(
             query="Compare courses",
@@ -432,78 +506,93 @@ class TestSequentialToolCalling:
         mock_client.verify_message_context(1, 3)  # After round 1: user + assistant + tool result
         mock_client.verify_message_context(2, 5)  # After round 2: + assistant + tool result
 
-    @patch('anthropic.Anthropic')
-    def test_max_rounds_termination(self, mock_anthropic_class):
-        """Verify termination after exactly 2 tool rounds"""
-        response_sequence = [
-            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test1"}},
-            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test2"}},
-            {"type": "text", "content": "Final summary after max rounds"}
-        ]
+    def test_parallel_tool_calls_in_one_response(self, make_gen):
+        """Test that multiple tool_use blocks in one response run concurrently and keep order"""
+        mock_client = Mock()
 
-        mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
+        tool_response = FakeResponse(
+            content=[
+                FakeContentBlock(type="tool_use", name="search_course_content", id=f"tool_{index}",
+                                 input={"query": "introduction", "course_name": course})
+                for index, course in enumerate(["Course A", "Course B"])
+            ],
+            stop_reason="tool_use"
+        )
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        mock_client.messages.create.side_effect = [tool_response, text_response("Comparison of both courses")]
 
-        mock_tool_manager = MockToolManager(mock_search_result="Tool result")
-        tools = mock_tool_manager.get_tool_definitions()
+        generator = make_gen(mock_client)
+
+        # Both calls must be in flight at once to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def execute_tool(tool_name, **kwargs):
+            barrier.wait()
+            return f"Results for {kwargs['course_name']}"
+
+        mock_tool_manager = Mock()
+        mock_tool_manager.execute_tool.side_effect = execute_tool
 
         result = generator.generate_response(
-            query="Complex query requiring multiple searches",
-            tools=tools,
+            query="Compare the introductions of Course A and Course B",
+            tools=_DEFAULT_TOOL_DEFS,
             tool_manager=mock_tool_manager
         )
 
-        # Should stop after 2 rounds regardless of more tool requests
-        assert mock_client.call_count == 3  # 2 tool rounds + final summary call
-        assert mock_tool_manager.execution_count == 2  # Only 2 tools executed
-        assert result == "Final summary after max rounds"
-
-    @patch('anthropic.Anthropic')
-    def test_no_tools_termination(self, mock_anthropic_class):
-        """Test termination when Claude responds without tools"""
-        response_sequence = [
-            {"type": "text", "content": "Direct answer without tools"}
-        ]
+        assert result == "Comparison of both courses"
+        assert mock_tool_manager.execute_tool.call_count == 2
+
+        final_messages = mock_client.messages.create.call_args_list[1][1]["messages"]
+        tool_results = final_messages[-1]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["tool_0", "tool_1"]
+        assert [r["content"] for r in tool_results] == ["Results for Course A", "Results for Course B"]
+
+    def test_parallel_tool_calls_keep_all_sources(self, make_gen):
+        """Test that sources from concurrent calls are all kept, in block order"""
+        tool_response = FakeResponse(
+            content=[
+                FakeContentBlock(type="tool_use", name="get_course_outline", id="tool_0",
+                                 input={"course_title": "Test Course"}),
+                FakeContentBlock(type="tool_use", name="search_course_content", id="tool_1",
+                                 input={"query": "introduction"})
+            ],
+            stop_reason="tool_use"
+        )
 
-        mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
+        mock_client = Mock()
+        mock_client.messages.create.side_effect = [tool_response, text_response("Outline and content")]
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
-        mock_tool_manager = MockToolManager()
-        tools = mock_tool_manager.get_tool_definitions()
+        tool_manager = ToolManager()
+        tool_manager.register_tool(CourseSearchTool(MockVectorStore()))
+        tool_manager.register_tool(CourseOutlineTool(MockVectorStore()))
 
         result = generator.generate_response(
-            query="Simple question",
-            tools=tools,
-            tool_manager=mock_tool_manager
+            query="Outline and introduction of Test Course",
+            tools=tool_manager.get_tool_definitions(),
+            tool_manager=tool_manager
         )
 
-        # Should terminate immediately
-        assert mock_client.call_count == 1
-        assert mock_tool_manager.execution_count == 0
-        assert result == "Direct answer without tools"
+        assert result == "Outline and content"
+        assert [source["text"] for source in tool_manager.get_last_sources()] == [
+            "Test Course - Course Outline",
+            "Test Course - Lesson 1"
+        ]
 
-    @patch('anthropic.Anthropic')
-    def test_conversation_context_preservation(self, mock_anthropic_class):
+    def test_conversation_context_preservation(self, make_gen):
         """Verify that conversation history is maintained across rounds"""
         response_sequence = [
             {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"}},
             {"type": "text", "content": "Response with context"}
         ]
 
-        mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
+        mock_client = EnhancedMockAnthropicClient(response_sequence, record_history=True)
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         mock_tool_manager = MockToolManager()
-        tools = mock_tool_manager.get_tool_definitions()
+        tools = _DEFAULT_TOOL_DEFS
 
         history = "User: Previous question\nAssistant: Previous answer"
         result = generator.generate_response(
@@ -513,18 +602,81 @@ class TestSequentialToolCalling:
             tool_manager=mock_tool_manager
         )
 
-        # Check that history was included in system prompt for all calls
+        # Check that history was replayed ahead of the query for all calls
         for call_params in mock_client.call_history:
-            assert history in call_params["system"]
+            assert call_params["messages"][0]["content"] == "Previous question"
+            assert call_params["messages"][1]["content"] == "Previous answer"
 
         assert result == "Response with context"
 
 
+class TestStreamingResponses:
+    """Test streamed response generation"""
+
+    def test_stream_without_tools(self, make_gen):
+        """Test that a direct answer is yielded incrementally"""
+        mock_client = EnhancedMockAnthropicClient([
+            {"type": "text", "content": "Direct streamed answer"}
+        ])
+
+        generator = make_gen(mock_client)
+
+        chunks = list(generator.generate_response_stream(query="Simple question"))
+
+        assert len(chunks) > 1
+        assert "".join(chunks) == "Direct streamed answer"
+        assert mock_client.call_count == 1
+
+    def test_stream_with_tool_rounds(self, make_gen):
+        """Test that tool rounds run between streams and only the answer is yielded"""
+        mock_client = EnhancedMockAnthropicClient([
+            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"}},
+            {"type": "text", "content": "Answer after tool use"}
+        ])
+
+        generator = make_gen(mock_client)
+
+        mock_tool_manager = MockToolManager(mock_search_result="Tool result")
+
+        result = "".join(generator.generate_response_stream(
+            query="Test query",
+            tools=_DEFAULT_TOOL_DEFS,
+            tool_manager=mock_tool_manager
+        ))
+
+        assert result == "Answer after tool use"
+        assert mock_client.call_count == 2
+        assert mock_tool_manager.execution_count == 1
+
+    def test_stream_skips_tool_round_preamble(self, patched_anthropic):
+        """Test that text written before a tool call is not streamed or cached"""
+        mock_client = EnhancedMockAnthropicClient([
+            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"},
+             "text": "Let me search the course materials."},
+            {"type": "text", "content": "Final answer."}
+        ])
+        patched_anthropic["client"] = mock_client
+
+        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229",
+                                SemanticResponseCache(mock_embedding_function))
+
+        mock_tool_manager = MockToolManager(mock_search_result="Tool result")
+        tools = _DEFAULT_TOOL_DEFS
+
+        streamed = "".join(generator.generate_response_stream(
+            query="Test query", tools=tools, tool_manager=mock_tool_manager
+        ))
+        cached = generator.generate_response(query="Test query", tools=tools, tool_manager=mock_tool_manager)
+
+        assert streamed == "Final answer."
+        assert cached == "Final answer."
+        assert mock_client.call_count == 2
+
+
 class TestSequentialToolErrorHandling:
     """Test error scenarios and graceful degradation"""
 
-    @patch('anthropic.Anthropic')
-    def test_first_round_tool_error_recovery(self, mock_anthropic_class):
+    def test_first_round_tool_error_recovery(self, make_gen):
         """Tool fails in first round, should handle gracefully"""
         response_sequence = [
             {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"}},
@@ -532,14 +684,14 @@ class TestSequentialToolErrorHandling:
         ]
 
         mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
-        # Tool manager that simulates error
-        mock_tool_manager = MockToolManager(simulate_tool_error=True)
-        tools = mock_tool_manager.get_tool_definitions()
+        # Tool manager whose call fails the way ToolManager reports failures;
+        # a plain error string is passed on to Claude as content instead
+        mock_tool_manager = Mock()
+        mock_tool_manager.execute_tool.return_value = ToolError("Tool execution failed")
+        tools = _DEFAULT_TOOL_DEFS
 
         result = generator.generate_response(
             query="Test query",
@@ -551,18 +703,80 @@ class TestSequentialToolErrorHandling:
         assert "course materials" in result or "Response despite tool error" in result
         assert mock_client.call_count == 1  # Should terminate after tool error
 
-    @patch('anthropic.Anthropic')
-    def test_tool_execution_exception_handling(self, mock_anthropic_class):
+    def test_tool_error_result_terminates(self, make_gen):
+        """Test that a ToolError result stops the loop without another API call"""
+        response_sequence = [
+            {"type": "tool_use", "tool": "get_course_outline", "params": {"course_title": "Missing"}},
+            {"type": "text", "content": "Should not be reached"}
+        ]
+
+        mock_client = EnhancedMockAnthropicClient(response_sequence)
+
+        generator = make_gen(mock_client)
+
+        mock_tool_manager = Mock()
+        mock_tool_manager.execute_tool.return_value = ToolError("Course 'Missing' could not be resolved")
+
+        result = generator.generate_response(
+            query="Outline of the missing course",
+            tools=_DEFAULT_TOOL_DEFS,
+            tool_manager=mock_tool_manager
+        )
+
+        assert result == AIGenerator.TOOL_FAILURE_MESSAGE
+        assert mock_client.call_count == 1
+
+    def test_not_found_in_course_content_is_not_an_error(self, make_gen):
+        """Test that retrieved text mentioning "not found" is passed on, not treated as failure"""
+        mock_client = EnhancedMockAnthropicClient([
+            {"type": "tool_use", "tool": "search_course_content", "params": {"query": "404 not found errors"}},
+            {"type": "text", "content": "Explanation of 404 errors"}
+        ])
+
+        generator = make_gen(mock_client)
+
+        tool_manager = ToolManager()
+        tool_manager.register_tool(CourseSearchTool(MockVectorStore()))
+
+        result = generator.generate_response(
+            query="Why do I get 404 not found errors?",
+            tools=tool_manager.get_tool_definitions(),
+            tool_manager=tool_manager
+        )
+
+        assert result == "Explanation of 404 errors"
+        assert mock_client.call_count == 2
+
+    def test_unknown_course_is_not_an_error(self, make_gen):
+        """Test that a course the tools can't find is passed on to Claude, not treated as failure"""
+        mock_client = EnhancedMockAnthropicClient([
+            {"type": "tool_use", "tool": "get_course_outline", "params": {"course_title": "Quantum Cooking"}},
+            {"type": "text", "content": "There is no Quantum Cooking course"}
+        ])
+
+        generator = make_gen(mock_client)
+
+        tool_manager = ToolManager()
+        tool_manager.register_tool(CourseOutlineTool(MockVectorStore()))
+
+        result = generator.generate_response(
+            query="Outline of Quantum Cooking",
+            tools=tool_manager.get_tool_definitions(),
+            tool_manager=tool_manager
+        )
+
+        assert result == "There is no Quantum Cooking course"
+        assert mock_client.call_count == 2
+
+    def test_tool_execution_exception_handling(self, make_gen):
         """Test handling of tool execution exceptions"""
         response_sequence = [
             {"type": "tool_use", "tool": "search_course_content", "params": {"query": "test"}},
         ]
 
         mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         # Mock tool manager that raises exception
         mock_tool_manager = Mock()
@@ -583,12 +797,8 @@ class TestSequentialToolErrorHandling:
 class TestSequentialToolIntegration:
     """Test integration with real tool definitions and complex scenarios"""
 
-    @patch('anthropic.Anthropic')
-    def test_with_real_tool_definitions(self, mock_anthropic_class):
+    def test_with_real_tool_definitions(self, make_gen, real_tools):
         """Test with real tool definitions from search tools"""
-        from search_tools import CourseSearchTool, CourseOutlineTool
-        from mocks import MockVectorStore
-
         response_sequence = [
             {"type": "tool_use", "tool": "get_course_outline", "params": {"course_name": "Test Course"}},
             {"type": "tool_use", "tool": "search_course_content", "params": {"query": "introduction"}},
@@ -596,23 +806,15 @@ class TestSequentialToolIntegration:
         ]
 
         mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
 
-        # Use real tool definitions
-        mock_store = MockVectorStore()
-        search_tool = CourseSearchTool(mock_store)
-        outline_tool = CourseOutlineTool(mock_store)
+        generator = make_gen(mock_client)
 
         # Mock tool manager that can handle real tool calls
         mock_tool_manager = MockToolManager(mock_search_result="Real tool result")
-        tools = [search_tool.get_tool_definition(), outline_tool.get_tool_definition()]
 
         result = generator.generate_response(
             query="Complex query",
-            tools=tools,
+            tools=real_tools,
             tool_manager=mock_tool_manager
         )
 
@@ -624,8 +826,7 @@ class TestSequentialToolIntegration:
         assert mock_tool_manager.execution_history[0]["tool_name"] == "get_course_outline"
         assert mock_tool_manager.execution_history[1]["tool_name"] == "search_course_content"
 
-    @patch('anthropic.Anthropic')
-    def test_course_comparison_scenario(self, mock_anthropic_class):
+    def test_course_comparison_scenario(self, make_gen):
         """Test realistic course comparison scenario"""
         response_sequence = [
             {"type": "tool_use", "tool": "search_course_content",
@@ -636,13 +837,11 @@ class TestSequentialToolIntegration:
         ]
 
         mock_client = EnhancedMockAnthropicClient(response_sequence)
-        mock_anthropic_class.return_value = mock_client
 
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+        generator = make_gen(mock_client)
 
         mock_tool_manager = MockToolManager(mock_search_result="Course content")
-        tools = mock_tool_manager.get_tool_definitions()
+        tools = _DEFAULT_TOOL_DEFS
 
         result = generator.generate_response(
             query="Compare the introduction content between Course A and Course B",
@@ -665,59 +864,33 @@ class TestSequentialToolIntegration:
 class TestBackwardCompatibility:
     """Ensure existing single-call behavior still works"""
 
-    @patch('anthropic.Anthropic')
-    def test_single_call_behavior_unchanged(self, mock_anthropic_class):
-        """Verify single tool calls work exactly as before"""
-        mock_client = MockAnthropicClient(simulate_tool_use=True, custom_response="Single tool response")
-        mock_anthropic_class.return_value = mock_client
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
+    @pytest.mark.parametrize("client_kwargs,request_kwargs,tool_rounds,expected_calls,expected_result", [
+        # Old interface without max_rounds: this mock requests a tool on every
+        # call, so both default rounds run before the final tool-free answer
+        ({"simulate_tool_use": True, "custom_response": "Single tool response"},
+         {"query": "Simple query", "tools": _DEFAULT_TOOL_DEFS}, 2, 3, None),
+        # No-tool responses work as before
+        ({"simulate_tool_use": False, "custom_response": "Direct response"},
+         {"query": "Simple question"}, 0, 1, "Direct response"),
+        # All original API parameters still work
+        ({"custom_response": "Compatible response"},
+         {"query": "Test query", "conversation_history": "Previous: conversation",
+          "tools": [{"name": "test_tool"}], "tool_manager": None}, 0, 1, "Compatible response"),
+    ], ids=["single_call_behavior", "no_tools_behavior", "original_api"])
+    def test_behavior_unchanged(self, make_gen, client_kwargs, request_kwargs, tool_rounds,
+                                expected_calls, expected_result):
+        """Verify the original single-call interface behaves exactly as before"""
+        mock_client = MockAnthropicClient(**client_kwargs)
+
+        generator = make_gen(mock_client)
 
         mock_tool_manager = MockToolManager(mock_search_result="Tool result")
-        tools = mock_tool_manager.get_tool_definitions()
-
-        # Use old interface without max_rounds parameter
-        result = generator.generate_response(
-            query="Simple query",
-            tools=tools,
-            tool_manager=mock_tool_manager
-        )
-
-        # Should still work as before
-        assert mock_client.call_count == 2  # Tool use + final response
-        assert mock_tool_manager.execution_count == 1
+        if tool_rounds:
+            request_kwargs = {**request_kwargs, "tool_manager": mock_tool_manager}
 
-    @patch('anthropic.Anthropic')
-    def test_no_tools_behavior_unchanged(self, mock_anthropic_class):
-        """Verify no-tool responses work exactly as before"""
-        mock_client = MockAnthropicClient(simulate_tool_use=False, custom_response="Direct response")
-        mock_anthropic_class.return_value = mock_client
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
-
-        result = generator.generate_response(query="Simple question")
-
-        assert result == "Direct response"
-        assert mock_client.call_count == 1
-
-    @patch('anthropic.Anthropic')
-    def test_original_api_compatibility(self, mock_anthropic_class):
-        """Test that all original API parameters still work"""
-        mock_client = MockAnthropicClient(custom_response="Compatible response")
-        mock_anthropic_class.return_value = mock_client
-
-        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229")
-        generator.client = mock_client
-
-        # Test all original parameters still work
-        result = generator.generate_response(
-            query="Test query",
-            conversation_history="Previous: conversation",
-            tools=[{"name": "test_tool"}],
-            tool_manager=None
-        )
+        result = generator.generate_response(**request_kwargs)
 
-        assert result == "Compatible response"
-        assert mock_client.call_count == 1
\ No newline at end of file
+        assert mock_client.call_count == expected_calls
+        assert mock_tool_manager.execution_count == tool_rounds
+        if expected_result is not None:
+            assert result == expected_result
\ No newline at end of file
@@ -5,85 +5,67 @@ Tests the REST API endpoints for proper request/response handling,
 error cases, and integration with the RAG system components.
 """
 
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch
 import json
+import orjson
+
+from conftest import SAMPLE_QUERY_RESPONSE, TEST_QUERIES
+from mocks import RaisingStub
+
+# 10KB query, encoded once at import so the test doesn't json.dumps it per request
+_LARGE_QUERY = "A" * 10000
+_LARGE_PAYLOAD_BODY = orjson.dumps({"query": _LARGE_QUERY, "session_id": "test-session"})
 
 
 @pytest.mark.api
 class TestQueryEndpoint:
     """Test cases for the /api/query endpoint"""
 
-    def test_query_with_session_id(self, client, mock_rag_system, sample_query_response):
-        """Test query endpoint with provided session ID"""
-        # Configure mock response
-        mock_rag_system.query.return_value = (
-            sample_query_response["answer"],
-            sample_query_response["sources"]
-        )
-
-        # Make request
-        response = client.post("/api/query", json={
-            "query": "What is machine learning?",
-            "session_id": "test-session-123"
-        })
+    @pytest.mark.parametrize("body,mock_return,expected_sources,expected_session_id", [
+        # Provided session ID is used as-is
+        ({"query": "What is machine learning?", "session_id": "test-session-123"},
+         (SAMPLE_QUERY_RESPONSE["answer"], SAMPLE_QUERY_RESPONSE["sources"]),
+         SAMPLE_QUERY_RESPONSE["sources"], "test-session-123"),
+        # Missing session ID - a new session is created (ID from mock)
+        ({"query": "Explain neural networks"},
+         (SAMPLE_QUERY_RESPONSE["answer"], SAMPLE_QUERY_RESPONSE["sources"]),
+         SAMPLE_QUERY_RESPONSE["sources"], "test-session-123"),
+        # String sources are wrapped (backward compatibility)
+        ({"query": "Test query", "session_id": "test-session"},
+         ("Test answer", ["String source 1", "String source 2"]),
+         [{"text": "String source 1", "link": None}, {"text": "String source 2", "link": None}],
+         "test-session"),
+        # Empty query string
+        ({"query": "", "session_id": "test-session"},
+         ("No results found", []), [], "test-session"),
+    ], ids=["with_session_id", "without_session_id", "string_sources", "empty_query"])
+    def test_query(self, client, mock_rag_system, body, mock_return, expected_sources, expected_session_id):
+        """Test query endpoint responses for valid requests"""
+        mock_rag_system.query.return_value = mock_return
+
+        response = client.post("/api/query", json=body)
 
-        # Assertions
         assert response.status_code == 200
         data = response.json()
-        assert data["answer"] == sample_query_response["answer"]
-        assert data["sources"] == sample_query_response["sources"]
-        assert data["session_id"] == "test-session-123"
+        assert data["answer"] == mock_return[0]
+        assert data["sources"] == expected_sources
+        assert data["session_id"] == expected_session_id
 
-        # Verify RAG system was called correctly
-        mock_rag_system.query.assert_called_once_with(
-            "What is machine learning?", "test-session-123"
-        )
+        # A session is only created when the request has none
+        assert mock_rag_system.session_manager.create_session.call_count == (0 if "session_id" in body else 1)
+        mock_rag_system.query.assert_called_once_with(body["query"], expected_session_id)
 
-    def test_query_without_session_id(self, client, mock_rag_system, sample_query_response):
-        """Test query endpoint without session ID - should create new session"""
-        # Configure mock response
-        mock_rag_system.query.return_value = (
-            sample_query_response["answer"],
-            sample_query_response["sources"]
-        )
+    @pytest.mark.parametrize("query", TEST_QUERIES)
+    def test_query_passes_query_through(self, client, mock_rag_system, query):
+        """Test each sample query reaches the RAG system unchanged"""
+        mock_rag_system.query.return_value = ("Answer", [])
 
-        # Make request without session_id
-        response = client.post("/api/query", json={
-            "query": "Explain neural networks"
-        })
+        response = client.post("/api/query", json={"query": query, "session_id": "test-session-123"})
 
-        # Assertions
         assert response.status_code == 200
-        data = response.json()
-        assert data["answer"] == sample_query_response["answer"]
-        assert data["session_id"] == "test-session-123"  # From mock
-
-        # Verify session was created
-        mock_rag_system.session_manager.create_session.assert_called_once()
-        mock_rag_system.query.assert_called_once_with(
-            "Explain neural networks", "test-session-123"
-        )
-
-    def test_query_with_string_sources(self, client, mock_rag_system):
-        """Test query endpoint with string sources (backward compatibility)"""
-        # Configure mock response with string sources
-        mock_rag_system.query.return_value = (
-            "Test answer",
-            ["String source 1", "String source 2"]
-        )
-
-        response = client.post("/api/query", json={
-            "query": "Test query",
-            "session_id": "test-session"
-        })
-
-        assert response.status_code == 200
-        data = response.json()
-        assert len(data["sources"]) == 2
-        assert data["sources"][0] == {"text": "String source 1", "link": None}
-        assert data["sources"][1] == {"text": "String source 2", "link": None}
+        mock_rag_system.query.assert_called_once_with(query, "test-session-123")
 
     def test_query_missing_query_field(self, client):
         """Test query endpoint with missing query field"""
@@ -93,23 +75,9 @@ class TestQueryEndpoint:
 
         assert response.status_code == 422  # Validation error
 
-    def test_query_empty_query(self, client, mock_rag_system):
-        """Test query endpoint with empty query string"""
-        mock_rag_system.query.return_value = ("No results found", [])
-
-        response = client.post("/api/query", json={
-            "query": "",
-            "session_id": "test-session"
-        })
-
-        assert response.status_code == 200
-        data = response.json()
-        assert data["answer"] == "No results found"
-        assert data["sources"] == []
-
     def test_query_rag_system_exception(self, client, mock_rag_system):
         """Test query endpoint when RAG system raises exception"""
-        mock_rag_system.query.side_effect = Exception("RAG system error")
+        mock_rag_system.query = RaisingStub(Exception("RAG system error"))
 
         response = client.post("/api/query", json={
             "query": "Test query",
@@ -129,6 +97,38 @@ class TestQueryEndpoint:
 
 
 @pytest.mark.api
+class TestQueryStreamEndpoint:
+    """Test the streaming /api/query/stream endpoint"""
+
+    def test_stream_emits_text_then_done(self, client, mock_rag_system):
+        """Test that answer text arrives as events followed by sources and session"""
+        mock_rag_system.query_stream.return_value = iter([
+            {"type": "text", "text": "Machine learning "},
+            {"type": "text", "text": "is a subset of AI."},
+            {"type": "sources", "sources": [{"text": "Test Course - Lesson 1", "link": None}]}
+        ])
+
+        response = client.post("/api/query/stream", json={"query": "What is machine learning?"})
+
+        assert response.status_code == 200
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert "".join(e["text"] for e in events if e["type"] == "text") == "Machine learning is a subset of AI."
+        assert events[-1] == {
+            "type": "done",
+            "sources": [{"text": "Test Course - Lesson 1", "link": None}],
+            "session_id": "test-session-123"
+        }
+
+    def test_stream_reports_errors_in_band(self, client, mock_rag_system):
+        """Test that a failure after the stream starts is sent as an error event"""
+        mock_rag_system.query_stream = RaisingStub(Exception("RAG system error"))
+
+        response = client.post("/api/query/stream", json={"query": "What is machine learning?"})
+
+        assert response.status_code == 200
+        assert json.loads(response.text.splitlines()[-1]) == {"type": "error", "detail": "RAG system error"}
+
+
 class TestCoursesEndpoint:
     """Test cases for the /api/courses endpoint"""
 
@@ -161,7 +161,7 @@ class TestCoursesEndpoint:
 
     def test_get_courses_exception(self, client, mock_rag_system):
         """Test course endpoint when analytics raises exception"""
-        mock_rag_system.get_course_analytics.side_effect = Exception("Analytics error")
+        mock_rag_system.get_course_analytics = RaisingStub(Exception("Analytics error"))
 
         response = client.get("/api/courses")
 
@@ -173,9 +173,10 @@ class TestCoursesEndpoint:
 class TestRootEndpoint:
     """Test cases for the root endpoint"""
 
-    def test_root_endpoint(self, client):
+    @pytest.mark.anyio
+    async def test_root_endpoint(self, async_client):
         """Test root endpoint returns basic message"""
-        response = client.get("/")
+        response = await async_client.get("/")
 
         assert response.status_code == 200
         data = response.json()
@@ -186,17 +187,8 @@ class TestRootEndpoint:
 class TestCORSHeaders:
     """Test CORS middleware functionality"""
 
-    def test_cors_headers_present(self, client):
-        """Test that CORS headers are properly set"""
-        response = client.options("/api/query")
-
-        # Should have CORS headers
-        assert "access-control-allow-origin" in response.headers
-        assert "access-control-allow-methods" in response.headers
-        assert "access-control-allow-headers" in response.headers
-
     def test_preflight_request(self, client):
-        """Test CORS preflight request handling"""
+        """Test CORS preflight handling and headers with a single request"""
         response = client.options("/api/query", headers={
             "Origin": "http://localhost:3000",
             "Access-Control-Request-Method": "POST",
@@ -205,39 +197,43 @@ class TestCORSHeaders:
 
         assert response.status_code == 200
 
+        # Should have CORS headers
+        assert "access-control-allow-origin" in response.headers
+        assert "access-control-allow-methods" in response.headers
+        assert "access-control-allow-headers" in response.headers
+
 
 @pytest.mark.api
 class TestErrorHandling:
     """Test error handling across endpoints"""
 
-    def test_404_endpoint(self, client):
+    @pytest.mark.anyio
+    async def test_404_endpoint(self, async_client):
         """Test non-existent endpoint returns 404"""
-        response = client.get("/api/nonexistent")
+        response = await async_client.get("/api/nonexistent")
 
         assert response.status_code == 404
 
-    def test_method_not_allowed(self, client):
+    @pytest.mark.anyio
+    async def test_method_not_allowed(self, async_client):
         """Test wrong HTTP method returns 405"""
-        response = client.get("/api/query")  # Should be POST
+        response = await async_client.get("/api/query")  # Should be POST
 
         assert response.status_code == 405
 
     def test_large_payload(self, client, mock_rag_system):
         """Test handling of large query payloads"""
-        large_query = "A" * 10000  # 10KB query
         mock_rag_system.query.return_value = ("Large query processed", [])
 
-        response = client.post("/api/query", json={
-            "query": large_query,
-            "session_id": "test-session"
-        })
+        response = client.post("/api/query",
+                               content=_LARGE_PAYLOAD_BODY,
+                               headers={"Content-Type": "application/json"})
 
         assert response.status_code == 200
-        mock_rag_system.query.assert_called_once_with(large_query, "test-session")
+        mock_rag_system.query.assert_called_once_with(_LARGE_QUERY, "test-session")
 
 
 @pytest.mark.api
-@pytest.mark.integration
 class TestEndToEndWorkflow:
     """Integration tests for typical API workflows"""
 
@@ -272,18 +268,19 @@ class TestEndToEndWorkflow:
         session_id = query_data["session_id"]
         assert session_id == "test-session-123"
 
-    def test_session_continuity(self, client, mock_rag_system):
+    @pytest.mark.anyio
+    async def test_session_continuity(self, async_client, mock_rag_system):
         """Test that session ID is maintained across requests"""
         mock_rag_system.query.return_value = ("Response", [])
 
         # First query - get session ID
-        response1 = client.post("/api/query", json={
+        response1 = await async_client.post("/api/query", json={
             "query": "First question"
         })
         session_id = response1.json()["session_id"]
 
         # Second query - use same session ID
-        response2 = client.post("/api/query", json={
+        response2 = await async_client.post("/api/query", json={
             "query": "Follow-up question",
             "session_id": session_id
         })
@@ -295,4 +292,19 @@ class TestEndToEndWorkflow:
         assert mock_rag_system.query.call_count == 2
         calls = mock_rag_system.query.call_args_list
         assert calls[0][0][1] == session_id  # First call
-        assert calls[1][0][1] == session_id  # Second call
\ No newline at end of file
+        assert calls[1][0][1] == session_id  # Second call
+
+    @pytest.mark.anyio
+    async def test_concurrent_queries_keep_sessions_isolated(self, async_client, mock_rag_system):
+        """Test that concurrent queries each get the answer for their own session"""
+        mock_rag_system.query.side_effect = lambda query, session_id: (f"Answer for {session_id}", [])
+
+        responses = await asyncio.gather(*[
+            async_client.post("/api/query", json={"query": f"Question {i}", "session_id": f"session-{i}"})
+            for i in range(20)
+        ])
+
+        assert all(response.status_code == 200 for response in responses)
+        for i, response in enumerate(responses):
+            assert response.json()["answer"] == f"Answer for session-{i}"
+            assert response.json()["session_id"] == f"session-{i}"
@@ -2,10 +2,12 @@
 Comprehensive tests for CourseSearchTool to diagnose content query failures
 """
 import pytest
-from unittest.mock import Mock, patch
-from search_tools import CourseSearchTool, ToolManager
-from vector_store import SearchResults
-from mocks import MockVectorStore
+from unittest.mock import Mock
+from search_tools import CourseSearchTool, CourseOutlineTool, ToolManager, ToolError, NO_CONTENT_MSG
+from vector_store import SearchResults, VectorStore
+from config import config
+from models import Course, Lesson, CourseChunk
+from mocks import FakeEmbeddingFunction, MockVectorStore
 
 
 class TestCourseSearchToolBasic:
@@ -38,6 +40,14 @@ class TestCourseSearchToolBasic:
         assert "query" in schema["required"]
         assert "query" in schema["properties"]
 
+    def test_tool_definition_shared_across_instances(self):
+        """Test that the static definition is built once, not per call"""
+        first = CourseSearchTool(MockVectorStore())
+        second = CourseSearchTool(MockVectorStore())
+
+        assert first.get_tool_definition() is first.get_tool_definition()
+        assert first.get_tool_definition() is second.get_tool_definition()
+
     def test_execute_with_simple_query_success(self):
         """Test successful execution with simple query"""
         mock_store = MockVectorStore(populate_with_data=True)
@@ -62,7 +72,7 @@ class TestCourseSearchToolBasic:
         result = tool.execute(query="machine learning")
 
         # Should return "no content found" message
-        assert "No relevant content found" in result
+        assert result == NO_CONTENT_MSG
 
     def test_execute_with_vector_store_error(self):
         """Test execution when vector store returns error"""
@@ -73,14 +83,26 @@ class TestCourseSearchToolBasic:
 
         # Should return the error message
         assert "Simulated search error" in result
+        assert isinstance(result, ToolError)
+
+
+# Built once at import; the fixture below resets it before each test
+_SHARED_POPULATED_STORE = MockVectorStore(populate_with_data=True)
+
+
+@pytest.fixture
+def populated_mock_store():
+    """Shared populated MockVectorStore with per-test state cleared"""
+    _SHARED_POPULATED_STORE.reset()
+    return _SHARED_POPULATED_STORE
 
 
 class TestCourseSearchToolWithFilters:
     """Test CourseSearchTool with course and lesson filters"""
 
-    def test_execute_with_course_filter(self):
+    def test_execute_with_course_filter(self, populated_mock_store):
         """Test execution with course name filter"""
-        mock_store = MockVectorStore(populate_with_data=True)
+        mock_store = populated_mock_store
         tool = CourseSearchTool(mock_store)
 
         result = tool.execute(query="machine learning", course_name="Test Course")
@@ -89,9 +111,9 @@ class TestCourseSearchToolWithFilters:
         assert mock_store.last_search_params["course_name"] == "Test Course"
         assert isinstance(result, str)
 
-    def test_execute_with_lesson_filter(self):
+    def test_execute_with_lesson_filter(self, populated_mock_store):
         """Test execution with lesson number filter"""
-        mock_store = MockVectorStore(populate_with_data=True)
+        mock_store = populated_mock_store
         tool = CourseSearchTool(mock_store)
 
         result = tool.execute(query="machine learning", lesson_number=1)
@@ -100,9 +122,9 @@ class TestCourseSearchToolWithFilters:
         assert mock_store.last_search_params["lesson_number"] == 1
         assert isinstance(result, str)
 
-    def test_execute_with_both_filters(self):
+    def test_execute_with_both_filters(self, populated_mock_store):
         """Test execution with both course and lesson filters"""
-        mock_store = MockVectorStore(populate_with_data=True)
+        mock_store = populated_mock_store
         tool = CourseSearchTool(mock_store)
 
         result = tool.execute(query="machine learning", course_name="Test Course", lesson_number=1)
@@ -112,17 +134,17 @@ class TestCourseSearchToolWithFilters:
         assert mock_store.last_search_params["lesson_number"] == 1
         assert isinstance(result, str)
 
-    def test_execute_with_invalid_course_name(self):
+    def test_execute_with_invalid_course_name(self, populated_mock_store):
         """Test execution with non-existent course name"""
-        mock_store = MockVectorStore(populate_with_data=True)
+        mock_store = populated_mock_store
         # Override course resolution to return None
-        mock_store._resolve_course_name = Mock(return_value=None)
+        mock_store.resolve_course_name_fn = lambda course_name: None
         tool = CourseSearchTool(mock_store)
 
         result = tool.execute(query="machine learning", course_name="NonexistentCourse")
 
         # Should indicate course not found
-        assert "No relevant content found in course 'NonexistentCourse'" in result
+        assert result == "No relevant content found in course 'NonexistentCourse'."
 
 
 class TestCourseSearchToolResultFormatting:
@@ -197,84 +219,62 @@ class TestCourseSearchToolResultFormatting:
         assert len(tool.last_sources) == 2
 
 
+@pytest.fixture(scope="module")
+def empty_store(tmp_path_factory):
+    """Real ChromaDB store with no data and fake embeddings, shared by this module"""
+    return VectorStore(str(tmp_path_factory.mktemp("empty_chroma")), config.EMBEDDING_MODEL, 3,
+                       embedding_function=FakeEmbeddingFunction())
+
+
+@pytest.fixture(scope="module")
+def populated_store(tmp_path_factory):
+    """Real VectorStore holding one course and one chunk, built once per module"""
+    store = VectorStore(str(tmp_path_factory.mktemp("populated_chroma")), config.EMBEDDING_MODEL, 3)
+
+    # Add sample course metadata
+    store.add_course_metadata(Course(
+        title="Integration Test Course",
+        course_link="https://example.com/course",
+        instructor="Test Instructor",
+        lessons=[
+            Lesson(lesson_number=1, title="Introduction", lesson_link="https://example.com/lesson1")
+        ]
+    ))
+
+    # Add sample content
+    store.add_course_content([
+        CourseChunk(
+            content="This is a test lesson about machine learning fundamentals",
+            course_title="Integration Test Course",
+            lesson_number=1,
+            chunk_index=0
+        )
+    ])
+    return store
+
+
 class TestCourseSearchToolIntegration:
     """Integration tests with real components"""
 
-    def test_with_real_vector_store_empty(self):
+    def test_with_real_vector_store_empty(self, empty_store):
         """Test with real VectorStore that has no data"""
-        from vector_store import VectorStore
-        from config import config
-
-        # Create a temporary vector store
-        test_store = VectorStore("./test_empty_chroma", config.EMBEDDING_MODEL, 3)
-        try:
-            # Clear any existing data
-            test_store.clear_all_data()
-
-            tool = CourseSearchTool(test_store)
-            result = tool.execute(query="machine learning")
-
-            # Should indicate no content found
-            assert "No relevant content found" in result
+        tool = CourseSearchTool(empty_store)
+        result = tool.execute(query="machine learning")
 
-        finally:
-            # Clean up
-            try:
-                test_store.clear_all_data()
-            except:
-                pass
+        # Should indicate no content found
+        assert result == NO_CONTENT_MSG
 
     @pytest.mark.integration
-    def test_with_real_vector_store_with_data(self):
+    def test_with_real_vector_store_with_data(self, populated_store):
         """Integration test with real vector store and sample data"""
-        from vector_store import VectorStore
-        from config import config
-        from models import Course, Lesson, CourseChunk
-
-        # Create a temporary vector store
-        test_store = VectorStore("./test_populated_chroma", config.EMBEDDING_MODEL, 3)
-        try:
-            # Clear and add test data
-            test_store.clear_all_data()
-
-            # Add sample course metadata
-            test_course = Course(
-                title="Integration Test Course",
-                course_link="https://example.com/course",
-                instructor="Test Instructor",
-                lessons=[
-                    Lesson(lesson_number=1, title="Introduction", lesson_link="https://example.com/lesson1")
-                ]
-            )
-            test_store.add_course_metadata(test_course)
-
-            # Add sample content
-            test_chunks = [
-                CourseChunk(
-                    content="This is a test lesson about machine learning fundamentals",
-                    course_title="Integration Test Course",
-                    lesson_number=1,
-                    chunk_index=0
-                )
-            ]
-            test_store.add_course_content(test_chunks)
-
-            # Test the search tool
-            tool = CourseSearchTool(test_store)
-            result = tool.execute(query="machine learning")
-
-            # Should find the content
-            assert isinstance(result, str)
-            assert len(result) > 0
-            # The exact content depends on the search algorithm, but it should not be an error
-            assert not any(error_word in result.lower() for error_word in ["error", "failed", "no relevant content"])
+        tool = CourseSearchTool(populated_store)
+        result = tool.execute(query="machine learning")
 
-        finally:
-            # Clean up
-            try:
-                test_store.clear_all_data()
-            except:
-                pass
+        # Should find the content
+        assert isinstance(result, str)
+        assert len(result) > 0
+        # The exact content depends on the search algorithm, but it should not be an error
+        assert not any(error_word in result.lower() for error_word in ["error", "failed", "no relevant content"])
 
 
 class TestToolManagerIntegration:
@@ -294,6 +294,20 @@ class TestToolManagerIntegration:
         assert len(definitions) == 1
         assert definitions[0]["name"] == "search_course_content"
 
+    def test_tool_definitions_reused_until_registration(self):
+        """Test that definitions are built once and rebuilt when a tool is added"""
+        manager = ToolManager()
+        manager.register_tool(CourseSearchTool(MockVectorStore()))
+
+        first = manager.get_tool_definitions()
+        assert manager.get_tool_definitions() is first
+
+        manager.register_tool(CourseOutlineTool(MockVectorStore()))
+        updated = manager.get_tool_definitions()
+
+        assert updated is not first
+        assert [d["name"] for d in updated] == ["search_course_content", "get_course_outline"]
+
     def test_tool_execution_through_manager(self):
         """Test executing the tool through ToolManager"""
         mock_store = MockVectorStore(populate_with_data=True)
@@ -308,6 +322,16 @@ class TestToolManagerIntegration:
         assert isinstance(result, str)
         assert len(result) > 0
 
+    def test_execute_unknown_tool_through_manager(self):
+        """Test that an unregistered tool name returns a not-found message"""
+        manager = ToolManager()
+        manager.register_tool(CourseSearchTool(MockVectorStore()))
+
+        result = manager.execute_tool("nonexistent_tool", query="machine learning")
+
+        assert result == "Tool 'nonexistent_tool' not found"
+        assert isinstance(result, ToolError)
+
     def test_source_tracking_through_manager(self):
         """Test that sources are tracked correctly through ToolManager"""
         mock_store = MockVectorStore(populate_with_data=True)
@@ -327,34 +351,31 @@ class TestToolManagerIntegration:
 
 
 # Diagnostic test to identify common failure points
+@pytest.fixture(scope="module")
+def diagnostic_store():
+    """VectorStore over the real database, opened once per module (and per xdist worker)"""
+    try:
+        return VectorStore(config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS)
+    except Exception as e:
+        pytest.fail(f"Vector store connection failed: {e}")
+
+
+@pytest.mark.integration
 class TestCourseSearchToolDiagnostics:
     """Diagnostic tests to identify common failure patterns"""
 
-    def test_diagnose_vector_store_connection(self):
+    def test_diagnose_vector_store_connection(self, diagnostic_store):
         """Test if vector store can be accessed"""
-        try:
-            from vector_store import VectorStore
-            from config import config
-
-            # Try to create a vector store
-            store = VectorStore(config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS)
-            tool = CourseSearchTool(store)
-
-            # This should not raise an exception
-            definition = tool.get_tool_definition()
-            assert definition is not None
+        tool = CourseSearchTool(diagnostic_store)
 
-        except Exception as e:
-            pytest.fail(f"Vector store connection failed: {e}")
+        # This should not raise an exception
+        definition = tool.get_tool_definition()
+        assert definition is not None
 
-    def test_diagnose_search_functionality(self):
+    def test_diagnose_search_functionality(self, diagnostic_store):
         """Test basic search functionality with real vector store"""
         try:
-            from vector_store import VectorStore
-            from config import config
-
-            store = VectorStore(config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS)
-            tool = CourseSearchTool(store)
+            tool = CourseSearchTool(diagnostic_store)
 
             # Try a simple search
             result = tool.execute(query="test")
@@ -365,19 +386,14 @@ class TestCourseSearchToolDiagnostics:
         except Exception as e:
             pytest.fail(f"Search functionality failed: {e}")
 
-    def test_diagnose_course_resolution(self):
+    def test_diagnose_course_resolution(self, diagnostic_store):
         """Test course name resolution functionality"""
         try:
-            from vector_store import VectorStore
-            from config import config
-
-            store = VectorStore(config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS)
-
             # Try to resolve a course name
-            resolved = store._resolve_course_name("test")
+            resolved = diagnostic_store._resolve_course_name("test")
 
             # Should return either a string or None, not raise an exception
             assert resolved is None or isinstance(resolved, str)
 
         except Exception as e:
-            pytest.fail(f"Course resolution failed: {e}")
\ No newline at end of file
+            pytest.fail(f"Course resolution failed: {e}")
@@ -1,49 +1,73 @@
 """
 Integration tests for RAG system end-to-end functionality
 """
+import logging
 import pytest
-import tempfile
-from unittest.mock import Mock, patch, MagicMock
+from dataclasses import replace
+from functools import partial
+from unittest.mock import NonCallableMock, patch
+from ai_generator import AIGenerator
+from config import config
+from document_processor import DocumentProcessor
 from rag_system import RAGSystem
-from mocks import MockVectorStore, MockAnthropicClient, MockToolManager, create_mock_rag_system
-from config import Config
+from search_tools import ToolManager, CourseSearchTool, CourseOutlineTool
+from session_manager import SessionManager
+from vector_store import VectorStore
+from mocks import FakeEmbeddingFunction, MockVectorStore, create_mock_rag_system, mock_embedding_function
 
+# Diagnostic output; shown with --log-level=DEBUG, or on failure for errors
+logger = logging.getLogger(__name__)
 
-class TestRAGSystemInitialization:
-    """Test RAG system initialization and component setup"""
 
-    def test_initialization_with_config(self):
-        """Test RAG system initialization with config"""
-        config = Config()
-        config.CHROMA_PATH = "./test_chroma"
-        config.ANTHROPIC_API_KEY = "test-key"
+def _spec_vector_store(**return_values):
+    """Fresh non-callable mock limited to VectorStore's methods, with the given method return values"""
+    # embedding_function is an instance attribute, so the class spec doesn't include it;
+    # that is also why this is spec rather than spec_set
+    mock = NonCallableMock(spec=VectorStore, embedding_function=mock_embedding_function)
+    for method, value in return_values.items():
+        getattr(mock, method).return_value = value
+    return mock
 
-        try:
-            rag_system = RAGSystem(config)
 
-            # Check all components are initialized
-            assert rag_system.config is not None
-            assert rag_system.document_processor is not None
-            assert rag_system.vector_store is not None
-            assert rag_system.ai_generator is not None
-            assert rag_system.session_manager is not None
-            assert rag_system.tool_manager is not None
-            assert rag_system.search_tool is not None
-            assert rag_system.outline_tool is not None
+def assert_valid_query_result(response, sources):
+    """Check the (response, sources) shape every RAGSystem.query call returns"""
+    assert isinstance(response, str)
+    assert isinstance(sources, list)
+
+
+class TestRAGSystemInitialization:
+    """Test RAG system initialization and component setup"""
 
+    @pytest.fixture(scope="class")
+    def initialized_rag(self, base_config, tmp_path_factory):
+        """Real RAGSystem over a scratch database, built once for this class's read-only checks"""
+        config = replace(base_config,
+                         CHROMA_PATH=str(tmp_path_factory.mktemp("init_chroma")),
+                         ANTHROPIC_API_KEY="test-key")
+        # Real ChromaDB and components; only the embedding model is swapped for the fake
+        fake_embedding_store = partial(VectorStore, embedding_function=FakeEmbeddingFunction())
+        try:
+            with patch("rag_system.VectorStore", fake_embedding_store):
+                return RAGSystem(config)
         except Exception as e:
             pytest.fail(f"RAG system initialization failed: {e}")
 
-    def test_tool_registration(self):
+    def test_initialization_with_config(self, initialized_rag):
+        """Test RAG system initialization with config"""
+        # Check all components are initialized
+        assert initialized_rag.config is not None
+        assert initialized_rag.document_processor is not None
+        assert initialized_rag.vector_store is not None
+        assert initialized_rag.ai_generator is not None
+        assert initialized_rag.session_manager is not None
+        assert initialized_rag.tool_manager is not None
+        assert initialized_rag.search_tool is not None
+        assert initialized_rag.outline_tool is not None
+
+    def test_tool_registration(self, initialized_rag):
         """Test that tools are properly registered"""
-        config = Config()
-        config.CHROMA_PATH = "./test_chroma"
-        config.ANTHROPIC_API_KEY = "test-key"
-
-        rag_system = RAGSystem(config)
-
         # Check tool definitions
-        tool_definitions = rag_system.tool_manager.get_tool_definitions()
+        tool_definitions = initialized_rag.tool_manager.get_tool_definitions()
         assert len(tool_definitions) == 2  # search + outline tools
 
         tool_names = [tool["name"] for tool in tool_definitions]
@@ -54,77 +78,41 @@ class TestRAGSystemInitialization:
 class TestRAGSystemBasicQuery:
     """Test basic query processing functionality"""
 
-    @patch('rag_system.AIGenerator')
-    @patch('rag_system.VectorStore')
-    def test_query_without_session(self, mock_vector_store_class, mock_ai_generator_class):
+    def test_query_without_session(self, rag_system_mocked):
         """Test query processing without session"""
-        # Setup mocks
-        mock_vector_store = MockVectorStore(populate_with_data=True)
-        mock_vector_store_class.return_value = mock_vector_store
-
-        mock_ai_generator = Mock()
-        mock_ai_generator.generate_response.return_value = "Test AI response"
-        mock_ai_generator_class.return_value = mock_ai_generator
-
-        config = Config()
-        config.CHROMA_PATH = "./test_chroma"
-
-        rag_system = RAGSystem(config)
+        rag_system_mocked.ai_generator.generate_response.return_value = "Test AI response"
 
         # Execute query
-        response, sources = rag_system.query("What is machine learning?")
+        response, sources = rag_system_mocked.query("What is machine learning?")
 
         # Check response
-        assert isinstance(response, str)
+        assert_valid_query_result(response, sources)
         assert len(response) > 0
-        assert isinstance(sources, list)
 
-    @patch('rag_system.AIGenerator')
-    @patch('rag_system.VectorStore')
-    def test_query_with_session(self, mock_vector_store_class, mock_ai_generator_class):
+    def test_query_with_session(self, rag_system_mocked):
         """Test query processing with session"""
-        # Setup mocks
-        mock_vector_store = MockVectorStore(populate_with_data=True)
-        mock_vector_store_class.return_value = mock_vector_store
-
-        mock_ai_generator = Mock()
-        mock_ai_generator.generate_response.return_value = "Test AI response"
-        mock_ai_generator_class.return_value = mock_ai_generator
-
-        config = Config()
-        rag_system = RAGSystem(config)
+        rag_system_mocked.ai_generator.generate_response.return_value = "Test AI response"
 
         # Create session
-        session_id = rag_system.session_manager.create_session()
+        session_id = rag_system_mocked.session_manager.create_session()
 
         # Execute query
-        response, sources = rag_system.query("What is machine learning?", session_id)
+        response, sources = rag_system_mocked.query("What is machine learning?", session_id)
 
         # Check response
-        assert isinstance(response, str)
-        assert isinstance(sources, list)
+        assert_valid_query_result(response, sources)
 
         # Check that session was used
-        history = rag_system.session_manager.get_conversation_history(session_id)
+        history = rag_system_mocked.session_manager.get_conversation_history(session_id)
         assert history is not None
 
-    @patch('rag_system.AIGenerator')
-    @patch('rag_system.VectorStore')
-    def test_query_ai_generator_called_correctly(self, mock_vector_store_class, mock_ai_generator_class):
+    def test_query_ai_generator_called_correctly(self, rag_system_mocked):
         """Test that AI generator is called with correct parameters"""
-        # Setup mocks
-        mock_vector_store = MockVectorStore(populate_with_data=True)
-        mock_vector_store_class.return_value = mock_vector_store
-
-        mock_ai_generator = Mock()
+        mock_ai_generator = rag_system_mocked.ai_generator
         mock_ai_generator.generate_response.return_value = "Test AI response"
-        mock_ai_generator_class.return_value = mock_ai_generator
-
-        config = Config()
-        rag_system = RAGSystem(config)
 
         # Execute query
-        response, sources = rag_system.query("What is machine learning?")
+        response, sources = rag_system_mocked.query("What is machine learning?")
 
         # Check that AI generator was called correctly
         mock_ai_generator.generate_response.assert_called_once()
@@ -134,46 +122,43 @@ class TestRAGSystemBasicQuery:
         assert 'query' in call_args.kwargs
         assert 'tools' in call_args.kwargs
         assert 'tool_manager' in call_args.kwargs
-        assert call_args.kwargs['tool_manager'] is rag_system.tool_manager
+        assert call_args.kwargs['tool_manager'] is rag_system_mocked.tool_manager
+
+
+class TestRAGSystemStreaming:
+    """Test streamed query processing"""
+
+    def test_query_stream_yields_text_then_sources(self, rag_system_mocked):
+        """Test that streamed text is followed by sources and recorded in the session"""
+        rag_system_mocked.ai_generator.generate_response_stream.return_value = iter(["Streamed ", "answer"])
+
+        session_id = rag_system_mocked.session_manager.create_session()
+
+        events = list(rag_system_mocked.query_stream("What is machine learning?", session_id))
+
+        assert events[:2] == [{"type": "text", "text": "Streamed "}, {"type": "text", "text": "answer"}]
+        assert events[-1] == {"type": "sources", "sources": []}
+        assert "Streamed answer" in rag_system_mocked.session_manager.get_conversation_history(session_id)
 
 
 class TestRAGSystemErrorHandling:
     """Test error handling in RAG system"""
 
-    @patch('rag_system.AIGenerator')
-    @patch('rag_system.VectorStore')
-    def test_query_with_ai_error(self, mock_vector_store_class, mock_ai_generator_class):
+    def test_query_with_ai_error(self, rag_system_mocked):
         """Test query when AI generator fails"""
-        mock_vector_store = MockVectorStore(populate_with_data=True)
-        mock_vector_store_class.return_value = mock_vector_store
-
-        mock_ai_generator = Mock()
-        mock_ai_generator.generate_response.side_effect = Exception("AI generation failed")
-        mock_ai_generator_class.return_value = mock_ai_generator
-
-        config = Config()
-        rag_system = RAGSystem(config)
+        rag_system_mocked.ai_generator.generate_response.side_effect = Exception("AI generation failed")
 
         # Should raise the exception
         with pytest.raises(Exception, match="AI generation failed"):
-            rag_system.query("What is machine learning?")
+            rag_system_mocked.query("What is machine learning?")
 
-    @patch('rag_system.AIGenerator')
-    @patch('rag_system.VectorStore')
-    def test_query_with_tool_error(self, mock_vector_store_class, mock_ai_generator_class):
+    def test_query_with_tool_error(self, rag_system_mocked, monkeypatch):
         """Test query when tools fail"""
-        mock_vector_store = MockVectorStore(simulate_search_error=True)
-        mock_vector_store_class.return_value = mock_vector_store
-
-        mock_ai_generator = Mock()
-        mock_ai_generator.generate_response.return_value = "Error response"
-        mock_ai_generator_class.return_value = mock_ai_generator
-
-        config = Config()
-        rag_system = RAGSystem(config)
+        monkeypatch.setattr(rag_system_mocked.search_tool, "store", MockVectorStore(simulate_search_error=True))
+        rag_system_mocked.ai_generator.generate_response.return_value = "Error response"
 
         # Should still return a response, even with tool errors
-        response, sources = rag_system.query("What is machine learning?")
+        response, sources = rag_system_mocked.query("What is machine learning?")
         assert isinstance(response, str)
 
 
@@ -181,82 +166,50 @@ class TestRAGSystemDocumentProcessing:
     """Test document processing functionality"""
 
     @patch('rag_system.VectorStore')
-    def test_add_course_document(self, mock_vector_store_class):
+    def test_add_course_document(self, mock_vector_store_class, test_config, sample_course_file):
         """Test adding a single course document"""
-        mock_vector_store = Mock()
-        mock_vector_store.add_course_metadata = Mock()
-        mock_vector_store.add_course_content = Mock()
+        mock_vector_store = _spec_vector_store()
         mock_vector_store_class.return_value = mock_vector_store
 
-        config = Config()
-        rag_system = RAGSystem(config)
-
-        # Create a temporary test file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            f.write("Course Title: Test Course\n")
-            f.write("Course Link: https://example.com\n")
-            f.write("Course Instructor: Test Instructor\n")
-            f.write("\nLesson 1: Introduction\n")
-            f.write("This is lesson content\n")
-            temp_file = f.name
+        rag_system = RAGSystem(test_config)
 
-        try:
-            course, chunk_count = rag_system.add_course_document(temp_file)
-
-            assert course is not None
-            assert course.title == "Test Course"
-            assert chunk_count > 0
+        course, chunk_count = rag_system.add_course_document(sample_course_file)
 
-            # Check that vector store methods were called
-            mock_vector_store.add_course_metadata.assert_called_once()
-            mock_vector_store.add_course_content.assert_called_once()
+        assert course is not None
+        assert course.title == "Test Course"
+        assert chunk_count > 0
 
-        finally:
-            import os
-            os.unlink(temp_file)
+        # Check that vector store methods were called
+        mock_vector_store.add_course_metadata.assert_called_once()
+        mock_vector_store.add_course_content.assert_called_once()
 
     @patch('rag_system.VectorStore')
-    def test_add_course_folder(self, mock_vector_store_class):
+    def test_add_course_folder(self, mock_vector_store_class, test_config, sample_course_dir):
         """Test adding course folder"""
-        mock_vector_store = Mock()
-        mock_vector_store.add_course_metadata = Mock()
-        mock_vector_store.add_course_content = Mock()
-        mock_vector_store.get_existing_course_titles = Mock(return_value=[])
+        mock_vector_store = _spec_vector_store(get_existing_course_titles=[])
         mock_vector_store_class.return_value = mock_vector_store
 
-        config = Config()
-        rag_system = RAGSystem(config)
-
-        # Create temporary directory with test files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create test file
-            test_file = f"{temp_dir}/test_course.txt"
-            with open(test_file, 'w') as f:
-                f.write("Course Title: Test Course\n")
-                f.write("Course Link: https://example.com\n")
-                f.write("Course Instructor: Test Instructor\n")
-                f.write("\nLesson 1: Introduction\n")
-                f.write("This is lesson content\n")
+        rag_system = RAGSystem(test_config)
 
-            courses_added, chunks_added = rag_system.add_course_folder(temp_dir)
+        courses_added, chunks_added = rag_system.add_course_folder(sample_course_dir)
 
-            assert courses_added == 1
-            assert chunks_added > 0
+        assert courses_added == 1
+        assert chunks_added > 0
 
 
 class TestRAGSystemAnalytics:
     """Test analytics functionality"""
 
     @patch('rag_system.VectorStore')
-    def test_get_course_analytics(self, mock_vector_store_class):
+    def test_get_course_analytics(self, mock_vector_store_class, test_config):
         """Test getting course analytics"""
-        mock_vector_store = Mock()
-        mock_vector_store.get_course_count.return_value = 5
-        mock_vector_store.get_existing_course_titles.return_value = ["Course A", "Course B"]
+        mock_vector_store = _spec_vector_store(
+            get_course_count=5,
+            get_existing_course_titles=["Course A", "Course B"]
+        )
         mock_vector_store_class.return_value = mock_vector_store
 
-        config = Config()
-        rag_system = RAGSystem(config)
+        rag_system = RAGSystem(test_config)
 
         analytics = rag_system.get_course_analytics()
 
@@ -264,94 +217,96 @@ class TestRAGSystemAnalytics:
         assert analytics["course_titles"] == ["Course A", "Course B"]
 
 
-class TestRAGSystemRealWorldScenarios:
-    """Test real-world usage scenarios"""
+def _reset_mock_rag(rag_system):
+    """Clear the state a query leaves on a shared mock RAG system"""
+    rag_system.response_cache.clear()
+    rag_system.tool_manager.reset_sources()
+    rag_system.ai_generator.generate_response.reset_mock()
+    return rag_system
 
-    def test_content_search_query_scenario(self):
-        """Test typical content search query scenario"""
-        # This is the type of query that's failing according to the user
-        mock_rag = create_mock_rag_system(vector_store_populated=True)
 
-        # Simulate a content-related query
-        try:
-            response, sources = mock_rag.query("Explain machine learning algorithms")
+@pytest.fixture(scope="module")
+def _mock_rag_populated_module():
+    """Mock RAG system over a populated vector store, built once per module"""
+    return create_mock_rag_system(vector_store_populated=True)
 
-            # Should not fail
-            assert isinstance(response, str)
-            assert isinstance(sources, list)
 
-        except Exception as e:
-            pytest.fail(f"Content search query failed: {e}")
+@pytest.fixture(scope="module")
+def _mock_rag_empty_module():
+    """Mock RAG system over an empty vector store, built once per module"""
+    return create_mock_rag_system(vector_store_populated=False)
 
-    def test_outline_query_scenario(self):
-        """Test outline query scenario"""
-        mock_rag = create_mock_rag_system(vector_store_populated=True)
 
-        # Simulate an outline query
-        try:
-            response, sources = mock_rag.query("What's in the machine learning course?")
+@pytest.fixture
+def mock_rag_populated(_mock_rag_populated_module):
+    """Shared populated mock RAG system with per-test state cleared"""
+    return _reset_mock_rag(_mock_rag_populated_module)
 
-            # Should not fail
-            assert isinstance(response, str)
-            assert isinstance(sources, list)
 
-        except Exception as e:
-            pytest.fail(f"Outline query failed: {e}")
+@pytest.fixture
+def mock_rag_empty(_mock_rag_empty_module):
+    """Shared empty mock RAG system with per-test state cleared"""
+    return _reset_mock_rag(_mock_rag_empty_module)
 
-    def test_empty_vector_store_scenario(self):
-        """Test scenario with empty vector store"""
-        mock_rag = create_mock_rag_system(vector_store_populated=False)
+
+class TestRAGSystemRealWorldScenarios:
+    """Test real-world usage scenarios"""
+
+    # The content search query is the type of query that's failing according to the user
+    @pytest.mark.parametrize("rag_fixture,query", [
+        pytest.param("mock_rag_populated", "Explain machine learning algorithms", id="content_search"),
+        pytest.param("mock_rag_populated", "What's in the machine learning course?", id="outline"),
+        pytest.param("mock_rag_empty", "What is machine learning?", id="empty_vector_store"),
+    ])
+    def test_scenario(self, request, rag_fixture, query):
+        """Test that typical queries return a response and sources instead of failing"""
+        # Fetched lazily, so only the store state this case needs is built
+        mock_rag = request.getfixturevalue(rag_fixture)
 
         try:
-            response, sources = mock_rag.query("What is machine learning?")
+            response, sources = mock_rag.query(query)
 
-            # Should still return a response, not fail
-            assert isinstance(response, str)
-            assert isinstance(sources, list)
+            # Should not fail
+            assert_valid_query_result(response, sources)
 
         except Exception as e:
-            pytest.fail(f"Empty vector store query failed: {e}")
+            pytest.fail(f"Query scenario failed: {e}")
 
 
 class TestRAGSystemDiagnostics:
     """Comprehensive diagnostic tests to identify failure points"""
 
-    def test_diagnose_component_initialization(self):
+    def test_diagnose_component_initialization(self, test_config):
         """Test each component initialization individually"""
-        config = Config()
-        config.CHROMA_PATH = "./diagnostic_chroma"
-        config.ANTHROPIC_API_KEY = "test-key"
-
         try:
             # Test document processor
-            from document_processor import DocumentProcessor
-            doc_processor = DocumentProcessor(config.CHUNK_SIZE, config.CHUNK_OVERLAP)
+            doc_processor = DocumentProcessor(test_config.CHUNK_SIZE, test_config.CHUNK_OVERLAP)
             assert doc_processor is not None
 
-            # Test vector store
-            from vector_store import VectorStore
-            vector_store = VectorStore(config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS)
-            assert vector_store is not None
+            # Test tool wiring over a mock vector store; the real store is covered below
+            search_tool = CourseSearchTool(MockVectorStore())
+            assert search_tool.store is not None
 
             # Test AI generator (without actual API key)
-            from ai_generator import AIGenerator
-            ai_gen = AIGenerator("test-key", config.ANTHROPIC_MODEL)
+            ai_gen = AIGenerator("test-key", test_config.ANTHROPIC_MODEL)
             assert ai_gen is not None
 
             # Test session manager
-            from session_manager import SessionManager
-            session_mgr = SessionManager(config.MAX_HISTORY)
+            session_mgr = SessionManager(test_config.MAX_HISTORY)
             assert session_mgr is not None
 
         except Exception as e:
             pytest.fail(f"Component initialization diagnostic failed: {e}")
 
+    @pytest.mark.integration
+    def test_diagnose_vector_store_initialization(self, session_vector_store):
+        """Test that a real VectorStore initializes with the configured embedding model"""
+        assert session_vector_store.course_catalog is not None
+        assert session_vector_store.course_content is not None
+
     def test_diagnose_tool_system(self):
         """Test tool system functionality"""
         try:
-            from search_tools import ToolManager, CourseSearchTool, CourseOutlineTool
-            from mocks import MockVectorStore
-
             # Test tool manager
             manager = ToolManager()
             assert manager is not None
@@ -379,37 +334,32 @@ class TestRAGSystemDiagnostics:
     def test_diagnose_real_rag_system(self):
         """Diagnostic test with real RAG system"""
         try:
-            from config import config
-
             # Try to create real RAG system
             rag_system = RAGSystem(config)
 
             # Test basic functionality
             analytics = rag_system.get_course_analytics()
-            print(f"Real RAG system analytics: {analytics}")
+            logger.debug("Real RAG system analytics: %s", analytics)
 
             # Try a simple query (this might fail, which is what we want to identify)
             try:
                 response, sources = rag_system.query("test query")
-                print(f"Query response: {response[:100]}...")
-                print(f"Sources: {sources}")
+                logger.debug("Query response: %.100s...", response)
+                logger.debug("Sources: %s", sources)
 
             except Exception as query_error:
-                print(f"Query execution failed: {query_error}")
+                logger.error("Query execution failed: %s", query_error)
                 # This is the actual error we're trying to diagnose
                 raise
 
         except Exception as e:
             # This will help us identify exactly where the failure occurs
-            print(f"Real RAG system diagnostic failed at: {e}")
+            logger.error("Real RAG system diagnostic failed at: %s", e)
             raise
 
     def test_diagnose_tool_execution_pipeline(self):
         """Test the complete tool execution pipeline"""
         try:
-            from search_tools import ToolManager, CourseSearchTool
-            from mocks import MockVectorStore
-
             # Create components
             mock_store = MockVectorStore(populate_with_data=True)
             search_tool = CourseSearchTool(mock_store)
@@ -433,9 +383,9 @@ class TestRAGSystemDiagnostics:
         except Exception as e:
             pytest.fail(f"Tool execution pipeline diagnostic failed: {e}")
 
+    @pytest.mark.integration
     def test_diagnose_api_key_and_model(self):
         """Test API key and model configuration"""
-        from config import config
 
         # Check if API key is configured
         if not config.ANTHROPIC_API_KEY or config.ANTHROPIC_API_KEY == "":
@@ -445,5 +395,5 @@ class TestRAGSystemDiagnostics:
         assert config.ANTHROPIC_MODEL is not None
         assert len(config.ANTHROPIC_MODEL) > 0
 
-        print(f"Using model: {config.ANTHROPIC_MODEL}")
-        print(f"API key configured: {'Yes' if config.ANTHROPIC_API_KEY else 'No'}")
\ No newline at end of file
+        logger.debug("Using model: %s", config.ANTHROPIC_MODEL)
+        logger.debug("API key configured: %s", "Yes" if config.ANTHROPIC_API_KEY else "No")
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+Tests for the semantic response cache and its use by AIGenerator
+"""
+import pytest
+from unittest.mock import Mock, patch
+from ai_generator import AIGenerator
+from config import Config
+from rag_system import RAGSystem
+from response_cache import SemanticResponseCache
+from mocks import MockAnthropicClient, MockToolManager, MockVectorStore, mock_embedding_function
+
+
+class TestSemanticResponseCache:
+    """Test cache lookup and storage behavior"""
+
+    def test_exact_query_hit(self):
+        """Test that an identical query in the same context is served from cache"""
+        cache = SemanticResponseCache(mock_embedding_function)
+        key = cache.make_key(None, None)
+
+        cache.put("What is machine learning?", key, "Cached answer")
+
+        assert cache.get("What is machine learning?", key) == "Cached answer"
+
+    def test_different_query_miss(self):
+        """Test that an unrelated query is not served from cache"""
+        cache = SemanticResponseCache(mock_embedding_function)
+        key = cache.make_key(None, None)
+
+        cache.put("What is machine learning?", key, "Cached answer")
+
+        assert cache.get("Show me the course outline", key) is None
+
+    def test_lesson_and_course_variants_miss(self):
+        """Test that questions differing only in lesson number or course name miss"""
+        cache = SemanticResponseCache(mock_embedding_function)
+        key = cache.make_key(None, None)
+
+        cache.put("What does lesson 3 of the MCP course cover?", key, "Lesson 3 answer")
+
+        assert cache.get("What does lesson 5 of the MCP course cover?", key) is None
+        assert cache.get("What does lesson 3 of the RAG course cover?", key) is None
+
+    def test_context_mismatch_miss(self):
+        """Test that the same query with different history or tools misses"""
+        cache = SemanticResponseCache(mock_embedding_function)
+        tools = MockToolManager().get_tool_definitions()
+
+        cache.put("What is machine learning?", cache.make_key(None, tools), "Cached answer")
+
+        assert cache.get("What is machine learning?", cache.make_key("User: Hi", tools)) is None
+        assert cache.get("What is machine learning?", cache.make_key(None, None)) is None
+
+    def test_eviction_and_clear(self):
+        """Test that the oldest entry is evicted when full and clear empties the cache"""
+        cache = SemanticResponseCache(mock_embedding_function, max_entries=1)
+        key = cache.make_key(None, None)
+
+        cache.put("first question", key, "First answer")
+        cache.put("second question", key, "Second answer")
+
+        assert cache.get("first question", key) is None
+        assert cache.get("second question", key) == "Second answer"
+
+        cache.clear()
+        assert cache.get("second question", key) is None
+
+    def test_eviction_across_contexts(self):
+        """Test that eviction drops the oldest entry even when it belongs to another context"""
+        cache = SemanticResponseCache(mock_embedding_function, max_entries=2)
+        first_key = cache.make_key(None, None)
+        second_key = cache.make_key("User: Hi", None)
+
+        cache.put("first question", first_key, "First answer")
+        cache.put("second question", second_key, "Second answer")
+        assert cache.get("first question", first_key) == "First answer"
+
+        cache.put("third question", second_key, "Third answer")
+
+        assert cache.get("first question", first_key) is None
+        assert cache.get("second question", second_key) == "Second answer"
+        assert cache.get("third question", second_key) == "Third answer"
+
+    def test_exact_only_without_embedding_function(self):
+        """Test that without an embedding function only exact repeats are served"""
+        cache = SemanticResponseCache()
+        key = cache.make_key(None, None)
+
+        cache.put("Explain machine learning algorithms", key, "Cached answer")
+
+        assert cache.get("Explain machine learning algorithms", key) == "Cached answer"
+        assert cache.get("Explain the machine learning algorithms", key) is None
+
+    @pytest.mark.parametrize("asked,hit", [
+        ("What is machine learning?", True),
+        ("what is MACHINE learning?", True),
+        ("  What is machine learning?\n", True),
+        ("What is  machine learning?", False),
+        ("What is machine learning", False),
+        ("What is machine-learning?", False),
+    ], ids=["identical", "case", "outer_whitespace", "inner_whitespace", "punctuation", "hyphen"])
+    def test_exact_match_rules(self, asked, hit):
+        """Test that exact matching ignores only case and surrounding whitespace"""
+        cache = SemanticResponseCache()
+        key = cache.make_key(None, None)
+
+        cache.put("What is machine learning?", key, "Cached answer")
+
+        assert (cache.get(asked, key) == "Cached answer") is hit
+        assert (cache._exact_key(asked) == cache._exact_key("What is machine learning?")) is hit
+
+    def test_key_ignores_tool_order(self):
+        """Test that the context key depends on tool names, not their order"""
+        tools = [{"name": "search_course_content"}, {"name": "get_course_outline"}]
+
+        assert SemanticResponseCache.make_key(None, tools) == SemanticResponseCache.make_key(None, tools[::-1])
+        assert SemanticResponseCache.make_key(None, tools) != SemanticResponseCache.make_key(None, tools[:1])
+
+    def test_exact_repeat_skips_embedding(self):
+        """Test that a repeated question is served without embedding it again"""
+        embedded = []
+
+        def embed(texts):
+            embedded.extend(texts)
+            return mock_embedding_function(texts)
+
+        cache = SemanticResponseCache(embed)
+        key = cache.make_key(None, None)
+
+        cache.put("What is machine learning?", key, "Cached answer")
+        assert cache.get("Show me the course outline", key) is None
+
+        assert cache.get("  what is Machine Learning?", key) == "Cached answer"
+        assert embedded == ["What is machine learning?", "Show me the course outline"]
+        assert cache.hits == 1
+
+
+class TestAIGeneratorResponseCache:
+    """Test AIGenerator short-circuiting through the response cache"""
+
+    def test_repeated_query_skips_api(self, patched_anthropic):
+        """Test that a repeated query makes no further API calls"""
+        mock_client = MockAnthropicClient(custom_response="Fresh answer")
+        patched_anthropic["client"] = mock_client
+
+        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229",
+                                SemanticResponseCache(mock_embedding_function))
+
+        first = generator.generate_response(query="What is machine learning?")
+        second = generator.generate_response(query="What is machine learning?")
+
+        assert first == second == "Fresh answer"
+        assert mock_client.call_count == 1
+
+    def test_cache_bypass(self, patched_anthropic):
+        """Test that cache=False always calls the API"""
+        mock_client = MockAnthropicClient(custom_response="Fresh answer")
+        patched_anthropic["client"] = mock_client
+
+        generator = AIGenerator("test-api-key", "claude-3-sonnet-20240229",
+                                SemanticResponseCache(mock_embedding_function))
+
+        generator.generate_response(query="What is machine learning?", cache=False)
+        generator.generate_response(query="What is machine learning?", cache=False)
+
+        assert mock_client.call_count == 2
+
+
+class TestRAGSystemResponseCache:
+    """Test RAGSystem serving cached answers together with their sources"""
+
+    def _build_rag_system(self, mock_vector_store_class, mock_ai_generator_class):
+        mock_vector_store_class.return_value = MockVectorStore(populate_with_data=True)
+
+        mock_ai_generator = Mock()
+        mock_ai_generator.TOOL_FAILURE_MESSAGE = AIGenerator.TOOL_FAILURE_MESSAGE
+        mock_ai_generator_class.return_value = mock_ai_generator
+
+        rag_system = RAGSystem(Config())
+
+        def generate_response(query, **kwargs):
+            # Simulate the search tool recording sources for the answer
+            rag_system.search_tool.last_sources = [{"text": f"Source for {query}", "link": None}]
+            return f"Answer to {query}"
+
+        mock_ai_generator.generate_response.side_effect = generate_response
+        return rag_system, mock_ai_generator
+
+    @patch('rag_system.AIGenerator')
+    @patch('rag_system.VectorStore')
+    def test_cache_hit_returns_original_sources(self, mock_vector_store_class, mock_ai_generator_class):
+        """Test that a repeated question returns the first answer's sources without regenerating"""
+        rag_system, mock_ai_generator = self._build_rag_system(mock_vector_store_class, mock_ai_generator_class)
+
+        first = rag_system.query("What is machine learning?")
+        second = rag_system.query("What is machine learning?")
+
+        assert second == first
+        assert len(second[1]) == 1
+        assert mock_ai_generator.generate_response.call_count == 1
+
+    @patch('rag_system.AIGenerator')
+    @patch('rag_system.VectorStore')
+    def test_lesson_variants_not_served_from_cache(self, mock_vector_store_class, mock_ai_generator_class):
+        """Test that the prompt prefix does not make different lesson questions collide"""
+        rag_system, mock_ai_generator = self._build_rag_system(mock_vector_store_class, mock_ai_generator_class)
+
+        lesson_3, _ = rag_system.query("What does lesson 3 of the MCP course cover?")
+        lesson_5, _ = rag_system.query("What does lesson 5 of the MCP course cover?")
+
+        assert lesson_3 != lesson_5
+        assert mock_ai_generator.generate_response.call_count == 2
+
+    @patch('rag_system.AIGenerator')
+    @patch('rag_system.VectorStore')
+    def test_near_duplicate_query_skips_search(self, mock_vector_store_class, mock_ai_generator_class):
+        """Test that a near-duplicate question is answered from cache without another vector search"""
+        rag_system, mock_ai_generator = self._build_rag_system(mock_vector_store_class, mock_ai_generator_class)
+
+        def generate_response(query, tool_manager, **kwargs):
+            # Run the real search tool, as the model would on a content question
+            tool_manager.execute_tool("search_course_content", query=query)
+            return f"Answer to {query}"
+
+        mock_ai_generator.generate_response.side_effect = generate_response
+
+        first = rag_system.query("Explain machine learning algorithms")
+        searches = rag_system.vector_store.search_count
+        second = rag_system.query("explain Machine Learning algorithms")
+
+        assert second == first
+        assert searches == 1
+        assert rag_system.vector_store.search_count == searches
+        assert mock_ai_generator.generate_response.call_count == 1
+
+    @patch('rag_system.AIGenerator')
+    @patch('rag_system.VectorStore')
+    def test_semantic_matching_off_by_default(self, mock_vector_store_class, mock_ai_generator_class):
+        """Test that the default config never embeds queries for the response cache"""
+        rag_system, _ = self._build_rag_system(mock_vector_store_class, mock_ai_generator_class)
+
+        assert rag_system.response_cache.embedding_function is None
+
+    def test_identical_query_skips_llm(self, rag_system_mocked):
+        """Test that asking the same question twice calls the model once"""
+        rag_system_mocked.ai_generator.generate_response.return_value = "Cached answer"
+        hits = rag_system_mocked.response_cache.hits
+
+        first = rag_system_mocked.query("same")
+        second = rag_system_mocked.query("same")
+
+        assert second == first
+        assert rag_system_mocked.ai_generator.generate_response.call_count == 1
+        assert rag_system_mocked.response_cache.hits == hits + 1
@@ -6,8 +6,33 @@ import os
 import tempfile
 import shutil
 from unittest.mock import Mock, patch
+from huggingface_hub import try_to_load_from_cache
+from config import config
 from vector_store import VectorStore, SearchResults
 from models import Course, Lesson, CourseChunk
+from mocks import FakeEmbeddingFunction
+
+# Loading the real model on a cold cache means a ~90MB download; skip unless the
+# weights are already local, or CI=1 asks for the download
+requires_embedding_model = pytest.mark.skipif(
+    not isinstance(try_to_load_from_cache(f"sentence-transformers/{config.EMBEDDING_MODEL}", "config.json"), str)
+    and os.environ.get("CI") != "1",
+    reason="embedding model weights are not cached locally"
+)
+
+
+@pytest.fixture(scope="module")
+def module_store(tmp_path_factory):
+    """Real ChromaDB store with deterministic fake embeddings, built once for this module"""
+    return VectorStore(str(tmp_path_factory.mktemp("vector_store")), "all-MiniLM-L6-v2",
+                       max_results=5, embedding_function=FakeEmbeddingFunction())
+
+
+@pytest.fixture
+def store(module_store):
+    """The module's shared VectorStore, emptied again after each test"""
+    yield module_store
+    module_store.clear_all_data()
 
 
 class TestVectorStoreBasic:
@@ -16,7 +41,8 @@ class TestVectorStoreBasic:
     def test_initialization(self):
         """Test VectorStore initialization"""
         with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5,
+                                embedding_function=FakeEmbeddingFunction())
 
             assert store.max_results == 5
             assert store.client is not None
@@ -55,288 +81,292 @@ class TestVectorStoreBasic:
 class TestVectorStoreDataOperations:
     """Test VectorStore data adding and retrieval operations"""
 
-    def test_add_course_metadata(self):
+    def test_add_course_metadata(self, store):
         """Test adding course metadata"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            course = Course(
-                title="Test Course",
-                course_link="https://example.com/course",
-                instructor="Test Instructor",
-                lessons=[
-                    Lesson(lesson_number=1, title="Introduction", lesson_link="https://example.com/lesson1"),
-                    Lesson(lesson_number=2, title="Advanced", lesson_link="https://example.com/lesson2")
-                ]
-            )
+        course = Course(
+            title="Test Course",
+            course_link="https://example.com/course",
+            instructor="Test Instructor",
+            lessons=[
+                Lesson(lesson_number=1, title="Introduction", lesson_link="https://example.com/lesson1"),
+                Lesson(lesson_number=2, title="Advanced", lesson_link="https://example.com/lesson2")
+            ]
+        )
 
-            # Should not raise an exception
-            store.add_course_metadata(course)
+        # Should not raise an exception
+        store.add_course_metadata(course)
 
-            # Check that course was added
-            existing_titles = store.get_existing_course_titles()
-            assert "Test Course" in existing_titles
+        # Check that course was added
+        existing_titles = store.get_existing_course_titles()
+        assert "Test Course" in existing_titles
 
-    def test_add_course_content(self):
+    def test_add_course_content(self, store):
         """Test adding course content chunks"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            chunks = [
-                CourseChunk(
-                    content="This is lesson 1 content",
-                    course_title="Test Course",
-                    lesson_number=1,
-                    chunk_index=0
-                ),
-                CourseChunk(
-                    content="This is lesson 2 content",
-                    course_title="Test Course",
-                    lesson_number=2,
-                    chunk_index=1
-                )
-            ]
+        chunks = [
+            CourseChunk(
+                content="This is lesson 1 content",
+                course_title="Test Course",
+                lesson_number=1,
+                chunk_index=0
+            ),
+            CourseChunk(
+                content="This is lesson 2 content",
+                course_title="Test Course",
+                lesson_number=2,
+                chunk_index=1
+            )
+        ]
 
-            # Should not raise an exception
-            store.add_course_content(chunks)
+        # Should not raise an exception
+        store.add_course_content(chunks)
 
-    def test_get_existing_course_titles(self):
-        """Test retrieving existing course titles"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+    def test_add_course_content_embeds_in_one_batch(self, store):
+        """Test that all chunks of a course are embedded in a single call"""
+        chunks = [
+            CourseChunk(content=f"Lesson {number} content", course_title="Test Course",
+                        lesson_number=number, chunk_index=number)
+            for number in range(3)
+        ]
+        calls = store.embedding_function.calls
+        calls.clear()
 
-            # Initially should be empty
-            titles = store.get_existing_course_titles()
-            assert len(titles) == 0
+        store.add_course_content(chunks)
 
-            # Add a course
-            course = Course(title="Test Course", lessons=[])
-            store.add_course_metadata(course)
+        assert list(calls) == [[chunk.content for chunk in chunks]]
 
-            # Now should contain the course
-            titles = store.get_existing_course_titles()
-            assert "Test Course" in titles
+    def test_get_existing_course_titles(self, store):
+        """Test retrieving existing course titles"""
+        # Initially should be empty
+        titles = store.get_existing_course_titles()
+        assert len(titles) == 0
 
-    def test_get_course_count(self):
-        """Test getting course count"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+        # Add a course
+        course = Course(title="Test Course", instructor="Test Instructor", course_link="https://example.com/course", lessons=[])
+        store.add_course_metadata(course)
 
-            # Initially should be 0
-            count = store.get_course_count()
-            assert count == 0
+        # Now should contain the course
+        titles = store.get_existing_course_titles()
+        assert "Test Course" in titles
+
+    def test_get_course_count(self, store):
+        """Test getting course count"""
+        # Initially should be 0
+        count = store.get_course_count()
+        assert count == 0
 
-            # Add courses
-            course1 = Course(title="Course 1", lessons=[])
-            course2 = Course(title="Course 2", lessons=[])
+        # Add courses
+        course1 = Course(title="Course 1", instructor="Test Instructor", course_link="https://example.com/course1", lessons=[])
+        course2 = Course(title="Course 2", instructor="Test Instructor", course_link="https://example.com/course2", lessons=[])
 
-            store.add_course_metadata(course1)
-            store.add_course_metadata(course2)
+        store.add_course_metadata(course1)
+        store.add_course_metadata(course2)
 
-            # Should be 2
-            count = store.get_course_count()
-            assert count == 2
+        # Should be 2
+        count = store.get_course_count()
+        assert count == 2
 
-    def test_get_all_courses_metadata(self):
+    def test_get_all_courses_metadata(self, store):
         """Test retrieving all course metadata"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            course = Course(
-                title="Test Course",
-                instructor="Test Instructor",
-                course_link="https://example.com",
-                lessons=[
-                    Lesson(lesson_number=1, title="Intro", lesson_link="https://example.com/lesson1")
-                ]
-            )
+        course = Course(
+            title="Test Course",
+            instructor="Test Instructor",
+            course_link="https://example.com",
+            lessons=[
+                Lesson(lesson_number=1, title="Intro", lesson_link="https://example.com/lesson1")
+            ]
+        )
 
-            store.add_course_metadata(course)
+        store.add_course_metadata(course)
 
-            metadata = store.get_all_courses_metadata()
-            assert len(metadata) == 1
-            assert metadata[0]["title"] == "Test Course"
-            assert metadata[0]["instructor"] == "Test Instructor"
-            assert "lessons" in metadata[0]
-            assert len(metadata[0]["lessons"]) == 1
+        metadata = store.get_all_courses_metadata()
+        assert len(metadata) == 1
+        assert metadata[0]["title"] == "Test Course"
+        assert metadata[0]["instructor"] == "Test Instructor"
+        assert "lessons" in metadata[0]
+        assert len(metadata[0]["lessons"]) == 1
 
 
 class TestVectorStoreSearch:
     """Test VectorStore search functionality"""
 
-    def test_search_empty_store(self):
+    def test_search_empty_store(self, store):
         """Test searching in empty store"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+        results = store.search("machine learning")
 
-            results = store.search("machine learning")
-
-            assert results.is_empty()
-            assert results.error is None
+        assert results.is_empty()
+        assert results.error is None
 
-    def test_search_with_content(self):
+    def test_search_with_content(self, store):
         """Test searching with actual content"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            # Add course metadata
-            course = Course(
-                title="Machine Learning Course",
-                lessons=[Lesson(lesson_number=1, title="Introduction")]
+        # Add course metadata
+        course = Course(
+            title="Machine Learning Course",
+            instructor="Test Instructor",
+            course_link="https://example.com/course",
+            lessons=[Lesson(lesson_number=1, title="Introduction", lesson_link="https://example.com/lesson1")]
+        )
+        store.add_course_metadata(course)
+
+        # Add content
+        chunks = [
+            CourseChunk(
+                content="This lesson covers machine learning fundamentals and algorithms",
+                course_title="Machine Learning Course",
+                lesson_number=1,
+                chunk_index=0
             )
-            store.add_course_metadata(course)
+        ]
+        store.add_course_content(chunks)
 
-            # Add content
-            chunks = [
-                CourseChunk(
-                    content="This lesson covers machine learning fundamentals and algorithms",
-                    course_title="Machine Learning Course",
-                    lesson_number=1,
-                    chunk_index=0
-                )
-            ]
-            store.add_course_content(chunks)
+        # Search for content
+        results = store.search("machine learning")
 
-            # Search for content
-            results = store.search("machine learning")
+        # Should find something (exact results depend on embedding model)
+        assert isinstance(results, SearchResults)
+        # Results may or may not be empty depending on the search algorithm
 
-            # Should find something (exact results depend on embedding model)
-            assert isinstance(results, SearchResults)
-            # Results may or may not be empty depending on the search algorithm
+    def test_search_unknown_course_is_empty(self, store):
+        """Test that a course filter matching no course gives empty results, not an error"""
+        results = store.search("machine learning", course_name="Nonexistent Course")
 
-    def test_course_name_resolution(self):
-        """Test course name resolution functionality"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+        assert results.is_empty()
+        assert results.error is None
 
-            # Add course
-            course = Course(title="Machine Learning Fundamentals", lessons=[])
-            store.add_course_metadata(course)
+    def test_course_name_resolution(self, store):
+        """Test that a course name resolves to the nearest catalog title"""
+        # An empty catalog has nothing to resolve to
+        assert store._resolve_course_name("Machine Learning Fundamentals") is None
 
-            # Test exact match
-            resolved = store._resolve_course_name("Machine Learning Fundamentals")
-            assert resolved == "Machine Learning Fundamentals"
+        for title in ("Machine Learning Fundamentals", "Cooking Basics"):
+            store.add_course_metadata(Course(title=title, instructor="Test Instructor",
+                                             course_link="https://example.com/course", lessons=[]))
 
-            # Test partial match (may or may not work depending on embedding similarity)
-            resolved_partial = store._resolve_course_name("Machine Learning")
-            # This might be None or the course name depending on the embedding model
+        # Test exact and partial matches
+        assert store._resolve_course_name("Machine Learning Fundamentals") == "Machine Learning Fundamentals"
+        assert store._resolve_course_name("machine learning") == "Machine Learning Fundamentals"
+        assert store._resolve_course_name("Cooking") == "Cooking Basics"
 
-            # Test non-existent course
-            resolved_none = store._resolve_course_name("Nonexistent Course")
-            assert resolved_none is None
+        # There is no distance cutoff: an unrelated name still gets the nearest course
+        assert store._resolve_course_name("Nonexistent Course") in ("Machine Learning Fundamentals", "Cooking Basics")
 
-    def test_search_with_course_filter(self):
+    def test_search_with_course_filter(self, store):
         """Test searching with course filter"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            # Add courses and content
-            course1 = Course(title="Course A", lessons=[])
-            course2 = Course(title="Course B", lessons=[])
-            store.add_course_metadata(course1)
-            store.add_course_metadata(course2)
+        # Add courses and content
+        course1 = Course(title="Course A", instructor="Test Instructor", course_link="https://example.com/course-a", lessons=[])
+        course2 = Course(title="Course B", instructor="Test Instructor", course_link="https://example.com/course-b", lessons=[])
+        store.add_course_metadata(course1)
+        store.add_course_metadata(course2)
 
-            chunks = [
-                CourseChunk(content="Content for course A", course_title="Course A", chunk_index=0),
-                CourseChunk(content="Content for course B", course_title="Course B", chunk_index=1)
-            ]
-            store.add_course_content(chunks)
+        chunks = [
+            CourseChunk(content="Content for course A", course_title="Course A", lesson_number=1, chunk_index=0),
+            CourseChunk(content="Content for course B", course_title="Course B", lesson_number=1, chunk_index=1)
+        ]
+        store.add_course_content(chunks)
 
-            # Search with course filter
-            results = store.search("content", course_name="Course A")
+        # Search with course filter
+        results = store.search("content", course_name="Course A")
 
-            # Should work without errors
-            assert isinstance(results, SearchResults)
+        # Should work without errors
+        assert isinstance(results, SearchResults)
 
-    def test_search_with_lesson_filter(self):
+    def test_search_with_lesson_filter(self, store):
         """Test searching with lesson filter"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+        # Add content
+        chunks = [
+            CourseChunk(content="Lesson 1 content", course_title="Course", lesson_number=1, chunk_index=0),
+            CourseChunk(content="Lesson 2 content", course_title="Course", lesson_number=2, chunk_index=1)
+        ]
+        store.add_course_content(chunks)
 
-            # Add content
-            chunks = [
-                CourseChunk(content="Lesson 1 content", course_title="Course", lesson_number=1, chunk_index=0),
-                CourseChunk(content="Lesson 2 content", course_title="Course", lesson_number=2, chunk_index=1)
-            ]
-            store.add_course_content(chunks)
-
-            # Search with lesson filter
-            results = store.search("content", lesson_number=1)
+        # Search with lesson filter
+        results = store.search("content", lesson_number=1)
 
-            # Should work without errors
-            assert isinstance(results, SearchResults)
+        # Should work without errors
+        assert isinstance(results, SearchResults)
 
-    def test_build_filter(self):
+    def test_build_filter(self, store):
         """Test filter building functionality"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+        # Test no filter
+        filter_dict = store._build_filter(None, None)
+        assert filter_dict is None
+
+        # Test course filter only
+        filter_dict = store._build_filter("Test Course", None)
+        assert filter_dict == {"course_title": "Test Course"}
 
-            # Test no filter
-            filter_dict = store._build_filter(None, None)
-            assert filter_dict is None
+        # Test lesson filter only
+        filter_dict = store._build_filter(None, 1)
+        assert filter_dict == {"lesson_number": 1}
 
-            # Test course filter only
-            filter_dict = store._build_filter("Test Course", None)
-            assert filter_dict == {"course_title": "Test Course"}
+        # Test both filters
+        filter_dict = store._build_filter("Test Course", 1)
+        expected = {"$and": [{"course_title": "Test Course"}, {"lesson_number": 1}]}
+        assert filter_dict == expected
 
-            # Test lesson filter only
-            filter_dict = store._build_filter(None, 1)
-            assert filter_dict == {"lesson_number": 1}
 
-            # Test both filters
-            filter_dict = store._build_filter("Test Course", 1)
-            expected = {"$and": [{"course_title": "Test Course"}, {"lesson_number": 1}]}
-            assert filter_dict == expected
+class TestVectorStoreQueryEmbeddingCache:
+    """Test that repeated query texts are embedded once"""
+
+    def test_identical_query_reuses_embedding(self, tmp_path):
+        """Test that searching the same text twice calls the embedding function once"""
+        embedding_function = FakeEmbeddingFunction()
+        store = VectorStore(str(tmp_path), "all-MiniLM-L6-v2", max_results=5,
+                            embedding_function=embedding_function)
+
+        first = store.search("What is machine learning?")
+        store.search("What is machine learning?")
+        store.search("What is deep learning?")
+
+        assert first.error is None
+        embedded = [text for batch in embedding_function.calls for text in batch]
+        assert embedded == ["What is machine learning?", "What is deep learning?"]
 
 
 class TestVectorStoreLinkRetrieval:
     """Test link retrieval functionality"""
 
-    def test_get_course_link(self):
+    def test_get_course_link(self, store):
         """Test getting course link"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            course = Course(
-                title="Test Course",
-                course_link="https://example.com/course",
-                lessons=[]
-            )
-            store.add_course_metadata(course)
+        course = Course(
+            title="Test Course",
+            instructor="Test Instructor",
+            course_link="https://example.com/course",
+            lessons=[]
+        )
+        store.add_course_metadata(course)
 
-            # Test existing course
-            link = store.get_course_link("Test Course")
-            assert link == "https://example.com/course"
+        # Test existing course
+        link = store.get_course_link("Test Course")
+        assert link == "https://example.com/course"
 
-            # Test non-existent course
-            link = store.get_course_link("Nonexistent Course")
-            assert link is None
+        # Test non-existent course
+        link = store.get_course_link("Nonexistent Course")
+        assert link is None
 
-    def test_get_lesson_link(self):
+    def test_get_lesson_link(self, store):
         """Test getting lesson link"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            course = Course(
-                title="Test Course",
-                lessons=[
-                    Lesson(lesson_number=1, title="Intro", lesson_link="https://example.com/lesson1"),
-                    Lesson(lesson_number=2, title="Advanced", lesson_link="https://example.com/lesson2")
-                ]
-            )
-            store.add_course_metadata(course)
+        course = Course(
+            title="Test Course",
+            instructor="Test Instructor",
+            course_link="https://example.com/course",
+            lessons=[
+                Lesson(lesson_number=1, title="Intro", lesson_link="https://example.com/lesson1"),
+                Lesson(lesson_number=2, title="Advanced", lesson_link="https://example.com/lesson2")
+            ]
+        )
+        store.add_course_metadata(course)
 
-            # Test existing lesson
-            link = store.get_lesson_link("Test Course", 1)
-            assert link == "https://example.com/lesson1"
+        # Test existing lesson
+        link = store.get_lesson_link("Test Course", 1)
+        assert link == "https://example.com/lesson1"
 
-            # Test non-existent lesson
-            link = store.get_lesson_link("Test Course", 99)
-            assert link is None
+        # Test non-existent lesson
+        link = store.get_lesson_link("Test Course", 99)
+        assert link is None
 
-            # Test non-existent course
-            link = store.get_lesson_link("Nonexistent Course", 1)
-            assert link is None
+        # Test non-existent course
+        link = store.get_lesson_link("Nonexistent Course", 1)
+        assert link is None
 
 
 class TestVectorStoreErrorHandling:
@@ -345,10 +375,11 @@ class TestVectorStoreErrorHandling:
     def test_clear_all_data(self):
         """Test clearing all data"""
         with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
+            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5,
+                                embedding_function=FakeEmbeddingFunction())
 
             # Add some data
-            course = Course(title="Test Course", lessons=[])
+            course = Course(title="Test Course", instructor="Test Instructor", course_link="https://example.com/course", lessons=[])
             store.add_course_metadata(course)
 
             # Clear data
@@ -358,25 +389,19 @@ class TestVectorStoreErrorHandling:
             count = store.get_course_count()
             assert count == 0
 
-    def test_add_empty_chunks(self):
+    def test_add_empty_chunks(self, store):
         """Test adding empty chunks list"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            # Should not raise an exception
-            store.add_course_content([])
+        # Should not raise an exception
+        store.add_course_content([])
 
-    def test_search_error_handling(self):
+    def test_search_error_handling(self, store):
         """Test search error handling"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            store = VectorStore(temp_dir, "all-MiniLM-L6-v2", max_results=5)
-
-            # Mock the collection to raise an exception
-            with patch.object(store.course_content, 'query', side_effect=Exception("Test error")):
-                results = store.search("test query")
+        # Mock the collection to raise an exception
+        with patch.object(store.course_content, 'query', side_effect=Exception("Test error")):
+            results = store.search("test query")
 
-                assert results.error is not None
-                assert "Test error" in results.error
+            assert results.error is not None
+            assert "Test error" in results.error
 
 
 class TestVectorStoreDiagnostics:
@@ -399,6 +424,7 @@ class TestVectorStoreDiagnostics:
         except Exception as e:
             pytest.fail(f"ChromaDB installation issue: {e}")
 
+    @requires_embedding_model
     def test_diagnose_embedding_model(self):
         """Test if embedding model can be loaded"""
         try:
@@ -412,6 +438,7 @@ class TestVectorStoreDiagnostics:
         except Exception as e:
             pytest.fail(f"Embedding model loading issue: {e}")
 
+    @requires_embedding_model
     def test_diagnose_vector_store_with_real_config(self):
         """Test VectorStore with real configuration"""
         try:
@@ -431,6 +458,8 @@ class TestVectorStoreDiagnostics:
         except Exception as e:
             pytest.fail(f"Vector store with real config failed: {e}")
 
+    @pytest.mark.integration
+    @requires_embedding_model
     def test_diagnose_real_vector_store_state(self):
         """Test the actual vector store state"""
         try:
@@ -2,8 +2,11 @@ import chromadb
 from chromadb.config import Settings
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
+from functools import lru_cache
 from models import Course, CourseChunk
-from sentence_transformers import SentenceTransformer
+
+# Distinct query texts whose embeddings are kept per store
+QUERY_EMBEDDING_CACHE_SIZE = 1024
 
 @dataclass
 class SearchResults:
@@ -34,7 +37,8 @@ class SearchResults:
 class VectorStore:
     """Vector storage using ChromaDB for course content and metadata"""
     
-    def __init__(self, chroma_path: str, embedding_model: str, max_results: int = 5):
+    def __init__(self, chroma_path: str, embedding_model: str, max_results: int = 5,
+                 embedding_function=None):
         self.max_results = max_results
         # Initialize ChromaDB client
         self.client = chromadb.PersistentClient(
@@ -42,11 +46,18 @@ class VectorStore:
             settings=Settings(anonymized_telemetry=False)
         )
         
-        # Set up sentence transformer embedding function
-        self.embedding_function = chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=embedding_model
-        )
+        # Set up sentence transformer embedding function, unless one is supplied
+        # (e.g. a deterministic fake in tests, which skips loading the model)
+        if embedding_function is None:
+            embedding_function = chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=embedding_model
+            )
+        self.embedding_function = embedding_function
         
+        # Repeated query texts (course names, follow-up searches) skip re-embedding;
+        # cached embeddings are shared, so callers must not modify them
+        self._embed_query = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._compute_query_embedding)
+
         # Create collections for different types of data
         self.course_catalog = self._create_collection("course_catalog")  # Course titles/instructors
         self.course_content = self._create_collection("course_content")  # Actual course material
@@ -58,6 +69,10 @@ class VectorStore:
             embedding_function=self.embedding_function
         )
     
+    def _compute_query_embedding(self, text: str):
+        """Embed a single query text with the collection's embedding function"""
+        return self.embedding_function([text])[0]
+
     def search(self, 
                query: str,
                course_name: Optional[str] = None,
@@ -80,7 +95,8 @@ class VectorStore:
         if course_name:
             course_title = self._resolve_course_name(course_name)
             if not course_title:
-                return SearchResults.empty(f"No course found matching '{course_name}'")
+                # An unknown course is an empty result; error is kept for failed searches
+                return SearchResults(documents=[], metadata=[], distances=[])
         
         # Step 2: Build filter for content search
         filter_dict = self._build_filter(course_title, lesson_number)
@@ -91,7 +107,7 @@ class VectorStore:
         
         try:
             results = self.course_content.query(
-                query_texts=[query],
+                query_embeddings=[self._embed_query(query)],
                 n_results=search_limit,
                 where=filter_dict
             )
@@ -103,7 +119,7 @@ class VectorStore:
         """Use vector search to find best matching course by name"""
         try:
             results = self.course_catalog.query(
-                query_texts=[course_name],
+                query_embeddings=[self._embed_query(course_name)],
                 n_results=1
             )
             
@@ -1,27 +1,29 @@
 #!/usr/bin/env python3
 """Script to format all Python code in the project."""
 
+import os
 import subprocess
 import sys
 from pathlib import Path
 
+from run_quality_checks import changed_py_files
+
 
 def run_command(command: list[str], description: str) -> bool:
     """Run a command and return True if successful."""
     print(f"Running {description}...")
-    try:
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    # Stream output as the tool produces it rather than buffering it until exit
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
+    ) as process:
+        for line in process.stdout:
+            print(line, end="")
+
+    if process.returncode == 0:
         print(f"✓ {description} completed successfully")
-        if result.stdout:
-            print(result.stdout)
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"✗ {description} failed")
-        if e.stdout:
-            print(e.stdout)
-        if e.stderr:
-            print(e.stderr)
-        return False
+    print(f"✗ {description} failed")
+    return False
 
 
 def main():
@@ -30,13 +32,15 @@ def main():
 
     print("Starting code formatting and quality checks...")
 
-    # Commands to run
+    # With CHANGED_ONLY=1, only files changed since origin/main are formatted
+    targets = (changed_py_files() if os.environ.get("CHANGED_ONLY") == "1" else []) or ["."]
+
+    # Commands to run; the formatters rewrite files in place, so a separate
+    # check pass beforehand would only parse the whole tree a second time
     commands = [
-        (["python", "-m", "black", ".", "--check"], "Black format check"),
-        (["python", "-m", "black", "."], "Black formatting"),
-        (["python", "-m", "isort", ".", "--check-only"], "Import sorting check"),
-        (["python", "-m", "isort", "."], "Import sorting"),
-        (["python", "-m", "flake8", "."], "Flake8 linting"),
+        (["python", "-m", "black", *targets], "Black formatting"),
+        (["python", "-m", "isort", *targets], "Import sorting"),
+        (["python", "-m", "flake8", *targets], "Flake8 linting"),
     ]
 
     success_count = 0
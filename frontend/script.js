@@ -89,7 +89,7 @@ async function sendMessage() {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 
     try {
-        const response = await fetch(`${API_URL}/query`, {
+        const response = await fetch(`${API_URL}/query/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -102,16 +102,59 @@ async function sendMessage() {
 
         if (!response.ok) throw new Error('Query failed');
 
-        const data = await response.json();
-        
-        // Update session ID if new
-        if (!currentSessionId) {
-            currentSessionId = data.session_id;
-        }
+        // Read newline-delimited JSON events, rendering the answer as it arrives
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        let answer = '';
+        let messageDiv = null;
+        let renderPending = false;
 
-        // Replace loading message with response
-        loadingMessage.remove();
-        addMessage(data.answer, 'assistant', data.sources);
+        // Re-render the partial answer at most once per frame, however many deltas arrive
+        const scheduleRender = () => {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(() => {
+                renderPending = false;
+                if (!messageDiv) return;
+                messageDiv.querySelector('.message-content').innerHTML = marked.parse(answer);
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            });
+        };
+
+        const handleEvent = (event) => {
+            if (event.type === 'text') {
+                answer += event.text;
+                if (!messageDiv) {
+                    loadingMessage.remove();
+                    messageDiv = document.getElementById(`message-${addMessage(answer, 'assistant')}`);
+                } else {
+                    scheduleRender();
+                }
+            } else if (event.type === 'done') {
+                // Update session ID if new
+                if (!currentSessionId) {
+                    currentSessionId = event.session_id;
+                }
+                if (messageDiv) messageDiv.remove();
+                messageDiv = null;
+                loadingMessage.remove();
+                addMessage(answer, 'assistant', event.sources);
+            } else if (event.type === 'error') {
+                throw new Error(event.detail);
+            }
+        };
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+        }
+        if (buffered.trim()) handleEvent(JSON.parse(buffered));
 
     } catch (error) {
         // Replace loading message with error
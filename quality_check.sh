@@ -15,6 +15,6 @@ echo "🔎 Running Flake8 linter..."
 python -m flake8 . || (echo "❌ Linting issues found." && exit 1)
 
 echo "🔍 Running MyPy type checker..."
-python -m mypy backend/ || echo "⚠️  Type checking issues found (non-blocking)"
+python -m mypy backend/ --cache-dir=.mypy_cache --sqlite-cache || echo "⚠️  Type checking issues found (non-blocking)"
 
 echo "✅ All code quality checks passed!"
\ No newline at end of file